@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Measures the latency between a K1 alarm being handled by the hub and a local consumer receiving it, over the Unix
+socket sink and over MQTT through a broker on localhost.
+
+    $ python benchmarks/alarm_latency.py --rounds 200
+"""
+import argparse
+import logging
+import statistics
+import tempfile
+import time
+
+import anyio
+from distmqtt.broker import create_broker
+from distmqtt.client import open_mqttclient
+
+from elro.capture import ReplayTransport
+from elro.command import Command
+from elro.device import create_device_from_data
+from elro.hub import Hub
+from elro.mqtt import MQTTPublisher
+from elro.sink import UnixSocketSink
+
+
+def alarm_data(device_id):
+    return {"data": {"cmdId": Command.DEVICE_ALARM_TRIGGER.value,
+                     "answer_content": f"000BAD{device_id:04X}01010464AA00"}}
+
+
+def create_hub():
+    hub = Hub("127.0.0.1", 1025, "ST_aaaaaaaaaaaa")
+    hub.sock = ReplayTransport()
+    hub.devices[1] = create_device_from_data({"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                                                       "device_name": "0101",
+                                                       "device_ID": 1,
+                                                       "device_status": "0464AA00"}})
+    return hub
+
+
+async def measure_unix_socket(rounds):
+    hub = create_hub()
+    latencies = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = f"{directory}/elro.sock"
+        sink = UnixSocketSink(path)
+        async with anyio.create_task_group() as task_group:
+            await task_group.start(sink.handle_hub_events, hub)
+            async with await anyio.connect_unix(path) as stream:
+                while not sink.clients:
+                    await anyio.sleep(0.001)
+                for _ in range(rounds):
+                    sent_at = time.perf_counter()
+                    await hub.handle_command(alarm_data(1))
+                    received = b""
+                    while not received.endswith(b"\n"):
+                        received += await stream.receive()
+                    latencies.append(time.perf_counter() - sent_at)
+            task_group.cancel_scope.cancel()
+    return latencies
+
+
+async def measure_mqtt(rounds, port):
+    hub = create_hub()
+    publisher = MQTTPublisher(f"mqtt://127.0.0.1:{port}", False, "/bench")
+    latencies = []
+    config = {"listeners": {"default": {"type": "tcp", "bind": f"127.0.0.1:{port}"}}, "sys_interval": 0}
+    async with create_broker(config), open_mqttclient(uri=f"mqtt://127.0.0.1:{port}") as client:
+        async with client.subscription(publisher.topic_name(hub.devices[1])) as subscription:
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(publisher.device_alarm_task, hub.devices[1])
+                await anyio.sleep(0.1)
+                messages = subscription.__aiter__()
+                for _ in range(rounds):
+                    sent_at = time.perf_counter()
+                    await hub.handle_command(alarm_data(1))
+                    await messages.__anext__()
+                    latencies.append(time.perf_counter() - sent_at)
+                task_group.cancel_scope.cancel()
+    return latencies
+
+
+def report(sink, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{sink:12} alarms={len(latencies):6} "
+          f"mean={statistics.mean(latencies) * 1e3:8.2f} ms "
+          f"p50={statistics.median(latencies) * 1e3:8.2f} ms "
+          f"p95={p95 * 1e3:8.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200, help="The number of alarms per sink.")
+    parser.add_argument("--port", type=int, default=18830, help="The port of the local MQTT broker.")
+    args = parser.parse_args()
+    logging.getLogger("distmqtt").setLevel(logging.ERROR)
+
+    report("unix socket", anyio.run(measure_unix_socket, args.rounds, backend="trio"))
+    report("mqtt", anyio.run(measure_mqtt, args.rounds, args.port, backend="trio"))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Measures the latency between a K1 status datagram being handled by the hub and a waiting consumer
+receiving the device update event, on every anyio backend.
+
+    $ python benchmarks/event_latency.py --rounds 2000
+"""
+import argparse
+import statistics
+import time
+
+import anyio
+
+from elro.command import Command
+from elro.device import create_device_from_data
+from elro.hub import Hub
+
+
+def status_data(device_id, state):
+    return {"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                     "device_name": "0101",
+                     "device_ID": device_id,
+                     "device_status": f"0464{state}00"}}
+
+
+async def measure(rounds):
+    hub = Hub("127.0.0.1", 1025, "ST_aaaaaaaaaaaa")
+    hub.devices[1] = create_device_from_data(status_data(1, "AA"))
+    device = hub.devices[1]
+
+    latencies = []
+    sent_at = [0.0]
+    received = anyio.Event()
+
+    async def consumer():
+        while True:
+            await device.updated.wait()
+            latencies.append(time.perf_counter() - sent_at[0])
+            received.set()
+
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(consumer)
+        await anyio.sleep(0)
+        for i in range(rounds):
+            received = anyio.Event()
+            sent_at[0] = time.perf_counter()
+            await hub.handle_command(status_data(1, "55" if i % 2 else "AA"))
+            await received.wait()
+        task_group.cancel_scope.cancel()
+
+    hub.sock.close()
+    return latencies
+
+
+def report(backend, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{backend:8} events={len(latencies):6} "
+          f"mean={statistics.mean(latencies) * 1e6:8.1f} us "
+          f"p50={statistics.median(latencies) * 1e6:8.1f} us "
+          f"p95={p95 * 1e6:8.1f} us")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=1000, help="The number of status updates per backend.")
+    parser.add_argument("--backend", action="append", choices=["trio", "asyncio"],
+                        help="The backend to measure, can be repeated. Defaults to all backends.")
+    args = parser.parse_args()
+
+    for backend in args.backend or ["trio", "asyncio"]:
+        report(backend, anyio.run(measure, args.rounds, backend=backend))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Measures how the number of handled K1 datagrams per second scales with the number of worker processes. The same
+fleet of hubs is sharded over 1, 2, 4, ... workers like elro/fleet.py does, and every hub decodes a burst of status
+datagrams.
+
+    $ python benchmarks/fleet_scaling.py --hubs 16 --datagrams 2000 --workers 1 --workers 2 --workers 4
+"""
+import argparse
+import multiprocessing
+import time
+
+import anyio
+
+from elro.capture import ReplayTransport
+from elro.fleet import shard
+from elro.hub import Hub
+
+
+def status_datagram(msg_id, hub_id, state):
+    return (f'{{"msgId": {msg_id}, "action": "devSend", "params": {{"devTid": "{hub_id}", "appTid": [], "data": '
+            f'{{"cmdId": 19, "device_ID": {msg_id % 8 + 1}, "device_name": "0013", '
+            f'"device_status": "0464{state}00"}}}}}}').encode("utf-8")
+
+
+async def handle_datagrams(hub_ids, datagrams):
+    hubs = []
+    for hub_id in hub_ids:
+        hub = Hub("127.0.0.1", 1025, hub_id)
+        hub.sock = ReplayTransport()
+        hubs.append(hub)
+
+    for msg_id in range(datagrams):
+        for hub in hubs:
+            await hub.handle_datagram(status_datagram(msg_id, hub.id, "55" if msg_id % 2 else "AA"))
+    return datagrams * len(hubs)
+
+
+def run_worker(args):
+    hub_ids, datagrams = args
+    return anyio.run(handle_datagrams, hub_ids, datagrams, backend="trio")
+
+
+def measure(workers, hubs, datagrams):
+    hub_ids = [f"ST_{index:012x}" for index in range(hubs)]
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers) as pool:
+        pool.map(run_worker, [([], 0)] * workers)  # start the processes before the measurement
+        started = time.perf_counter()
+        handled = sum(pool.map(run_worker, [(hub_shard, datagrams) for hub_shard in shard(hub_ids, workers)]))
+        elapsed = time.perf_counter() - started
+    print(f"workers={workers:3} hubs={hubs:4} datagrams={handled:8} "
+          f"elapsed={elapsed:7.2f} s rate={handled / elapsed:9.0f} datagrams/s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hubs", type=int, default=16, help="The number of hubs in the fleet.")
+    parser.add_argument("--datagrams", type=int, default=1000, help="The number of datagrams per hub.")
+    parser.add_argument("--workers", type=int, action="append",
+                        help="The number of worker processes, can be repeated. Defaults to 1, 2 and 4.")
+    args = parser.parse_args()
+
+    for workers in args.workers or [1, 2, 4]:
+        measure(workers, args.hubs, args.datagrams)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Measures the memory of a hub with 10, 100 and 1000 devices and the publisher tasks of the devices with tracemalloc,
+on every anyio backend.
+
+    $ python benchmarks/memory_footprint.py --devices 10 --devices 100 --devices 1000
+"""
+import argparse
+
+import anyio
+
+from elro.footprint import measure_footprint
+
+
+def report(backend, result):
+    print(f"{backend:8} devices={result['devices']:5} "
+          f"devices={result['device_bytes'] / 1024:9.1f} KiB ({result['bytes_per_device']:7.0f} B/device) "
+          f"tasks={result['task_bytes'] / 1024:9.1f} KiB ({result['bytes_per_task']:7.0f} B/task)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, action="append",
+                        help="The number of devices, can be repeated. Defaults to 10, 100 and 1000.")
+    parser.add_argument("--backend", action="append", choices=["trio", "asyncio"],
+                        help="The backend to measure, can be repeated. Defaults to all backends.")
+    args = parser.parse_args()
+
+    for devices in args.devices or [10, 100, 1000]:
+        for backend in args.backend or ["trio", "asyncio"]:
+            report(backend, anyio.run(measure_footprint, devices, backend=backend))
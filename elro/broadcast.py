@@ -0,0 +1,53 @@
+import anyio
+
+
+class Broadcast:
+    """
+    A versioned change notification. Every change increases the version, a subscriber waits for the changes since
+    the version it saw last, so it never misses a change, even when it was busy while the change happened. An Event
+    is only allocated when someone is waiting.
+
+        version = device.updated.version
+        while True:
+            version = await device.updated.wait(version)
+            ...
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.version = 0
+        self._changed = None
+
+    def notify(self):
+        """
+        Announces a change, and wakes up the waiting subscribers
+        """
+        self.version += 1
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    async def wait(self, since=None):
+        """
+        Waits for a change
+        :param since: The version the subscriber saw last, None to wait for the next change
+        :return: The current version, it is more than one higher than since when changes happened in between
+        """
+        since = self.version if since is None else since
+        while self.version <= since:
+            if self._changed is None:
+                self._changed = anyio.Event()
+            await self._changed.wait()
+        return self.version
+
+    async def subscribe(self, since=None):
+        """
+        Iterates over the changes
+        :param since: The version the subscriber saw last, None to start with the next change
+        :return: An async iterator of the versions
+        """
+        version = self.version if since is None else since
+        while True:
+            version = await self.wait(version)
+            yield version
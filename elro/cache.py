@@ -0,0 +1,63 @@
+import logging
+import json
+import os
+
+
+def default_cache_path():
+    """
+    The default path of the cache file, in the user's cache directory
+    :return: The path
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "elro", "hub_ids.json")
+
+
+class HubIdCache:
+    """
+    Caches the resolved K1 ids on disk by hostname, so the MAC address lookup is only needed once
+    """
+    def __init__(self, path=None):
+        """
+        Constructor
+        :param path: The path of the cache file, defaults to default_cache_path()
+        """
+        self.path = default_cache_path() if path is None else path
+
+    def _read(self):
+        """
+        Reads the cache file
+        :return: A dict with the ids by hostname
+        """
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            logging.warning(f"Unable to read the hub id cache '{self.path}': {error}")
+            return {}
+
+    def get(self, hostname):
+        """
+        Gets the cached id of a hub
+        :param hostname: The hostname or ip of the K1
+        :return: The id, or None when the id is not cached
+        """
+        return self._read().get(hostname)
+
+    def set(self, hostname, hub_id):
+        """
+        Stores the id of a hub
+        :param hostname: The hostname or ip of the K1
+        :param hub_id: The id of the K1
+        """
+        ids = self._read()
+        ids[hostname] = hub_id
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as cache_file:
+                json.dump(ids, cache_file)
+            os.replace(tmp_path, self.path)
+        except OSError as error:
+            logging.warning(f"Unable to write the hub id cache '{self.path}': {error}")
@@ -0,0 +1,116 @@
+import logging
+import struct
+import time
+
+import anyio
+
+MAGIC = b"ELROCAP1"
+# A record is the monotonic timestamp, the direction and the length, followed by the datagram
+RECORD = struct.Struct("<dBH")
+
+RECEIVED = 0
+SENT = 1
+
+
+class CaptureWriter:
+    """
+    Appends the datagrams of a hub to a capture file, so the traffic can be replayed later
+    """
+    def __init__(self, path):
+        """
+        Constructor
+        :param path: The path of the capture file, an existing capture is appended to
+        """
+        self.path = path
+        self.records = 0
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def record(self, direction, data):
+        """
+        Appends a datagram
+        :param direction: RECEIVED or SENT
+        :param data: The bytes of the datagram
+        """
+        self.file.write(RECORD.pack(time.monotonic(), direction, len(data)))
+        self.file.write(data)
+        self.file.flush()
+        self.records += 1
+
+    def close(self):
+        """
+        Closes the capture file
+        """
+        self.file.close()
+
+
+def read_capture(path):
+    """
+    Reads the records of a capture file. A record that is cut off (e.g. by a crash while writing) ends the capture.
+    :param path: The path of the capture file
+    :return: An iterator of tuples with the timestamp, the direction and the bytes of the datagrams
+    :raises ValueError: When the file is not a capture file
+    """
+    with open(path, "rb") as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{path}' is not an elro capture file")
+
+        while True:
+            header = capture.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            timestamp, direction, length = RECORD.unpack(header)
+            data = capture.read(length)
+            if len(data) < length:
+                logging.warning(f"Capture '{path}' ends with an incomplete record")
+                break
+            yield timestamp, direction, data
+
+
+class ReplayTransport:
+    """
+    Takes the place of the UDPTransport of a hub during a replay. Nothing is sent, the datagrams the hub
+    would send are kept so they can be compared with the capture.
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.sent = []
+
+    async def sendto(self, data, address):
+        """
+        Keeps a datagram instead of sending it
+        :param data: The bytes to send
+        :param address: A tuple with the host and the port to send to
+        :return: The number of bytes
+        """
+        self.sent.append(data)
+        return len(data)
+
+    def close(self):
+        """
+        Closes the transport
+        """
+
+
+async def replay(hub, path, speed=1.0):
+    """
+    Feeds the received datagrams of a capture to a hub, with the timing of the capture
+    :param hub: The hub to feed, usually with a ReplayTransport
+    :param path: The path of the capture file
+    :param speed: The speed factor of the replay, 0 replays as fast as possible
+    :return: The number of datagrams that are replayed
+    """
+    count = 0
+    previous = None
+    for timestamp, direction, data in read_capture(path):
+        if direction != RECEIVED:
+            continue
+        if speed > 0 and previous is not None:
+            await anyio.sleep(max(0.0, timestamp - previous) / speed)
+        previous = timestamp
+        await hub.handle_datagram(data)
+        count += 1
+    return count
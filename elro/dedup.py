@@ -0,0 +1,56 @@
+import collections
+import time
+
+
+class DuplicateFilter:
+    """
+    Remembers the most recently seen datagrams of the K1, so retransmissions of a frame
+    (the K1 resends when it does not get APP_answer_OK in time) can be recognized
+    """
+    def __init__(self, size=64, max_age=30):
+        """
+        Constructor
+        :param size: The maximum number of datagrams to remember
+        :param max_age: The number of seconds a datagram is remembered
+        """
+        self.size = size
+        self.max_age = max_age
+        self._seen = collections.OrderedDict()
+
+    def is_duplicate(self, msg_id, payload):
+        """
+        Checks if a datagram was seen before, and remembers it otherwise
+        :param msg_id: The msgId of the datagram, None when the datagram has no msgId
+        :param payload: The raw payload of the datagram
+        :return: True if the same datagram was seen within the window
+        """
+        if msg_id is None:
+            return False
+
+        now = time.monotonic()
+        self._expire(now)
+
+        key = (msg_id, hash(payload))
+        if key in self._seen:
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+            return True
+
+        self._seen[key] = now
+        if len(self._seen) > self.size:
+            self._seen.popitem(last=False)
+        return False
+
+    def _expire(self, now):
+        """
+        Forgets the datagrams that are older than max_age
+        :param now: The current monotonic time
+        """
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if now - seen_at <= self.max_age:
+                break
+            del self._seen[key]
+
+    def __len__(self):
+        return len(self._seen)
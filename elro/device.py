@@ -3,7 +3,7 @@ from abc import ABC, abstractmethod
 import logging
 import json
 
-import trio
+from elro.broadcast import Broadcast
 
 
 class DeviceType(Enum):
@@ -69,8 +69,8 @@ class Device(ABC):
         self._device_state = ""
         self.device_type_id = device_type_id
         self.device_type = DeviceType(self.device_type_id)
-        self.updated = trio.Event()
-        self.alarm = trio.Event()
+        self.updated = Broadcast()
+        self.alarm = Broadcast()
 
     @property
     def name(self):
@@ -82,6 +82,8 @@ class Device(ABC):
 
     @name.setter
     def name(self, name):
+        if name == self._name:
+            return
         self._name = name
         self._send_update_event()
 
@@ -126,18 +128,16 @@ class Device(ABC):
 
     def _send_update_event(self):
         """
-        Triggers the self.updated event
+        Notifies the subscribers of self.updated
         """
-        self.updated.set()
-        self.updated = trio.Event()
+        self.updated.notify()
 
     def send_alarm_event(self, data):
         """
-        Triggers the self.alarm event.
+        Notifies the subscribers of self.alarm.
         """
         self.update(data)
-        self.alarm.set()
-        self.alarm = trio.Event()
+        self.alarm.notify()
 
     def update(self, data):
         """
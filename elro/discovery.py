@@ -0,0 +1,99 @@
+import logging
+import dataclasses
+import ipaddress
+import re
+
+import anyio
+
+from elro.transport import UDPTransport
+
+# The handshake of Hub.connect without a hub id, a K1 answers it with its id
+PROBE = b"IOT_KEY?"
+REPLY = re.compile(r"NAME:(ST_[0-9A-Fa-f]{12})")
+
+
+@dataclasses.dataclass(frozen=True)
+class DiscoveredHub:
+    """
+    A K1 that answered the discovery probe
+    """
+    address: str
+    hub_id: str
+    response_time: float
+
+
+def probe_addresses(network):
+    """
+    The addresses to probe for a network
+    :param network: A network like "192.168.1.0/24", or a single (broadcast) address
+    :return: A list with the addresses
+    """
+    network = ipaddress.ip_network(network, strict=False)
+    if network.num_addresses == 1:
+        return [str(network.network_address)]
+    return [str(address) for address in network.hosts()]
+
+
+def parse_reply(data):
+    """
+    Reads the hub id from the reply to the probe
+    :param data: The received bytes
+    :return: The hub id, or None when the reply is not from a K1
+    """
+    match = REPLY.search(data.decode("utf-8", errors="replace"))
+    if match is None:
+        return None
+    return match.group(1)
+
+
+async def discover(network="255.255.255.255", port=1025, timeout=2, attempts=2):
+    """
+    Looks for K1 connectors by sending the handshake probe to every address of a network at once and
+    collecting the replies until the timeout
+    :param network: A network like "192.168.1.0/24", or a single (broadcast) address
+    :param port: The port of the K1 (usually 1025)
+    :param timeout: The number of seconds to wait for replies
+    :param attempts: The number of times the probes are sent, spread over the timeout
+    :return: A list with the DiscoveredHub objects, sorted by address
+    """
+    addresses = probe_addresses(network)
+    transport = UDPTransport()
+    transport.enable_broadcast()
+    sent = {}
+    found = {}
+
+    async def receive():
+        while True:
+            data, (address, _) = await transport.recvfrom(4096)
+            hub_id = parse_reply(data)
+            if hub_id is None or address in found:
+                continue
+
+            # A reply to a broadcast comes from another address than the probe was sent to
+            response_time = anyio.current_time() - sent.get(address, min(sent.values()))
+            found[address] = DiscoveredHub(address, hub_id, response_time)
+            logging.info(f"Found k1 '{hub_id}' at '{address}' in {response_time * 1000:.1f} ms")
+            if all(address in found for address in addresses):
+                task_group.cancel_scope.cancel()
+
+    async def probe():
+        for _ in range(attempts):
+            for address in addresses:
+                if address not in found:
+                    sent.setdefault(address, anyio.current_time())
+                    try:
+                        await transport.sendto(PROBE, (address, port))
+                    except OSError as error:
+                        logging.debug(f"Unable to probe '{address}': {error}")
+            await anyio.sleep(timeout / attempts)
+
+    logging.info(f"Probing {len(addresses)} addresses for k1 connectors")
+    try:
+        with anyio.move_on_after(timeout):
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(receive)
+                task_group.start_soon(probe)
+    finally:
+        transport.close()
+
+    return sorted(found.values(), key=lambda hub: ipaddress.ip_address(hub.address))
@@ -0,0 +1,168 @@
+import collections
+import dataclasses
+import itertools
+import logging
+import time
+
+import anyio
+
+
+@dataclasses.dataclass(frozen=True)
+class HubEvent:
+    """
+    The base of all events of the hub. The sequence number increases by one for every event.
+    """
+    sequence: int
+    timestamp: float
+
+
+@dataclasses.dataclass(frozen=True)
+class HubConnected(HubEvent):
+    """
+    The handshake with the K1 succeeded
+    """
+    hub_id: str
+
+
+@dataclasses.dataclass(frozen=True)
+class HubDisconnected(HubEvent):
+    """
+    The connection with the K1 is lost
+    """
+    hub_id: str
+
+
+@dataclasses.dataclass(frozen=True)
+class DeviceEvent(HubEvent):
+    """
+    The base of all device events, with the state of the device at the time of the event
+    """
+    device_id: int
+    device_type: str
+    name: str
+    state: str
+    battery: int
+    signal: int
+
+
+@dataclasses.dataclass(frozen=True)
+class DeviceAdded(DeviceEvent):
+    """
+    A new device is registered
+    """
+
+
+@dataclasses.dataclass(frozen=True)
+class DeviceUpdated(DeviceEvent):
+    """
+    The state, battery level or signal strength of a device changed
+    """
+
+
+@dataclasses.dataclass(frozen=True)
+class DeviceAlarm(DeviceEvent):
+    """
+    A device triggered an alarm
+    """
+
+
+@dataclasses.dataclass(frozen=True)
+class DeviceNameChanged(DeviceEvent):
+    """
+    The name of a device changed
+    """
+    old_name: str
+
+
+@dataclasses.dataclass(frozen=True)
+class DeviceRemoved(HubEvent):
+    """
+    A device is removed
+    """
+    device_id: int
+
+
+def event_dict(event):
+    """
+    An event as a dict, e.g. to send it as json, with the name of its type in "event"
+    :param event: The HubEvent
+    :return: A dict with the fields of the event
+    """
+    fields = dataclasses.asdict(event)
+    fields["event"] = type(event).__name__
+    return fields
+
+
+def device_fields(device):
+    """
+    The fields of a DeviceEvent for a device
+    :param device: The device
+    :return: A dict with the fields
+    """
+    return {"device_id": device.id,
+            "device_type": device.device_type.name,
+            "name": device.name,
+            "state": device.device_state,
+            "battery": device.battery_level,
+            "signal": device.signal_strength}
+
+
+class EventStream:
+    """
+    A stream of hub events. Every subscriber keeps its own position in the stream, so it receives every event
+    that is published after it subscribed, even when it was busy while the events were published.
+    """
+    def __init__(self, size=1024):
+        """
+        Constructor
+        :param size: The number of events that are kept for subscribers that are behind
+        """
+        self.sequence = 0
+        self._events = collections.deque(maxlen=size)
+        self._published = anyio.Event()
+
+    def publish(self, event_type, **fields):
+        """
+        Publishes a new event
+        :param event_type: The HubEvent class of the event
+        :param fields: The fields of the event, without the sequence and timestamp
+        :return: The published event
+        """
+        self.sequence += 1
+        event = event_type(sequence=self.sequence, timestamp=time.time(), **fields)
+        self._events.append(event)
+        self._published.set()
+        self._published = anyio.Event()
+        return event
+
+    def since(self, sequence):
+        """
+        The kept events after a sequence number
+        :param sequence: The sequence number of the last event that was received
+        :return: A list with the events
+        """
+        if not self._events or sequence >= self.sequence:
+            return []
+
+        first = self._events[0].sequence
+        if sequence + 1 < first:
+            logging.warning(f"Subscriber missed {first - sequence - 1} events, the stream only keeps {len(self._events)}")
+            sequence = first - 1
+        return list(itertools.islice(self._events, sequence + 1 - first, None))
+
+    async def subscribe(self, since=None):
+        """
+        Iterates over the events
+        :param since: The sequence number of the last event that was received, None to start with the
+                      next event
+        :return: An async iterator of events
+        """
+        last = self.sequence if since is None else since
+        while True:
+            events = self.since(last)
+            if not events:
+                await self._published.wait()
+                continue
+            for event in events:
+                last = event.sequence
+                yield event
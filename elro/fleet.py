@@ -0,0 +1,211 @@
+import logging
+import collections
+import json
+import multiprocessing
+import os
+import queue
+
+import anyio
+
+
+def load_fleet(path):
+    """
+    Reads the hubs of a fleet from a json file with a list of objects with the "hostname" and the "id" of every
+    K1, and optionally its "port" and "base_topic"
+    :param path: The path of the fleet file
+    :return: A list with dicts with the hubs
+    :raises ValueError: When the file is not a valid fleet file
+    """
+    with open(path) as fleet_file:
+        hubs = json.load(fleet_file)
+
+    if not isinstance(hubs, list):
+        raise ValueError(f"The fleet file '{path}' should contain a list of hubs")
+    for hub in hubs:
+        if not isinstance(hub, dict) or "hostname" not in hub or "id" not in hub:
+            raise ValueError(f"Every hub in the fleet file '{path}' needs a hostname and an id, got '{hub}'")
+    return hubs
+
+
+def shard(hubs, workers):
+    """
+    Divides the hubs over the workers, round robin
+    :param hubs: The list of hubs
+    :param workers: The number of workers
+    :return: A list with a list of hubs per worker, without empty lists
+    """
+    return [hubs[index::workers] for index in range(min(workers, len(hubs)))]
+
+
+def worker_report(index, hubs):
+    """
+    The health and metrics of the hubs of a worker, as sent to the coordinator
+    :param index: The index of the worker
+    :param hubs: The Hub objects of the worker
+    :return: A dict with the report
+    """
+    return {"worker": index,
+            "pid": os.getpid(),
+            "hubs": {hub.id: {"connected": hub.connected,
+                              "devices": len(hub.devices),
+                              "counters": dict(hub.metrics.counters)} for hub in hubs}}
+
+
+def run_worker(index, hubs, mqtt_broker, ha_autodiscover, base_topic, reports, backend, report_interval):
+    """
+    The entry point of a worker process, runs its hubs on its own event loop
+    :param index: The index of the worker
+    :param hubs: The list of hub dicts of the worker
+    :param mqtt_broker: The MQTT broker to publish on
+    :param ha_autodiscover: If true, the devices are published for Home Assistant discovery
+    :param base_topic: The base topic, the hubs publish under <base topic>/<hub id> unless they have their own
+    :param reports: The queue to send the reports to the coordinator on
+    :param backend: The async backend to run on
+    :param report_interval: The number of seconds between two reports
+    """
+    logging.basicConfig(format=f'[%(asctime)s] %(levelname)-8s: worker {index}: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.INFO)
+    anyio.run(_worker_main, index, hubs, mqtt_broker, ha_autodiscover, base_topic, reports, report_interval,
+              backend=backend)
+
+
+async def _worker_main(index, hubs, mqtt_broker, ha_autodiscover, base_topic, reports, report_interval):
+    from distmqtt.client import open_mqttclient
+    from elro.hub import Hub
+    from elro.mqtt import MQTTPublisher
+
+    # The hubs of the worker share one MQTT connection
+    uri = mqtt_broker if mqtt_broker.startswith("mqtt://") else f"mqtt://{mqtt_broker}"
+    fleet = []
+    async with open_mqttclient(uri=uri) as client, anyio.create_task_group() as task_group:
+        for config in hubs:
+            hub = Hub(config["hostname"], config.get("port", 1025), config["id"])
+            publisher = MQTTPublisher(mqtt_broker, ha_autodiscover,
+                                      config.get("base_topic", f"{base_topic or ''}/{hub.id}"),
+                                      client=client, hub_id=hub.id)
+            task_group.start_soon(publisher.handle_hub_events, hub, name=f"hub_events_{hub.id}")
+            task_group.start_soon(hub.sender_task, name=f"hub_sender_{hub.id}")
+            task_group.start_soon(hub.receiver_task, name=f"hub_receiver_{hub.id}")
+            fleet.append(hub)
+
+        logging.info(f"Started {len(fleet)} hubs")
+        while True:
+            reports.put(worker_report(index, fleet))
+            await anyio.sleep(report_interval)
+
+
+class FleetCoordinator:
+    """
+    Runs a fleet of hubs sharded over worker processes, so the hubs are not bound to one core. Every worker runs
+    its own event loop and one MQTT connection for its hubs, the coordinator restarts workers that die and
+    aggregates the health and metrics the workers report.
+    """
+    def __init__(self, hubs, workers, mqtt_broker, ha_autodiscover=False, base_topic=None, backend="trio",
+                 report_interval=30):
+        """
+        Constructor
+        :param hubs: The list of hub dicts, see load_fleet()
+        :param workers: The number of worker processes
+        :param mqtt_broker: The MQTT broker to publish on
+        :param ha_autodiscover: If true, the devices are published for Home Assistant discovery
+        :param base_topic: The base topic, the hubs publish under <base topic>/<hub id> unless they have their own
+        :param backend: The async backend of the workers
+        :param report_interval: The number of seconds between two reports of a worker
+        """
+        self.shards = shard(hubs, workers)
+        self.mqtt_broker = mqtt_broker
+        self.ha_autodiscover = ha_autodiscover
+        self.base_topic = base_topic
+        self.backend = backend
+        self.report_interval = report_interval
+
+        self.context = multiprocessing.get_context("spawn")
+        self.queue = self.context.Queue()
+        self.processes = {}
+        self.started = {}
+        self.reports = {}
+        self.restarts = collections.Counter()
+        self.restart_delay = 5
+
+    def start_worker(self, index):
+        """
+        Starts the process of a worker
+        :param index: The index of the worker
+        """
+        process = self.context.Process(target=run_worker,
+                                       args=(index, self.shards[index], self.mqtt_broker, self.ha_autodiscover,
+                                             self.base_topic, self.queue, self.backend, self.report_interval),
+                                       name=f"elro-worker-{index}",
+                                       daemon=True)
+        process.start()
+        self.processes[index] = process
+        self.started[index] = anyio.current_time()
+        logging.info(f"Started worker {index} (pid {process.pid}) with {len(self.shards[index])} hubs")
+
+    def health(self):
+        """
+        The health and metrics of the fleet, aggregated from the last report of every worker
+        :return: A dict with the number of workers and hubs, the connected hubs, the devices and the summed counters
+        """
+        counters = collections.Counter()
+        hubs = {}
+        for report in self.reports.values():
+            hubs.update(report["hubs"])
+        for hub in hubs.values():
+            counters.update(hub["counters"])
+
+        return {"workers": len(self.shards),
+                "alive": sum(1 for process in self.processes.values() if process.is_alive()),
+                "restarts": sum(self.restarts.values()),
+                "hubs": sum(len(hub_shard) for hub_shard in self.shards),
+                "connected": sum(1 for hub in hubs.values() if hub["connected"]),
+                "devices": sum(hub["devices"] for hub in hubs.values()),
+                "counters": dict(counters)}
+
+    def _receive_report(self):
+        """
+        Waits shortly for a report of a worker
+        :return: The report, or None when no report arrived
+        """
+        try:
+            return self.queue.get(timeout=1)
+        except queue.Empty:
+            return None
+
+    async def run(self):
+        """
+        The main loop of the coordinator
+        """
+        for index in range(len(self.shards)):
+            self.start_worker(index)
+
+        logged = anyio.current_time()
+        try:
+            while True:
+                report = await anyio.to_thread.run_sync(self._receive_report)
+                if report is not None:
+                    self.reports[report["worker"]] = report
+
+                for index, process in list(self.processes.items()):
+                    # A worker that keeps failing is not restarted more often than the restart delay
+                    if not process.is_alive() and anyio.current_time() - self.started[index] >= self.restart_delay:
+                        logging.error(f"Worker {index} stopped with exit code {process.exitcode}, restarting it")
+                        self.restarts[index] += 1
+                        self.reports.pop(index, None)
+                        self.start_worker(index)
+
+                if anyio.current_time() - logged >= self.report_interval:
+                    logging.info(f"Fleet health: {json.dumps(self.health())}")
+                    logged = anyio.current_time()
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Stops all workers
+        """
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join(timeout=5)
@@ -0,0 +1,83 @@
+import gc
+import logging
+import tracemalloc
+
+import anyio
+
+from elro.command import Command
+from elro.hub import Hub
+from elro.mqtt import MQTTPublisher
+
+
+def status_data(device_id):
+    """
+    The status datagram data of a fire alarm
+    :param device_id: The id of the device
+    :return: The data dict as handled by Hub.handle_command()
+    """
+    return {"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                     "device_name": "0013",
+                     "device_ID": device_id,
+                     "device_status": "0464AAFF"}}
+
+
+def traced_bytes():
+    """
+    The number of bytes allocated by Python that are still in use, after a garbage collection
+    :return: The number of bytes
+    """
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+async def measure_footprint(devices):
+    """
+    Measures the memory of a hub with devices and the publisher tasks of the devices, with tracemalloc. The devices
+    are added through the status updates of the K1, like on a real hub, so their events and history are included.
+    :param devices: The number of devices
+    :return: A dict with the total bytes of the devices and of the tasks, and the bytes per device and per task
+    """
+    started = tracemalloc.is_tracing()
+    if not started:
+        tracemalloc.start()
+
+    try:
+        hub = Hub("127.0.0.1", 1025, "ST_aaaaaaaaaaaa")
+        publisher = MQTTPublisher("127.0.0.1", False, "/footprint")
+        new_devices = []
+
+        async def collect_new_devices():
+            async for device_id in hub.new_device_receive_ch:
+                new_devices.append(device_id)
+
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(collect_new_devices)
+            await anyio.wait_all_tasks_blocked()
+
+            before = traced_bytes()
+            for device_id in range(1, devices + 1):
+                await hub.handle_command(status_data(device_id))
+            await anyio.wait_all_tasks_blocked()
+            with_devices = traced_bytes()
+
+            # The tasks MQTTPublisher.handle_hub_events starts for every device
+            for device_id in new_devices:
+                task_group.start_soon(publisher.device_update_task, hub.devices[device_id])
+                task_group.start_soon(publisher.device_alarm_task, hub.devices[device_id])
+            await anyio.wait_all_tasks_blocked()
+            with_tasks = traced_bytes()
+
+            task_group.cancel_scope.cancel()
+        hub.sock.close()
+    finally:
+        if not started:
+            tracemalloc.stop()
+
+    tasks = 2 * devices
+    result = {"devices": devices,
+              "device_bytes": with_devices - before,
+              "task_bytes": with_tasks - with_devices,
+              "bytes_per_device": (with_devices - before) / devices,
+              "bytes_per_task": (with_tasks - with_devices) / tasks}
+    logging.debug(f"Footprint of {devices} devices: {result}")
+    return result
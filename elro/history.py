@@ -0,0 +1,121 @@
+import array
+import bisect
+
+
+class DeviceHistory:
+    """
+    The recent samples of one device in fixed size ring buffers. The samples are stored in typed arrays, so a
+    sample takes 11 bytes and the memory is allocated once.
+    """
+    def __init__(self, size=256):
+        """
+        Constructor
+        :param size: The number of samples that are kept
+        """
+        self.size = size
+        self.count = 0
+        self._next = 0
+        self._timestamps = array.array("d", bytes(8 * size))
+        self._states = array.array("B", bytes(size))
+        self._batteries = array.array("b", bytes(size))
+        self._signals = array.array("b", bytes(size))
+        self._state_names = []
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, state, battery, signal):
+        """
+        Adds a sample, the oldest sample is overwritten when the buffer is full
+        :param timestamp: The time of the sample in seconds since the epoch
+        :param state: The state of the device
+        :param battery: The battery level in percent, -1 if unknown
+        :param signal: The signal strength from 0 to 4, -1 if unknown
+        """
+        try:
+            state_index = self._state_names.index(state)
+        except ValueError:
+            self._state_names.append(state)
+            state_index = len(self._state_names) - 1
+
+        self._timestamps[self._next] = timestamp
+        self._states[self._next] = state_index
+        self._batteries[self._next] = max(-1, min(battery, 127))
+        self._signals[self._next] = max(-1, min(signal, 127))
+        self._next = (self._next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def _indexes(self):
+        """
+        The buffer indexes of the samples, oldest first
+        :return: A range or list with the indexes
+        """
+        if self.count < self.size:
+            return range(self.count)
+        return list(range(self._next, self.size)) + list(range(self._next))
+
+    def window(self, since=None, until=None, limit=None):
+        """
+        The samples in a time window
+        :param since: The start of the window in seconds since the epoch, None for the oldest sample
+        :param until: The end of the window in seconds since the epoch, None for the newest sample
+        :param limit: The maximum number of samples, the newest samples are returned
+        :return: A list with dicts with the timestamp, state, battery and signal of the samples, oldest first
+        """
+        indexes = self._indexes()
+        timestamps = [self._timestamps[index] for index in indexes]
+        start = 0 if since is None else bisect.bisect_left(timestamps, since)
+        end = len(indexes) if until is None else bisect.bisect_right(timestamps, until)
+        if limit is not None:
+            start = max(start, end - limit)
+
+        return [{"timestamp": self._timestamps[index],
+                 "state": self._state_names[self._states[index]],
+                 "battery": self._batteries[index],
+                 "signal": self._signals[index]} for index in indexes[start:end]]
+
+
+class HistoryStore:
+    """
+    The recent history of all devices of a hub, recorded from the device events
+    """
+    def __init__(self, size=256):
+        """
+        Constructor
+        :param size: The number of samples that are kept per device
+        """
+        self.size = size
+        self.devices = {}
+
+    def record(self, event):
+        """
+        Adds a sample from a device event
+        :param event: The DeviceEvent
+        """
+        try:
+            history = self.devices[event.device_id]
+        except KeyError:
+            history = self.devices[event.device_id] = DeviceHistory(self.size)
+        history.append(event.timestamp, event.state, event.battery, event.signal)
+
+    def forget(self, device_id):
+        """
+        Removes the history of a device
+        :param device_id: The id of the device
+        """
+        self.devices.pop(device_id, None)
+
+    def query(self, device_id, since=None, until=None, limit=None):
+        """
+        The samples of a device in a time window
+        :param device_id: The id of the device
+        :param since: The start of the window in seconds since the epoch, None for the oldest sample
+        :param until: The end of the window in seconds since the epoch, None for the newest sample
+        :param limit: The maximum number of samples, the newest samples are returned
+        :return: A list with dicts with the timestamp, state, battery and signal of the samples, oldest first
+        """
+        try:
+            history = self.devices[device_id]
+        except KeyError:
+            return []
+        return history.window(since, until, limit)
@@ -1,12 +1,24 @@
 import logging
 import json
+import re
 
-import trio
+import anyio
 from valideer import accepts
 import valideer
 
+from elro.broadcast import Broadcast
+from elro.capture import RECEIVED, SENT
 from elro.command import Command
+from elro.dedup import DuplicateFilter
 from elro.device import create_device_from_data
+from elro.events import EventStream, HubConnected, HubDisconnected, DeviceAdded, DeviceUpdated, DeviceAlarm, DeviceNameChanged, \
+    DeviceRemoved, device_fields
+from elro.history import HistoryStore
+from elro.metrics import Metrics
+from elro.scene import create_scene_from_data
+from elro.scheduler import CommandScheduler
+from elro.transport import UDPTransport
+from elro.watchdog import Watchdog
 from elro.utils import get_string_from_ascii, get_ascii, crc_maker, get_eq_crc
 from elro.validation import hostname, ip_address
 
@@ -16,9 +28,13 @@ class Hub:
     A representation of the K1 Connector (its "Hub") of the Elro Connects system
     """
     APP_ID = '0'
+    # The keys before the handshake, every hub gets its own keys from the handshake reply of its K1
     CTRL_KEY = '0'
     BIND_KEY = '0'
 
+    # The states that can be set on a device, with their status code
+    STATES = {"test alarm": "17", "silence": "00"}
+
     @accepts(ip=valideer.Pattern(f"^(mqtt://)?({ip_address})|({hostname})$"),
              port="integer",
              device_id=valideer.Pattern("^ST_([0-9A-Fa-f]{12})$"))
@@ -32,39 +48,85 @@ class Hub:
         self.ip = ip
         self.port = port
         self.id = device_id
+        self.ctrl_key = Hub.CTRL_KEY
+        self.bind_key = Hub.BIND_KEY
 
         self.devices = {}
         self.unregistered_names = {}
-        self.devices_for_sync = {}
+        # The last status the K1 reported per device id, the status sync sends their CRC so the K1 only reports changes
+        self.device_statuses = {}
+        self.device_names = {}
+        self.names_fetched_at = None
+        self.scenes = {}
+        self.scenes_updated = Broadcast()
         self.connected = False
+        self.synced = anyio.Event()
+        self.last_reply = None
+        self.disconnected_at = None
+
+        # The K1 is polled every 30 seconds, so a silent K1 is considered lost after the reply timeout
+        self.reply_timeout = 75
+        self.reconnect_delay = 1
+        self.max_reconnect_delay = 60
+        # The names rarely change, they are fetched again after the name TTL or when a new device shows up
+        self.name_ttl = 600
+
+        self.event_stream = EventStream()
+        self.history = HistoryStore()
+        self.duplicate_filter = DuplicateFilter()
+        self.metrics = Metrics()
+        self.scheduler = CommandScheduler(self.metrics)
+        self.watchdog = Watchdog(self.metrics)
+        self.health_updated = Broadcast()
 
         self.msg_id = 0
-        self.sock = trio.socket.socket(trio.socket.AF_INET, trio.socket.SOCK_DGRAM)
+        self.sock = UDPTransport()
+        self.capture = None
+
+        # The ids of the new devices for the MQTTPublisher, buffered so a hub without a reader is not blocked
+        self.new_device_send_ch, self.new_device_receive_ch = anyio.create_memory_object_stream(256)
 
-        self.new_device_send_ch, self.new_device_receive_ch = trio.open_memory_channel(0)
+    def events(self, since=None):
+        """
+        The typed events of this hub, e.g. devices that are added, updated or removed, alarms and the connection
+        state. Every consumer gets every event, in order, without MQTT.
+
+            async for event in hub.events():
+                ...
+
+        :param since: The sequence number of the last event that was received, None to start with the next event
+        :return: An async iterator of HubEvent records
+        """
+        return self.event_stream.subscribe(since)
 
     async def sender_task(self):
         """
         The main loop for sending keep alive messages asking for the current status to
         the K1
         """
-        await self.connect()
-        await self.sync_scenes(0)
-        await self.get_device_names()
-
-        logging.info("Waiting until all devices are retreived")
-        await trio.sleep(5)
-        if len(self.devices_for_sync) > 0:  # sync devices when there are devices known by name
-            logging.info(f"Devices where replied, syncing those devices")
-            await self.sync_device_status(self.devices_for_sync)
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(self.scheduler.run, name="hub_scheduler")
 
-        # Main loop, keep updating every 30 seconds. Keeps 'connection' alive in order
-        # to receive alarms/events
-        while True:
-            await trio.sleep(30)  # sleep first to handle the sync scenes and device names
-            await self.sync_devices()
+            await self.connect()
+            task_group.start_soon(self.connection_supervisor, name="hub_supervisor")
+            task_group.start_soon(self.watchdog_task, name="hub_watchdog")
+            await self.sync_scenes(0)
             await self.get_device_names()
 
+            logging.info("Waiting until all devices are retreived")
+            await anyio.sleep(5)
+            if len(self.device_statuses) > 0:  # ask for the devices that were missed by the first sync
+                logging.info(f"Devices where replied, syncing the other devices")
+                await self.poll_device_status()
+
+            # Main loop, keep updating every 30 seconds. Keeps 'connection' alive in order
+            # to receive alarms/events. The polls only go out when no user commands are waiting.
+            while True:
+                await anyio.sleep(30)  # sleep first to handle the sync scenes and device names
+                self.scheduler.schedule("sync_device_status", CommandScheduler.POLL, self.poll_device_status)
+                if self.names_due():
+                    self.request_device_names()
+
     async def receiver_task(self):
         """
         The main loop for receiving data from the K1
@@ -72,16 +134,87 @@ class Hub:
         while True:
             await self.receive_data()
 
+    async def connection_supervisor(self):
+        """
+        The main loop watching the connection with the K1. When the K1 stops replying, or the socket fails,
+        the handshake is repeated with backoff. The devices are kept, so nothing is lost on a reconnect.
+        """
+        while True:
+            await anyio.sleep(self.reply_timeout / 3)
+            if self.connected and anyio.current_time() - self.last_reply > self.reply_timeout:
+                self.set_disconnected(f"no reply for {self.reply_timeout} seconds")
+            if not self.connected:
+                await self.connect()
+
+    async def watchdog_task(self):
+        """
+        The main loop judging the liveness of the K1 from the unanswered polls
+        """
+        while True:
+            await anyio.sleep(1)
+            if self.watchdog.check():
+                self._send_health_updated_event()
+
+    def _send_health_updated_event(self):
+        """
+        Notifies the subscribers of self.health_updated
+        """
+        self.health_updated.notify()
+
     async def connect(self):
         """
-        Connects with the K1
+        Connects with the K1, retrying the handshake with an increasing delay. The commands are buffered until the
+        handshake succeeds.
         """
         print("Start connection with hub.")
+        if not self.connected:
+            self.scheduler.pause()
+        delay = self.reconnect_delay
         while not self.connected:
-            await self.send_data('IOT_KEY?' + self.id)
-            await trio.sleep(1)
+            try:
+                await self.send_data('IOT_KEY?' + self.id)
+            except OSError as error:
+                logging.warning(f"Unable to send the handshake to k1, retrying in {delay} seconds. Error: {error}")
+            await anyio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+        # After a reconnect only the devices that changed during the outage are reported
+        await self.poll_device_status()
+
+    def set_disconnected(self, reason):
+        """
+        Marks the connection with the K1 as lost
+        :param reason: The reason the connection is lost
+        """
+        if not self.connected:
+            return
+
+        logging.warning(f"Lost connection with k1: {reason}")
+        self.connected = False
+        self.disconnected_at = anyio.current_time()
+        self.metrics.increment("hub_disconnects")
+        self.metrics.set_gauge("hub_connected", 0)
+        self.scheduler.pause()
+        self.event_stream.publish(HubDisconnected, hub_id=self.id)
+
+    def _set_connected(self):
+        """
+        Marks the connection with the K1 as established
+        """
+        if self.connected:
+            return
 
-        await self.sync_device_status()
+        if self.disconnected_at is not None:
+            outage = anyio.current_time() - self.disconnected_at
+            self.metrics.increment("hub_reconnects")
+            self.metrics.observe("outage_duration", outage)
+            logging.info(f"Reconnected with k1 after {outage:.1f} seconds")
+            self.disconnected_at = None
+        self.connected = True
+        self.watchdog.reset()
+        self.metrics.set_gauge("hub_connected", 1)
+        self.scheduler.resume()
+        self.event_stream.publish(HubConnected, hub_id=self.id)
 
     def construct_message(self, data):
         """
@@ -93,7 +226,7 @@ class Hub:
 
         result = '{"msgId":' + str(self.msg_id) + \
                  ',"action":"appSend","params":{"devTid":"' + \
-                 self.id + '","ctrlKey":"' + Hub.CTRL_KEY + '","appTid":"' + Hub.APP_ID + '","data":' + data + '}}'
+                 self.id + '","ctrlKey":"' + self.ctrl_key + '","appTid":"' + Hub.APP_ID + '","data":' + data + '}}'
         return result
 
     async def send_data(self, data):
@@ -104,6 +237,8 @@ class Hub:
         logging.info(f"Send data: {data}")
         await self.sock.sendto(bytes(data, "utf-8"),
                                (self.ip, self.port))
+        if self.capture is not None:
+            self.capture.record(SENT, bytes(data, "utf-8"))
 
     async def receive_data(self):
         """
@@ -118,11 +253,22 @@ class Hub:
                 i = i+1
                 if i < 3:
                     logging.warning(f"Unable to connect to k1, retrying again. Error: {Error}")
-                    await trio.sleep(1)
+                    await anyio.sleep(1)
                 else:
                     logging.error(f"Unable to connect to k1 with error: {Error}")
-                    exit()
+                    self.set_disconnected(f"{Error}")
+                    return
 
+        self.last_reply = anyio.current_time()
+        if self.capture is not None:
+            self.capture.record(RECEIVED, data)
+        await self.handle_datagram(data)
+
+    async def handle_datagram(self, data):
+        """
+        Handles a datagram from the K1
+        :param data: The received bytes
+        """
         reply = str(data)[2:-1]
         if reply.endswith('\\n'):
             reply = reply[:-2]
@@ -134,18 +280,23 @@ class Hub:
         if f"NAME:{self.id}" in reply:
             for item in reply.split('\\n'):
                 if f"KEY" in item:
-                    Hub.CTRL_KEY = item.split(':')[1]
-                    logging.info(f"Got ctrlKey '{Hub.CTRL_KEY}'")
+                    self.ctrl_key = item.split(':')[1]
+                    logging.info(f"Got ctrlKey '{self.ctrl_key}'")
                 if f"BIND" in item:
-                    Hub.BIND_KEY = item.split(':')[1]
-                    logging.info(f"Got bindKey '{Hub.BIND_KEY}'")
-            self.connected = True
+                    self.bind_key = item.split(':')[1]
+                    logging.info(f"Got bindKey '{self.bind_key}'")
+            self._set_connected()
 
         if reply.startswith('{') and reply != "{ST_answer_OK}":
             msg = json.loads(reply)
-            dat = msg["params"]
 
-            await self.handle_command(dat)
+            # The K1 resends a frame when the answer was not received in time. Those copies
+            # are answered again, but not processed again.
+            if self.duplicate_filter.is_duplicate(msg.get("msgId"), reply):
+                self.metrics.increment("duplicates_suppressed")
+                logging.debug(f"Suppressed duplicate message with msgId '{msg.get('msgId')}'")
+            else:
+                await self.handle_command(msg["params"])
 
             # Send reply
             await self.send_data('APP_answer_OK')
@@ -159,7 +310,7 @@ class Hub:
         logging.info(f"Process device with data: {data}")
         d_id = data["data"]["device_ID"]
         if data["data"]["device_name"] == 'DEL':
-            await self.remove_device(data, False)
+            await self.remove_device(d_id, False)
             return None
         else:
             dev = create_device_from_data(data)
@@ -169,8 +320,17 @@ class Hub:
             if self.unregistered_names.get(d_id):
                 dev.name = self.unregistered_names[d_id]
                 del self.unregistered_names[d_id]
+            else:
+                self.device_names.pop(d_id, None)
+                if self.names_fetched_at is not None:  # else the first names are still on their way
+                    self.request_device_names()
             self.devices[d_id] = dev
-            await self.new_device_send_ch.send(d_id)
+            self.history.record(self.event_stream.publish(DeviceAdded, **device_fields(dev)))
+            try:
+                self.new_device_send_ch.send_nowait(d_id)
+            except anyio.WouldBlock:
+                logging.warning(f"Dropped new device '{d_id}', the new device channel is full")
+                self.metrics.increment("new_devices_dropped")
             return self.devices[d_id]
 
     async def handle_command(self, data):
@@ -182,17 +342,29 @@ class Hub:
         if data["data"]["cmdId"] == Command.DEVICE_STATUS_UPDATE.value:
             logging.debug(f"Processing cmdId: {data['data']['cmdId']}")
             if data["data"]["device_name"] == "STATUES":
+                # The end of a status sweep, all devices are known after the first one
+                self.synced.set()
+                self.watchdog.replied(Watchdog.STATUS)
+                self._send_health_updated_event()
                 return
 
             # set device ID
             d_id = data["data"]["device_ID"]
             try:
                 dev = self.devices[d_id]
+                if data["data"]["device_name"] == "DEL":  # a device that was deleted on the K1 itself
+                    dev = await self.process_device(data)
             except KeyError:
                 dev = await self.process_device(data)
-            await trio.sleep(0)
+            await anyio.sleep(0)
             if dev is not None:
+                before = device_fields(dev)
                 dev.update(data)
+                self.cache_status(d_id, data["data"]["device_status"])
+                self.metrics.increment("status_reports")
+                after = device_fields(dev)
+                if after != before:
+                    self.history.record(self.event_stream.publish(DeviceUpdated, **after))
 
         elif data["data"]["cmdId"] == Command.DEVICE_ALARM_TRIGGER.value:
             logging.debug(f"Processing cmdId: {data['data']['cmdId']}")
@@ -214,30 +386,33 @@ class Hub:
             except KeyError:
                 logging.warning(f"Got device id '{d_id}', but the device is not yet known. Trying to create the device")
                 dev = await self.process_device(data)
-                await trio.sleep(0)
+                await anyio.sleep(0)
                 if dev is not None:
                     dev.update(data)
 
             dev.send_alarm_event(data)
+            self.cache_status(d_id, d_status)
+            self.history.record(self.event_stream.publish(DeviceAlarm, **device_fields(dev)))
             logging.debug("ALARM!! Device_id " + str(d_id) + "(" + dev.name + ")")
 
         elif data["data"]["cmdId"] == Command.DEVICE_NAME_REPLY.value:
             logging.debug(f"Processing cmdId: {data['data']['cmdId']}")
             answer = data["data"]["answer_content"]
             if answer == "NAME_OVER":
+                self.names_fetched_at = anyio.current_time()
+                self.watchdog.replied(Watchdog.NAMES)
+                self._send_health_updated_event()
                 return
 
             d_id = int(answer[0:4], 16)
-            name_val = get_string_from_ascii(answer[4:])
 
-            # Build a list with known device names by device id
-            try:
-                dev = self.devices_for_sync[d_id]
-            except KeyError:
-                logging.info(f"Unknown name from device id '{d_id}'")
-                self.devices_for_sync[d_id] = "0464AA00"  # Bogus device status
+            # The names are cached as received, so an unchanged name is not decoded and set again
+            if self.device_names.get(d_id) == answer[4:]:
+                self.metrics.increment("names_unchanged")
                 return
-            await trio.sleep(0)
+            self.device_names[d_id] = answer[4:]
+            name_val = get_string_from_ascii(answer[4:])
+            await anyio.sleep(0)
 
             # Set the device name from this reply
             try:
@@ -245,8 +420,54 @@ class Hub:
             except KeyError:
                 self.unregistered_names[d_id] = name_val
                 return
-            await trio.sleep(0)
+            await anyio.sleep(0)
+            old_name = dev.name
             dev.name = name_val
+            if name_val != old_name:
+                self.event_stream.publish(DeviceNameChanged, old_name=old_name, **device_fields(dev))
+
+        elif data["data"]["cmdId"] == Command.SCENE_STATUS_UPDATE.value:
+            logging.debug(f"Processing cmdId: {data['data']['cmdId']}")
+            scene = create_scene_from_data(data)
+            if scene is None:
+                return
+
+            if scene.name == "DEL" or scene.name == "":
+                self.scenes.pop(scene.id, None)
+            else:
+                self.scenes[scene.id] = scene
+            self._send_scenes_updated_event()
+
+    def _send_scenes_updated_event(self):
+        """
+        Notifies the subscribers of self.scenes_updated
+        """
+        self.scenes_updated.notify()
+
+    def scene_by_name(self, name):
+        """
+        Looks up a scene in the scene index by its name
+        :param name: The name of the scene, case insensitive
+        :return: The Scene, or None when there is no scene with the name
+        """
+        for scene in self.scenes.values():
+            if scene.name.lower() == name.lower():
+                return scene
+        return None
+
+    async def trigger_scene(self, scene_id):
+        """
+        Executes a scene on the K1, which replaces sending the commands of all devices in the scene
+        :param scene_id: The id of the scene to execute
+        """
+        if scene_id not in self.scenes:
+            logging.error(f"Trigger scene scene_id '{scene_id}' is not (yet) known")
+            return
+
+        data = '{"cmdId":' + str(Command.SCENE_HANDLE.value) + ',"sence_group":' + str(scene_id) + '}'
+        run = self.construct_message(data)
+        logging.info(f"Trigger scene '{scene_id}' with: {run}")
+        await self.send_data(run)
 
     async def sync_scenes(self, group_nr):
         """
@@ -260,10 +481,12 @@ class Hub:
 
     async def sync_devices(self):
         """
-        Sends a sync devices command to the K1
+        Sends a sync devices command to the K1, it answers with the status of all devices. The hub polls with
+        poll_device_status(), this is only for a manual full resync, e.g. when the cached statuses are not trusted
         """
         msg = self.construct_message('{"cmdId":' + str(Command.GET_ALL_EQUIPMENT_STATUS.value) + ',"device_status":""}')
         logging.info("sync devices")
+        self.watchdog.sent(Watchdog.STATUS)
         await self.send_data(msg)
 
     async def get_device_names(self):
@@ -271,56 +494,114 @@ class Hub:
         Sends a get device names command to the K1
         """
         msg = self.construct_message('{"cmdId":' + str(Command.GET_DEVICE_NAME.value) + ',"device_ID":0}')
+        self.watchdog.sent(Watchdog.NAMES)
         await self.send_data(msg)
 
-    async def set_device_state(self, device_id, status):
+    def names_due(self):
+        """
+        Checks if the cached device names are older than the name TTL
+        :return: True if the names should be fetched again
+        """
+        return self.names_fetched_at is None or anyio.current_time() - self.names_fetched_at >= self.name_ttl
+
+    def request_device_names(self):
         """
-        Sets the device to the specified state
+        Schedules fetching the device names, requests that arrive together are merged into one
+        """
+        self.scheduler.schedule("get_device_names", CommandScheduler.POLL, self.get_device_names)
+
+    def device_state_data(self, device_id, status):
+        """
+        Builds the data of a set device state command
         :param device_id: The id of the device to change the state, 0 for all or the gateway(?)
         :param status: The status to set the device to
+        :return: The data to construct the message with
+        :raises ValueError: When the command is not valid
         """
         if status == "00" and device_id == 0:  # only allow the command silence for device id 0
             pass
-        else:
-            try:
-                dev = self.devices[device_id]
-            except KeyError:
-                logging.error(f"Set device state device_id '{device_id}' is not (yet) known")
-                return
+        elif device_id not in self.devices:
+            raise ValueError(f"device_id '{device_id}' is not (yet) known")
+
+        return '{"cmdId":' + str(Command.EQUIPMENT_CONTROL.value) + ',"device_ID":' + str(device_id) + ',"device_status":"' + str(status) + '000000"}'
+
+    async def set_device_state(self, device_id, status):
+        """
+        Sets the device to the specified state. It is sent right away, without the command buffer of the scheduler
+        :param device_id: The id of the device to change the state, 0 for all or the gateway(?)
+        :param status: The status to set the device to
+        """
+        try:
+            data = self.device_state_data(device_id, status)
+        except ValueError as error:
+            logging.error(f"Set device state {error}")
+            return
 
-        data = '{"cmdId":' + str(Command.EQUIPMENT_CONTROL.value) + ',"device_ID":' + str(device_id) + ',"device_status":"' + str(status) + '000000"}'
         run = self.construct_message(data)
         logging.info(f"Set device '{device_id}' state with: {run}")
         await self.send_data(run)
 
-    async def set_device_name(self, device_id, device_name):
+    def device_name_data(self, device_id, device_name):
         """
-        Sets the device name
+        Builds the data of a set device name command
         :param device_id: The id of the device to change the name of
         :param device_name: The new name of the device
+        :return: The data to construct the message with
+        :raises ValueError: When the command is not valid
         """
-        try:
-            dev = self.devices[device_id]
-        except KeyError:
-            logging.error(f"Set device name device_id '{device_id}' is not (yet) known")
-            return
+        if device_id not in self.devices:
+            raise ValueError(f"device_id '{device_id}' is not (yet) known")
 
         try:
             data = get_ascii(device_name)
         except Exception as error:
-            logging.error(f"Unable to set device_name for '{device_id}' with error: {error}")
-            return
-        
-        if len(data) == 0:
-            logging.error(f"Unable to set device_name for '{device_id}', there is no hex string")
-            return
+            raise ValueError(f"Unable to set device_name for '{device_id}' with error: {error}")
+
+        if not data:
+            raise ValueError(f"Unable to set device_name for '{device_id}', there is no hex string")
 
         crc = crc_maker(data)
         datacrc = data + crc
-        data = '{"cmdId":' + str(Command.MODIFY_EQUIPMENT_NAME.value) + ',"device_ID":' + str(device_id) + ',"device_name":"' + str(datacrc) + '"}'
+        return '{"cmdId":' + str(Command.MODIFY_EQUIPMENT_NAME.value) + ',"device_ID":' + str(device_id) + ',"device_name":"' + str(datacrc) + '"}'
+
+    async def set_device_name(self, device_id, device_name):
+        """
+        Sets the device name. It is sent right away, without the command buffer of the scheduler
+        :param device_id: The id of the device to change the name of
+        :param device_name: The new name of the device
+        """
+        try:
+            data = self.device_name_data(device_id, device_name)
+        except ValueError as error:
+            logging.error(f"Set device name {error}")
+            return
+
         run = self.construct_message(data)
         logging.info(f"Set device '{device_id}' new name '{device_name}' with: {run}")
         await self.send_data(run)
+        self.device_names.pop(device_id, None)
+        self.request_device_names()
+
+    def cache_status(self, device_id, status):
+        """
+        Remembers the status the K1 reported for a device, for the next status sync
+        :param device_id: The id of the device
+        :param status: The device status as hex string
+        """
+        if not re.fullmatch("[0-9A-Fa-f]{8}", status):
+            logging.warning(f"Not caching the invalid status '{status}' of device '{device_id}'")
+            self.device_statuses.pop(device_id, None)
+            return
+        self.device_statuses[device_id] = status
+
+    async def poll_device_status(self):
+        """
+        Sends a sync device status command with the cached statuses, the K1 answers with the devices of which the
+        status differs, or with all devices when no status is known yet
+        """
+        self.metrics.increment("status_polls")
+        self.metrics.set_gauge("cached_statuses", len(self.device_statuses))
+        await self.sync_device_status(dict(self.device_statuses))
 
     async def sync_device_status(self, devices=None):
         """
@@ -328,11 +609,12 @@ class Hub:
         :param devices: An dictionary of devices statuses, where the id of the device is the index of the dict
         """
         device_status = ""
-        if devices is not None:
+        if devices:
             device_status = get_eq_crc(devices)
         msg = self.construct_message('{"cmdId":' + str(Command.SYN_DEVICE_STATUS.value) + ',"device_status":"' + device_status + '"}')
         logging.info(f"sync device status with '{msg}'")
 
+        self.watchdog.sent(Watchdog.STATUS)
         await self.send_data(msg)
 
     async def remove_device(self, device_id, from_hub=False):
@@ -341,26 +623,34 @@ class Hub:
         :param device_id: The id of the device that will be removed
         :param from_hub: Also send the delete command to the hub
         """
+        self.forget_device(device_id)
+
+        if from_hub:
+            run = self.construct_message(self.remove_device_data(device_id))
+            logging.info(f"Delete device '{device_id}' on the hub with: {run}")
+            await self.send_data(run)
+
+    def forget_device(self, device_id):
+        """
+        Removes everything that is known about a device
+        :param device_id: The id of the device that will be removed
+        """
         logging.info(f"Delete device '{device_id}'")
         # Delete device
         try:
             dev = self.devices[device_id]
             del self.devices[device_id]
+            self.event_stream.publish(DeviceRemoved, device_id=device_id)
+            self.history.forget(device_id)
         except KeyError:
             pass
         except Exception as error:
             logging.error(f"Unhandeld error when deleting device  '{device_id}': {error}")
         
-        # Delete device from devices_for_sync
-        try:
-            dev = self.devices_for_sync[device_id]
-            del self.devices_for_sync[device_id]
-        except KeyError:
-            pass
-        except Exception as error:
-            logging.error(f"Unhandeld error when deleting device from the sync  '{device_id}': {error}")
+        self.device_statuses.pop(device_id, None)
+        self.device_names.pop(device_id, None)
 
-        # Delete device from devices_for_sync
+        # Delete device from unregistered_names
         try:
             dev = self.unregistered_names[device_id]
             del self.unregistered_names[device_id]
@@ -369,11 +659,79 @@ class Hub:
         except Exception as error:
             logging.error(f"Unhandeld error when deleting device from unregistered names  '{device_id}': {error}")
 
-        if from_hub:
-            data = '{"cmdId":' + str(Command.DELETE_EQUIPMENT.value) + ',"device_ID":' + str(device_id) + '}'
+    def remove_device_data(self, device_id):
+        """
+        Builds the data of a delete device command
+        :param device_id: The id of the device that will be removed
+        :return: The data to construct the message with
+        """
+        return '{"cmdId":' + str(Command.DELETE_EQUIPMENT.value) + ',"device_ID":' + str(device_id) + '}'
+
+    async def bulk_update(self, operations):
+        """
+        Applies states, names and removals to many devices in one call. All operations are validated and
+        constructed first, then they are queued at once in the scheduler, which pipelines them to the K1. The
+        operations that the scheduler dropped, because they expired or the buffer was full while the K1 was not
+        connected, are reported as failed.
+        :param operations: A list of dicts with the device "id" and one of "state" (see Hub.STATES),
+                           "name" or "remove" (true)
+        :return: A dict with the "succeeded" operations and the "failed" operations with their error
+        """
+        result = {"succeeded": [], "failed": []}
+        scheduled = []
+        for operation in operations:
+            try:
+                key, device_id, data = self._bulk_operation_data(operation)
+            except (ValueError, KeyError, TypeError, AttributeError) as error:
+                logging.error(f"Bulk operation '{operation}' is invalid: {error}")
+                result["failed"].append({"operation": operation, "error": str(error)})
+                continue
+
+            if key == "remove":
+                self.forget_device(device_id)
+            if key == "name":
+                self.device_names.pop(device_id, None)
+                self.request_device_names()
             run = self.construct_message(data)
-            logging.info(f"Delete device '{device_id}' on the hub with: {run}")
-            await self.send_data(run)
+            logging.info(f"Bulk '{key}' for device '{device_id}' with: {run}")
+            command = self.scheduler.schedule((key, device_id), CommandScheduler.USER, self.send_data, run)
+            scheduled.append((operation, command))
+
+        for operation, command in scheduled:
+            await command.done.wait()
+            if command.expired:
+                logging.error(f"Bulk operation '{operation}' was dropped before it was sent")
+                result["failed"].append({"operation": operation, "error": "Dropped while the K1 was not connected"})
+            else:
+                result["succeeded"].append(operation)
+
+        logging.info(f"Bulk update done, {len(result['succeeded'])} succeeded and {len(result['failed'])} failed")
+        return result
+
+    def _bulk_operation_data(self, operation):
+        """
+        Builds the data of one bulk operation
+        :param operation: The operation dict
+        :return: A tuple with the kind of operation, the device id and the data to construct the message with
+        :raises ValueError: When the operation is not valid
+        """
+        device_id = int(operation["id"])
+        if "name" in operation:
+            return "name", device_id, self.device_name_data(device_id, operation["name"])
+        if "state" in operation:
+            state = operation["state"].lower()
+            if state == "silence" and device_id != 0:  # like the state command, silence is only for device id 0
+                raise ValueError(f"The state 'silence' can only be set for device_id 0, not '{device_id}'")
+            try:
+                status = Hub.STATES[state]
+            except KeyError:
+                raise ValueError(f"Unknown state '{operation['state']}'")
+            return "state", device_id, self.device_state_data(device_id, status)
+        if operation.get("remove") is True:
+            if device_id not in self.devices:  # also rejects device id 0, the K1 itself
+                raise ValueError(f"device_id '{device_id}' is not (yet) known")
+            return "remove", device_id, self.remove_device_data(device_id)
+        raise ValueError("No name, state or remove in the operation")
 
     async def permit_join_device(self):
         """
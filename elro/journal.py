@@ -0,0 +1,214 @@
+import logging
+import collections
+import json
+import mmap
+import os
+import struct
+import zlib
+
+import anyio
+
+from elro.events import DeviceAlarm, DeviceUpdated, event_dict
+
+# A journal record is the length and the CRC32 of the payload, followed by the json payload
+RECORD = struct.Struct("<II")
+# An index entry is the timestamp, the offset of the record in the journal and the device id
+INDEX = struct.Struct("<dQi")
+
+
+class AlarmJournal:
+    """
+    A durable, append-only journal of the alarms and state changes of the devices. The records are framed with
+    their length and CRC32 in "journal.log", a torn record at the end (e.g. after a crash) is cut off when the
+    journal is opened. A fixed size index in "journal.idx" is memory-mapped for the queries, so a time window is
+    found with a binary search instead of scanning the journal. The records are written in a worker thread, so
+    the receive loop never waits for the disk.
+    """
+    EVENTS = (DeviceAlarm, DeviceUpdated)
+
+    def __init__(self, directory, read_only=False):
+        """
+        Constructor
+        :param directory: The directory of the journal, it is created when it does not exist
+        :param read_only: Only query the journal, e.g. while a bridge is writing to it. The files are not
+                          recovered or written, a record that is still being written is skipped by its CRC
+        """
+        self.directory = directory
+        self.read_only = read_only
+        self.log_path = os.path.join(directory, "journal.log")
+        self.index_path = os.path.join(directory, "journal.idx")
+
+        self._pending = collections.deque()
+        self._wakeup = anyio.Event()
+        self.log = None
+        self.index = None
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+            self._recover()
+            self.log = open(self.log_path, "ab")
+            self.index = open(self.index_path, "ab")
+
+    def _recover(self):
+        """
+        Makes the journal and its index consistent after a crash: a torn record at the end of the journal is
+        cut off, index entries of lost records are removed and records without index entry are indexed
+        """
+        with open(self.log_path, "a+b") as log, open(self.index_path, "a+b") as index:
+            log.seek(0)
+            index.seek(0)
+            entries = index.read()
+
+            # The records are written before their index entries, so only the tail of the index can be lost
+            count = len(entries) // INDEX.size
+            end = 0
+            while count > 0:
+                _, offset, _ = INDEX.unpack_from(entries, (count - 1) * INDEX.size)
+                record, record_end = self._read_record(log, offset)
+                if record is not None:
+                    end = record_end
+                    break
+                count -= 1
+
+            recovered = []
+            while True:
+                record, record_end = self._read_record(log, end)
+                if record is None:
+                    break
+                recovered.append(INDEX.pack(record["timestamp"], end, record["device_id"]))
+                end = record_end
+
+            log.truncate(end)
+            index.truncate(count * INDEX.size)
+            index.write(b"".join(recovered))
+            if recovered:
+                logging.warning(f"Recovered {len(recovered)} records without index entry in the journal")
+
+    @staticmethod
+    def _read_record(log, offset):
+        """
+        Reads a record, and verifies it
+        :param log: The journal file
+        :param offset: The offset of the record
+        :return: A tuple with the record dict and the offset after the record, the dict is None when there is no
+        valid record at the offset
+        """
+        log.seek(offset)
+        header = log.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return None, offset
+        length, crc = RECORD.unpack(header)
+        payload = log.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return None, offset
+        return json.loads(payload), offset + RECORD.size + length
+
+    def append(self, event):
+        """
+        Queues an event for the journal, without waiting for the disk
+        :param event: The DeviceAlarm or DeviceUpdated event
+        """
+        self._pending.append(event_dict(event))
+        self._wakeup.set()
+
+    def _write(self, records):
+        """
+        Writes records to the journal and the index, and flushes them to the disk
+        :param records: A list with the record dicts
+        """
+        entries = []
+        for record in records:
+            payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+            entries.append(INDEX.pack(record["timestamp"], self.log.tell(), record["device_id"]))
+            self.log.write(RECORD.pack(len(payload), zlib.crc32(payload)))
+            self.log.write(payload)
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.index.write(b"".join(entries))
+        self.index.flush()
+        os.fsync(self.index.fileno())
+
+    async def writer_task(self):
+        """
+        The main loop writing the queued records, in a worker thread
+        """
+        while True:
+            if not self._pending:
+                await self._wakeup.wait()
+                self._wakeup = anyio.Event()
+                continue
+
+            records = list(self._pending)
+            self._pending.clear()
+            await anyio.to_thread.run_sync(self._write, records)
+
+    async def record_events(self, hub):
+        """
+        Journals the alarms and state changes of a hub
+        :param hub: The hub to journal the events of
+        """
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(self.writer_task, name="journal_writer")
+            async for event in hub.events():
+                if isinstance(event, AlarmJournal.EVENTS):
+                    self.append(event)
+
+    def _find(self, entries, count, timestamp):
+        """
+        Finds the first index entry at or after a timestamp, with a binary search
+        :param entries: The memory-mapped index
+        :param count: The number of entries
+        :param timestamp: The timestamp
+        :return: The number of the entry
+        """
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if INDEX.unpack_from(entries, middle * INDEX.size)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, device_id=None, since=None, until=None, event=None):
+        """
+        The journaled events in a time window, only the records of the window are read
+        :param device_id: The id of the device, None for all devices
+        :param since: The start of the window in seconds since the epoch, None for the first record
+        :param until: The end of the window in seconds since the epoch, None for the last record
+        :param event: The name of the event type, e.g. "DeviceAlarm", None for all events
+        :return: A list with the record dicts, oldest first
+        """
+        try:
+            size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            return []
+        count = size // INDEX.size
+        if count == 0:
+            return []
+
+        records = []
+        with open(self.index_path, "rb") as index_file, open(self.log_path, "rb") as log:
+            with mmap.mmap(index_file.fileno(), count * INDEX.size, access=mmap.ACCESS_READ) as entries:
+                first = 0 if since is None else self._find(entries, count, since)
+                for number in range(first, count):
+                    timestamp, offset, entry_device_id = INDEX.unpack_from(entries, number * INDEX.size)
+                    if until is not None and timestamp > until:
+                        break
+                    if device_id is not None and entry_device_id != device_id:
+                        continue
+                    record, _ = self._read_record(log, offset)
+                    if record is not None and (event is None or record["event"] == event):
+                        records.append(record)
+        return records
+
+    def close(self):
+        """
+        Writes the queued records and closes the journal
+        """
+        if self.read_only:
+            return
+        if self._pending:
+            self._write(list(self._pending))
+            self._pending.clear()
+        self.log.close()
+        self.index.close()
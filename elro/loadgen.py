@@ -0,0 +1,220 @@
+import logging
+import json
+import random
+
+import anyio
+from distmqtt.broker import create_broker
+from distmqtt.client import open_mqttclient
+from distmqtt.mqtt.constants import QOS_0
+
+from elro.command import Command
+from elro.hub import Hub
+from elro.mqtt import MQTTPublisher
+from elro.simulator import K1Simulator, SimulatedDevice
+
+# The command messages of the load, with the K1 command each of them ends up as
+COMMANDS = {
+    "state": (Command.EQUIPMENT_CONTROL, lambda number: {"state": "test alarm"}),
+    "name": (Command.MODIFY_EQUIPMENT_NAME, lambda number: {"name": f"Load {number % 1000}"}),
+}
+
+
+def parse_mix(text):
+    """
+    Parses a command mix, e.g. "state=9,name=1" sends nine state commands for every name command
+    :param text: The commands with their weights
+    :return: A dict with the weight per command
+    :raises ValueError: When the text is not a valid mix
+    """
+    mix = {}
+    for part in text.split(","):
+        command, _, weight = part.partition("=")
+        if command not in COMMANDS:
+            raise ValueError(f"Unknown command '{command}', expected one of {', '.join(COMMANDS)}")
+        mix[command] = int(weight or 1)
+        if mix[command] < 0:
+            raise ValueError(f"The weight of '{command}' should not be negative")
+    if sum(mix.values()) == 0:
+        raise ValueError(f"The mix '{text}' has no commands")
+    return mix
+
+
+def percentiles(values):
+    """
+    The percentiles of a list of values, in milliseconds
+    :param values: The values in seconds
+    :return: A dict with the p50, p95, p99 and max, or None values when there are no values
+    """
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    values = sorted(values)
+
+    def percentile(percent):
+        return round(values[min(len(values) - 1, int(len(values) * percent / 100))] * 1000, 2)
+
+    return {"p50": percentile(50), "p95": percentile(95), "p99": percentile(99), "max": round(values[-1] * 1000, 2)}
+
+
+class LatencyTracker:
+    """
+    Matches the published command messages with the K1 commands the simulator receives. Commands for the same
+    device are coalesced by the scheduler of the hub, so one K1 command answers all messages that are waiting for it.
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.pending = {}
+        self.latencies = []
+
+    def sent(self, key):
+        """
+        Timestamps a published message
+        :param key: A tuple with the K1 command and the device id
+        """
+        self.pending.setdefault(key, []).append(anyio.current_time())
+
+    def received(self, key):
+        """
+        Ends the messages that are waiting for a K1 command
+        :param key: A tuple with the K1 command and the device id
+        """
+        now = anyio.current_time()
+        self.latencies.extend(now - sent for sent in self.pending.pop(key, []))
+
+    @property
+    def waiting(self):
+        """
+        The number of messages that are waiting for their K1 command
+        """
+        return sum(len(sent) for sent in self.pending.values())
+
+
+class RecordingSimulator(K1Simulator):
+    """
+    A K1Simulator that reports the commands it receives to a LatencyTracker
+    """
+    def __init__(self, tracker, hub_id, devices=None):
+        """
+        Constructor
+        :param tracker: The LatencyTracker to report to
+        :param hub_id: The id of the simulated K1
+        :param devices: A dict with the SimulatedDevice objects by device id
+        """
+        super().__init__(hub_id, devices)
+        self.tracker = tracker
+
+    async def handle_command(self, command, data):
+        if "device_ID" in data:
+            self.tracker.received((command, data["device_ID"]))
+        await super().handle_command(command, data)
+
+
+class CommandLoadGenerator:
+    """
+    Publishes a mix of command messages on the command topics and measures how long it takes until the commands
+    reach a simulated K1, through a local MQTT broker, the MQTTPublisher command handling, the scheduler of the hub
+    and UDP.
+    """
+    HUB_ID = "ST_10ad10ad10ad"
+
+    def __init__(self, devices=8, count=500, rate=100, mix=None, port=18831, settle=10, seed=None):
+        """
+        Constructor
+        :param devices: The number of simulated devices the commands are spread over
+        :param count: The number of command messages to publish
+        :param rate: The number of command messages per second, 0 publishes as fast as possible
+        :param mix: A dict with the weight per command, see parse_mix(), defaults to state commands only
+        :param port: The port of the local MQTT broker
+        :param settle: The number of seconds to wait for the last commands to reach the K1
+        :param seed: The seed of the random device and command choice
+        """
+        self.devices = devices
+        self.count = count
+        self.rate = rate
+        self.mix = {"state": 1} if mix is None else mix
+        self.port = port
+        self.settle = settle
+        self.random = random.Random(seed)
+        self.base_topic = "/load"
+
+    def messages(self):
+        """
+        The command messages of the load
+        :return: An iterator of tuples with the command name, the device id and the payload
+        """
+        commands = list(self.mix)
+        weights = [self.mix[command] for command in commands]
+        for number in range(self.count):
+            command = self.random.choices(commands, weights)[0]
+            device_id = self.random.randint(1, self.devices)
+            yield command, device_id, json.dumps(COMMANDS[command][1](number))
+
+    async def _wait_for_devices(self, hub):
+        await hub.connect()
+        await hub.poll_device_status()
+        while len(hub.devices) < self.devices:
+            await anyio.sleep(0.05)
+
+    async def run(self):
+        """
+        Runs the load
+        :return: The report dict, see report()
+        """
+        tracker = LatencyTracker()
+        simulator = RecordingSimulator(tracker, CommandLoadGenerator.HUB_ID,
+                                       {device_id: SimulatedDevice("0013", f"Device {device_id}")
+                                        for device_id in range(1, self.devices + 1)})
+        hub = Hub("127.0.0.1", simulator.port, CommandLoadGenerator.HUB_ID)
+        broker = f"mqtt://127.0.0.1:{self.port}"
+        publisher = MQTTPublisher(broker, False, self.base_topic)
+        config = {"listeners": {"default": {"type": "tcp", "bind": f"127.0.0.1:{self.port}"}}, "sys_interval": 0}
+
+        async with create_broker(config), anyio.create_task_group() as task_group:
+            await task_group.start(simulator.serve)
+            task_group.start_soon(hub.receiver_task, name="hub_receiver")
+            task_group.start_soon(hub.scheduler.run, name="hub_scheduler")
+            with anyio.fail_after(10):
+                await self._wait_for_devices(hub)
+            task_group.start_soon(publisher.device_message_task, hub, name="device_messages")
+            await anyio.sleep(0.5)  # let the publisher subscribe
+
+            logging.info(f"Publishing {self.count} commands at {self.rate or 'max'}/s over {self.devices} devices")
+            async with open_mqttclient(uri=broker) as client:
+                started = anyio.current_time()
+                for number, (command, device_id, payload) in enumerate(self.messages()):
+                    if self.rate > 0:
+                        await anyio.sleep(max(0.0, started + number / self.rate - anyio.current_time()))
+                    tracker.sent((COMMANDS[command][0], device_id))
+                    await client.publish(f"{self.base_topic}/elro/{device_id}/set", payload.encode("utf-8"), QOS_0)
+                published = anyio.current_time()
+
+                with anyio.move_on_after(self.settle):
+                    while tracker.waiting > 0:
+                        await anyio.sleep(0.05)
+                finished = anyio.current_time()
+                task_group.cancel_scope.cancel()
+
+        return self.report(tracker, simulator, publisher, published - started, finished - started)
+
+    def report(self, tracker, simulator, publisher, publish_duration, duration):
+        """
+        The results of a load run
+        :param tracker: The LatencyTracker of the run
+        :param simulator: The simulator of the run
+        :param publisher: The MQTTPublisher of the run
+        :param publish_duration: The number of seconds it took to publish the messages
+        :param duration: The number of seconds until the last command reached the K1
+        :return: A dict with the counts, the throughput and the MQTT to UDP latency in milliseconds
+        """
+        k1_commands = sum(simulator.received[command.name] for command, _ in COMMANDS.values())
+        return {"published": self.count,
+                "delivered": len(tracker.latencies),
+                "lost": tracker.waiting,
+                "k1_commands": k1_commands,
+                "coalesced": max(0, len(tracker.latencies) - k1_commands),
+                "publish_rate": round(self.count / max(publish_duration, 1e-9), 1),
+                "throughput": round(len(tracker.latencies) / max(duration, 1e-9), 1),
+                "k1_rate": round(k1_commands / max(duration, 1e-9), 1),
+                "latency": percentiles(tracker.latencies),
+                "routing_errors": publisher.metrics.counters["command_errors"]}
@@ -0,0 +1,71 @@
+import collections
+
+
+class Metrics:
+    """
+    A small in-memory registry of counters, gauges and timings, used to expose what the hub and publisher are doing
+    """
+    def __init__(self, window=256):
+        """
+        Constructor
+        :param window: The number of samples kept per timing
+        """
+        self.window = window
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.timings = {}
+
+    def increment(self, name, value=1):
+        """
+        Increments a counter
+        :param name: The name of the counter
+        :param value: The value to add to the counter
+        """
+        self.counters[name] += value
+
+    def set_gauge(self, name, value):
+        """
+        Sets a gauge to its current value
+        :param name: The name of the gauge
+        :param value: The current value
+        """
+        self.gauges[name] = value
+
+    def observe(self, name, value):
+        """
+        Adds a sample to a timing
+        :param name: The name of the timing
+        :param value: The measured duration in seconds
+        """
+        try:
+            samples = self.timings[name]
+        except KeyError:
+            samples = self.timings[name] = collections.deque(maxlen=self.window)
+        samples.append(value)
+
+    def percentile(self, name, percent):
+        """
+        Calculates a percentile over the recent samples of a timing
+        :param name: The name of the timing
+        :param percent: The percentile to calculate, from 0 to 100
+        :return: The percentile, or None when there are no samples
+        """
+        samples = sorted(self.timings.get(name, ()))
+        if len(samples) == 0:
+            return None
+        index = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self):
+        """
+        A snapshot of all metrics
+        :return: A dict with the metric names and their values
+        """
+        timings = {}
+        for name, samples in self.timings.items():
+            timings[name] = {"count": len(samples),
+                             "last": samples[-1],
+                             "p50": self.percentile(name, 50),
+                             "p95": self.percentile(name, 95),
+                             "max": max(samples)}
+        return {"counters": dict(self.counters), "gauges": dict(self.gauges), "timings": timings}
@@ -1,27 +1,43 @@
+import contextlib
+import functools
 import logging
 import json
+import math
+import re
 
-import trio
+import anyio
 from distmqtt.client import open_mqttclient
-from distmqtt.mqtt.constants import QOS_1
 from valideer import accepts, Pattern
 
+from elro.events import HubConnected, HubDisconnected, DeviceRemoved
+from elro.metrics import Metrics
+from elro.policy import DEFAULT_POLICIES, ALARM, STATE, REFRESH, DISCOVERY, AVAILABILITY, STATUS, RESPONSE
+from elro.router import CommandRouter, CommandDispatcher
+from elro.sink import EventSink
 from elro.validation import ip_address, hostname
 
 
-class MQTTPublisher:
+class MQTTPublisher(EventSink):
     """
     A MQTTPublisher listens to all hub events and publishes messages to an MQTT broker accordingly
     """
     @accepts(broker_host=Pattern(f"({ip_address}|{hostname})"),
              base_topic=Pattern("^[/_\\-a-zA-Z0-9]*$"))
-    def __init__(self, broker_host, ha_autodiscover, base_topic=None):
+    def __init__(self, broker_host, ha_autodiscover, base_topic=None, policies=None, telemetry=None, client=None,
+                 hub_id=None):
         """
         Constructor
         :param broker_host: The MQTT broker host or ip
         :param ha_autodiscover: If true, new devices will be automatically discovered by Home Assistant
         :param base_topic: The base topic to publish under, i.e., the publisher publishes messages under
                            <base topic>/elro/<device name or id>
+        :param policies: A dict with the PublishPolicy per message class that replaces the default policy
+        :param telemetry: A TelemetryAggregator to publish the battery level and signal strength separately, None to
+                          publish every update of the battery level or signal strength on the device topic
+        :param client: An MQTT client that is shared with other publishers, e.g. by the hubs of a fleet worker, None
+                       to open the connections of this publisher. A shared client has no last will.
+        :param hub_id: The id of the hub, when several hubs publish on one broker it scopes the Home Assistant
+                       discovery topics and unique ids, None for a single hub
         """
         self.broker_host = broker_host
         if not self.broker_host.startswith("mqtt://"):
@@ -33,6 +49,37 @@ class MQTTPublisher:
             self.base_topic = base_topic
 
         self.ha_autodiscover = ha_autodiscover
+        self.client = client
+        self.hub_id = hub_id
+        self.router = CommandRouter(self.base_topic)
+        self.metrics = Metrics()
+        self.policies = dict(DEFAULT_POLICIES)
+        self.policies.update(policies or {})
+        self.published_states = {}
+        self.telemetry = telemetry
+        # The metrics of the hub and the publisher are published every metrics interval (in seconds)
+        self.metrics_interval = 30
+
+        self.history_request_topic = f"{self.base_topic}/elro/+/history/get"
+        self.history_pattern = re.compile(f"^{re.escape(self.base_topic)}/elro/([0-9]+)/history/get$")
+
+        self.discovery_batch_delay = 1
+        self.discovery_published = {}
+        self._discovery_pending = {}
+        self._discovery_wakeup = anyio.Event()
+
+    @contextlib.asynccontextmanager
+    async def connection(self, **kwargs):
+        """
+        A connection with the broker, the shared client when the publisher has one
+        :param kwargs: The arguments of open_mqttclient(), e.g. the config with the last will
+        :return: An async context manager with the MQTT client
+        """
+        if self.client is not None:
+            yield self.client
+        else:
+            async with open_mqttclient(uri=self.broker_host, **kwargs) as client:
+                yield client
 
     def topic_name(self, device):
         """
@@ -41,78 +88,408 @@ class MQTTPublisher:
         """
         return f"{self.base_topic}/elro/{device.id}"
 
+    async def publish(self, client, message_class, topic, payload):
+        """
+        Publishes a message with the QoS, retain flag and expiry of its message class. A message that is not
+        published before it expires is dropped.
+        :param client: The MQTT client to use
+        :param message_class: The message class, e.g. ALARM or REFRESH
+        :param topic: The topic to publish on
+        :param payload: The bytes to publish
+        :return: True if the message is published, False if it expired
+        """
+        policy = self.policies[message_class]
+        with anyio.move_on_after(math.inf if policy.expiry is None else policy.expiry) as scope:
+            await client.publish(topic, payload, policy.qos, retain=policy.retain)
+        if scope.cancelled_caught:
+            logging.warning(f"Dropped {message_class} message on '{topic}', it expired after {policy.expiry} s")
+            self.metrics.increment("publish_expired")
+            return False
+
+        self.metrics.increment(f"published_{message_class}")
+        return True
+
+    def telemetry_topic(self, device_id):
+        """
+        The topic with the battery level and signal strength of a device
+        :param device_id: The id of the device
+        """
+        return f"{self.base_topic}/elro/{device_id}/telemetry"
+
+    @property
+    def availability_topic(self):
+        """
+        The topic with the availability of the hub, "online" or "offline"
+        """
+        return f"{self.base_topic}/elro/availability"
+
+    async def availability_task(self, hub):
+        """
+        The main loop publishing the availability of the hub. The broker publishes "offline" when the
+        connection with the publisher is lost.
+        :param hub: The hub to publish the availability of
+        """
+        policy = self.policies[AVAILABILITY]
+        will = {"topic": self.availability_topic, "message": b"offline", "qos": policy.qos, "retain": policy.retain}
+        async with self.connection(config={"will": will}) as client:
+            since = hub.event_stream.sequence
+            await self.publish_availability(client, hub.connected)
+            async for event in hub.events(since):
+                if isinstance(event, (HubConnected, HubDisconnected)):
+                    await self.publish_availability(client, isinstance(event, HubConnected))
+
+    async def publish_availability(self, client, available):
+        """
+        Publishes the availability of the hub, devices are unavailable while the hub is not connected
+        :param client: The MQTT client to use
+        :param available: True if the hub is connected
+        """
+        payload = "online" if available else "offline"
+        logging.info(f"Publish availability on '{self.availability_topic}': {payload}")
+        await self.publish(client, AVAILABILITY, self.availability_topic, payload.encode('utf-8'))
+
     async def device_alarm_task(self, device):
         """
         The main loop for handling alarm events
         :param device: The device to handle alarm events for.
         """
+        version = device.alarm.version
         while True:
-            await self.handle_device_alarm(device)
+            version = await self.handle_device_alarm(device, version)
 
-    async def handle_device_alarm(self, device):
+    async def handle_device_alarm(self, device, since=None):
         """
         Listens for a device's alarm event and publishes a message on arrival.
         :param device: The device to listen to
+        :param since: The version of the last alarm that was published, None to wait for the next alarm
+        :return: The version of the published alarm
         """
-        await device.alarm.wait()
-        async with open_mqttclient(uri=self.broker_host) as client:
+        version = await device.alarm.wait(since)
+        async with self.connection() as client:
             logging.info(f"Publish alarm on '{self.topic_name(device)}':\n"
                          f"{device.json.encode('utf-8')}")
-            await client.publish(f'{self.topic_name(device)}',
-                                 device.json.encode('utf-8'),
-                                 QOS_1)
+            await self.publish(client, ALARM, self.topic_name(device), device.json.encode('utf-8'))
+        return version
 
     async def device_update_task(self, device):
         """
         The main loop for handling device updates
         :param device: The device to listen to update events for
         """
+        version = device.updated.version
         while True:
-            await self.handle_device_update(device)
+            version = await self.handle_device_update(device, version)
 
-    async def handle_device_update(self, device):
+    async def handle_device_update(self, device, since=None):
         """
-        Listens to a device's update events and publish a message on arrival
+        Listens to a device's update events and publish a message on arrival. An update that changes the state
+        or the name of the device is a state change, an update of only the battery level or signal strength is a
+        refresh.
+        With a telemetry aggregator, a refresh is only published on the telemetry topic, when it is a meaningful
+        change. The updates that happen while publishing are combined in the next message.
         :param device: The device to listen for updates for
+        :param since: The version of the last update that was published, None to wait for the next update
+        :return: The version of the published update
         """
-        await device.updated.wait()
-        async with open_mqttclient(uri=self.broker_host) as client:
-            logging.info(f"Publish update on '{self.topic_name(device)}':\n"
+        version = await device.updated.wait(since)
+        published = (device.device_state, device.name)
+        message_class = REFRESH if self.published_states.get(device.id) == published else STATE
+        self.published_states[device.id] = published
+        if self.telemetry is not None:
+            changed = self.telemetry.observe(device.id, device.battery_level, device.signal_strength)
+            if message_class == REFRESH:
+                if changed:
+                    telemetry = {"battery": device.battery_level, "signal": device.signal_strength}
+                    async with self.connection() as client:
+                        await self.publish(client, REFRESH, self.telemetry_topic(device.id),
+                                           json.dumps(telemetry).encode('utf-8'))
+                else:
+                    self.metrics.increment("refresh_suppressed")
+                return version
+
+        async with self.connection() as client:
+            logging.info(f"Publish {message_class} on '{self.topic_name(device)}':\n"
                          f"{device.json.encode('utf-8')}")
-            await client.publish(f'{self.topic_name(device)}',
-                                 device.json.encode('utf-8'),
-                                 QOS_1)
+            await self.publish(client, message_class, self.topic_name(device), device.json.encode('utf-8'))
+        return version
+
+    async def telemetry_task(self):
+        """
+        The main loop publishing the telemetry summaries, with the minimum, maximum and last battery level and
+        signal strength of every device per interval, on <base topic>/elro/<device id>/telemetry/summary
+        """
+        async with self.connection() as client:
+            while True:
+                await anyio.sleep(min(self.telemetry.interval, 60))
+                await self.publish_telemetry_summaries(client)
+
+    async def publish_telemetry_summaries(self, client):
+        """
+        Publishes the summaries of the devices of which the summary window is over
+        :param client: The MQTT client to use
+        """
+        for device_id in self.telemetry.due():
+            summary = json.dumps(self.telemetry.summarize(device_id))
+            logging.info(f"Publish telemetry summary on '{self.telemetry_topic(device_id)}/summary':\n{summary}")
+            await self.publish(client, REFRESH, f"{self.telemetry_topic(device_id)}/summary", summary.encode('utf-8'))
+
+    async def scene_update_task(self, hub):
+        """
+        The main loop for handling scene index updates
+        :param hub: The hub to listen to scene updates for
+        """
+        version = hub.scenes_updated.version
+        while True:
+            version = await self.handle_scene_update(hub, version)
+
+    async def handle_scene_update(self, hub, since=None):
+        """
+        Listens to the hub's scene updates and publishes the scene index on arrival. The index is retained,
+        so automations can look up the scenes at any time.
+        :param hub: The hub to listen for scene updates for
+        :param since: The version of the last published scene index, None to wait for the next update
+        :return: The version of the published scene index
+        """
+        version = await hub.scenes_updated.wait(since)
+        scenes = json.dumps([json.loads(scene.json) for scene in hub.scenes.values()])
+        async with self.connection() as client:
+            logging.info(f"Publish scenes on '{self.base_topic}/elro/scenes':\n{scenes}")
+            await self.publish(client, STATUS, f"{self.base_topic}/elro/scenes", scenes.encode('utf-8'))
+        return version
+
+    async def history_request_task(self, hub):
+        """
+        The main loop for answering history requests
+        :param hub: The hub with the device history
+        """
+        while True:
+            await self.handle_history_requests(hub)
+
+    async def handle_history_requests(self, hub):
+        """
+        Answers the requests on <base topic>/elro/<device id>/history/get with the samples of the device on
+        <base topic>/elro/<device id>/history. The request payload can limit the window with "since" and
+        "until" (seconds since the epoch) and the number of samples with "limit".
+        :param hub: The hub with the device history
+        """
+        async with self.connection() as client:
+            logging.info(f"Subscribing to topic '{self.history_request_topic}'")
+            async with client.subscription(self.history_request_topic, codec="utf8") as subscription:
+                async for msg in subscription:
+                    await self.handle_history_request(client, hub, msg.topic, msg.data)
+
+    async def handle_history_request(self, client, hub, topic, payload):
+        """
+        Answers one history request
+        :param client: The MQTT client to use
+        :param hub: The hub with the device history
+        :param topic: The topic of the request
+        :param payload: The payload of the request, a json object or empty
+        """
+        match = self.history_pattern.match(topic)
+        if match is None:
+            logging.error(f"Please provide the topic as [base_topic]/elro/[device_id]/history/get, got '{topic}'")
+            return
+
+        try:
+            request = json.loads(payload) if payload else {}
+            samples = hub.history.query(int(match.group(1)),
+                                        request.get("since"), request.get("until"), request.get("limit"))
+        except (ValueError, TypeError, AttributeError) as error:
+            logging.error(f"Unable to handle history request '{payload}' with error: '{error}'")
+            return
+
+        history_topic = f"{self.base_topic}/elro/{match.group(1)}/history"
+        logging.info(f"Publish {len(samples)} history samples on '{history_topic}'")
+        await self.publish(client, RESPONSE, history_topic, json.dumps(samples).encode('utf-8'))
 
-    async def device_discovery_task(self, device):
+    async def health_update_task(self, hub):
         """
-        The main handler for Home Assistant discovery
+        The main loop for handling the health updates of the hub
+        :param hub: The hub to listen to health updates for
+        """
+        version = hub.health_updated.version
+        while True:
+            version = await self.handle_health_update(hub, version)
+
+    async def handle_health_update(self, hub, since=None):
+        """
+        Listens to the hub's health updates and publishes the state of the K1 (up, degraded or down) with its
+        round trip times in milliseconds. The health is retained, so it can be looked up at any time.
+        :param hub: The hub to listen for health updates for
+        :param since: The version of the last published health, None to wait for the next update
+        :return: The version of the published health
+        """
+        version = await hub.health_updated.wait(since)
+        health = json.dumps(hub.watchdog.summary())
+        async with self.connection() as client:
+            logging.info(f"Publish health on '{self.base_topic}/elro/health':\n{health}")
+            await self.publish(client, STATUS, f"{self.base_topic}/elro/health", health.encode('utf-8'))
+        return version
+
+    async def metrics_task(self, hub):
+        """
+        The main loop publishing the metrics of the hub and the publisher
+        :param hub: The hub to publish the metrics of
+        """
+        async with self.connection() as client:
+            while True:
+                await anyio.sleep(self.metrics_interval)
+                await self.publish_metrics(client, hub)
+
+    async def publish_metrics(self, client, hub):
+        """
+        Publishes the counters, gauges and timings of the hub and the publisher on <base topic>/elro/metrics, e.g.
+        the queue depth, the buffered and expired commands, the outages and the command latencies. The metrics are
+        retained, like the health.
+        :param client: The MQTT client to use
+        :param hub: The hub to publish the metrics of
+        """
+        metrics = json.dumps({"hub": hub.metrics.snapshot(), "publisher": self.metrics.snapshot()})
+        logging.debug(f"Publish metrics on '{self.base_topic}/elro/metrics':\n{metrics}")
+        await self.publish(client, STATUS, f"{self.base_topic}/elro/metrics", metrics.encode('utf-8'))
+
+    def queue_discovery(self, device):
+        """
+        Queues a device for the next batch of Home Assistant discovery configs
         :param device: The device to handle discover event for.
         """
         if self.ha_autodiscover is True and device.device_type != "DEL":
-            await self.handle_device_discovery(device)
+            self._discovery_pending[device.id] = device
+            self._discovery_wakeup.set()
+
+    @property
+    def discovery_scope(self):
+        """
+        The node id of the discovery topics and the prefix of the unique ids, with the hub id when it is set
+        """
+        return "elro_k1" if self.hub_id is None else f"elro_k1_{self.hub_id}"
+
+    def discovery_topic(self, device_id):
+        """
+        The Home Assistant discovery topic for a device
+        :param device_id: The id of the device
+        """
+        return f"homeassistant/sensor/{self.discovery_scope}/{device_id}/config"
 
-    async def handle_device_discovery(self, device):
+    def discovery_config(self, device):
         """
-        Add new devices automatically in Home Assistant
+        The Home Assistant discovery config for a device
         :param device: The device that will be added to Home Assistant
+        :return: The config as json str
         """
         # https://www.home-assistant.io/docs/mqtt/discovery/
         # https://www.home-assistant.io/integrations/sensor.mqtt/
-        async with open_mqttclient(uri=self.broker_host) as client:
-            logging.info(f"Publish discovery on 'homeassistant/sensor/elro_k1/{device.id}/config'")
-            await client.publish(
-                f"homeassistant/sensor/elro_k1/{device.id}/config",
-                json.dumps(
-                {
-                    "name": f"elro_k1_{device.id}",
-                    "state_topic": f"{self.topic_name(device)}",
-                    "value_template": "{{ value_json.state }}",
-                    "json_attributes_topic": f"{self.topic_name(device)}",
-                    "unique_id": f"elro_k1_device_{device.id}"
-                }).encode('utf8'),
-                QOS_1,
-                retain=True
-            )
+        return json.dumps({
+            "name": f"elro_k1_{device.id}",
+            "state_topic": f"{self.topic_name(device)}",
+            "value_template": "{{ value_json.state }}",
+            "json_attributes_topic": f"{self.topic_name(device)}",
+            "availability_topic": self.availability_topic,
+            "unique_id": f"{self.discovery_scope}_device_{device.id}"
+        })
+
+    async def device_discovery_task(self, hub):
+        """
+        The main loop for Home Assistant discovery. All discovery configs are published over one
+        connection in batches, configs that are already retained on the broker are skipped.
+        :param hub: The hub to handle the discovery for
+        """
+        async with self.connection() as client:
+            since = hub.event_stream.sequence
+            await self.read_discovery_configs(client)
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(self.discovery_cleanup_task, client, hub)
+                task_group.start_soon(self.discovery_removal_task, client, hub, since)
+                while True:
+                    await self._discovery_wakeup.wait()
+                    self._discovery_wakeup = anyio.Event()
+                    await anyio.sleep(self.discovery_batch_delay)  # gather the devices that arrive together
+                    await self.handle_device_discovery(client, hub)
+
+    async def read_discovery_configs(self, client, timeout=1):
+        """
+        Reads the discovery configs that are retained on the broker
+        :param client: The MQTT client to use
+        :param timeout: The number of seconds to wait for the retained messages
+        """
+        async with client.subscription(self.discovery_topic("+"), codec="utf8") as subscription:
+            with anyio.move_on_after(timeout):
+                async for msg in subscription:
+                    if msg.data:
+                        self.discovery_published[msg.topic] = msg.data
+        logging.info(f"Found {len(self.discovery_published)} retained discovery configs")
+
+    async def handle_device_discovery(self, client, hub):
+        """
+        Publishes the discovery configs of all queued devices in one batch
+        :param client: The MQTT client to use
+        :param hub: The hub the devices belong to
+        """
+        devices = list(self._discovery_pending.values())
+        self._discovery_pending.clear()
+
+        published = 0
+        for device in devices:
+            topic = self.discovery_topic(device.id)
+            config = self.discovery_config(device)
+            if self.discovery_published.get(topic) == config:
+                self.metrics.increment("discovery_skipped")
+                continue
+
+            await self.publish(client, DISCOVERY, topic, config.encode('utf8'))
+            self.discovery_published[topic] = config
+            published += 1
+        self.metrics.increment("discovery_published", published)
+        logging.info(f"Published {published} of {len(devices)} discovery configs")
+
+        if hub.synced.is_set():
+            await self.remove_stale_discovery(client, hub)
+
+    async def discovery_cleanup_task(self, client, hub):
+        """
+        Removes the discovery configs of removed devices, as soon as all devices of the hub are known
+        :param client: The MQTT client to use
+        :param hub: The hub the devices belong to
+        """
+        await hub.synced.wait()
+        await self.remove_stale_discovery(client, hub)
+
+    async def discovery_removal_task(self, client, hub, since=None):
+        """
+        Removes the discovery config of a device as soon as the device is removed from the hub
+        :param client: The MQTT client to use
+        :param hub: The hub the devices belong to
+        :param since: The sequence number of the last hub event that was handled, None for the next event
+        """
+        async for event in hub.events(since):
+            if isinstance(event, DeviceRemoved):
+                self._discovery_pending.pop(event.device_id, None)
+                topic = self.discovery_topic(event.device_id)
+                if topic in self.discovery_published:
+                    await self.remove_discovery(client, topic)
+
+    async def remove_stale_discovery(self, client, hub):
+        """
+        Removes the retained discovery configs of devices that are no longer known by the hub
+        :param client: The MQTT client to use
+        :param hub: The hub the devices belong to
+        """
+        known = set(self.discovery_topic(device_id) for device_id in hub.devices)
+        for topic in list(self.discovery_published):
+            if topic not in known:
+                await self.remove_discovery(client, topic)
+
+    async def remove_discovery(self, client, topic):
+        """
+        Removes a retained discovery config, which removes the entity from Home Assistant
+        :param client: The MQTT client to use
+        :param topic: The discovery topic
+        """
+        logging.info(f"Remove discovery on '{topic}'")
+        await self.publish(client, DISCOVERY, topic, b"")
+        del self.discovery_published[topic]
+        self.metrics.increment("discovery_removed")
 
     async def device_message_task(self, hub):
         """
@@ -127,70 +504,49 @@ class MQTTPublisher:
         The handler for the command topics
         :param hub: The hub to listen for devices
         """
-        async with open_mqttclient(uri=self.broker_host) as client:
-            logging.info(f"Subscribing to topic 'f{self.base_topic}/elro/[device_id]/set'")
-            async with client.subscription(f"{self.base_topic}/elro/+/set", codec="utf8") as subscription:
-                async for msg in subscription:
-                    mqtt_message = msg.data.strip('\"')
-                    logging.info(f"Got message '{mqtt_message}' on topic '{msg.topic}'")
-                    topic_items = msg.topic.split('/')
-                    device_index = None
-                    for i in range(len(topic_items)):  # searching for the device index and the command
-                        if topic_items[i].lower() == 'elro':
-                            try:
-                                device_index = int(topic_items[i+1])
-                            except KeyError:
-                                logging.error("Please provide the topic as [base_topic]/elro/[device_id]/set")
-                            except ValueError:
-                                logging.error("Please provide an integer for the device_index")
-                            except Exception as error:
-                                logging.error(f"Unknown error occured '{error}'")
-                            break
-
-                    if device_index is not None:
-                        mqtt_message_json = None
-                        try:
-                            mqtt_message_json = json.loads(mqtt_message)
-                        except Exception as error:
-                            logging.error(f"Unable to parse MQTT JSON '{mqtt_message}' with error: '{error}'")
-                        if mqtt_message_json is not None:
-                            if "name" in mqtt_message_json and device_index != 0:
-                                await hub.set_device_name(device_index, mqtt_message_json["name"])
-                            elif "state" in mqtt_message_json:
-                                if mqtt_message_json["state"].lower() == 'test alarm':
-                                    await hub.set_device_state(device_index, '17')
-                                elif mqtt_message_json["state"].lower() == 'silence' and device_index == 0:
-                                    await hub.set_device_state(device_index, '00')
-                                else:
-                                    logging.warning(f"Unable to set state with incorrect message '{mqtt_message}' and/or topic '{msg.topic}'")
-                            elif "permit_join" in mqtt_message_json and device_index == 0:
-                                if mqtt_message_json["permit_join"] is True:
-                                    await hub.permit_join_device()
-                                elif mqtt_message_json["permit_join"] is False:
-                                    await hub.permit_join_device_disable()
-                            elif "remove" in mqtt_message_json and device_index != 0:
-                                if mqtt_message_json["remove"] is True:
-                                    await hub.remove_device(device_index, True)
-                            elif "replace" in mqtt_message_json and device_index != 0:
-                                if mqtt_message_json["replace"] is True:
-                                    await hub.replace_device(device_index)
-                                elif mqtt_message_json["replace"] is False:
-                                    await hub.permit_join_device_disable()
-                            else:
-                                logging.warning(f"No action belongs to the MQTT message '{mqtt_message}' and/or topic '{msg.topic}'")
-                    else:
-                        logging.warning(f"Received message on topic '{msg.topic}', but there was no device index")
+        async with self.connection() as client:
+            logging.info(f"Subscribing to topic '{self.router.subscription_topic}'")
+            async with client.subscription(self.router.subscription_topic, codec="utf8") as subscription:
+                async with anyio.create_task_group() as task_group:
+                    dispatcher = CommandDispatcher(task_group, hub, self.metrics,
+                                                   respond=functools.partial(self.publish_command_result, client))
+                    async for msg in subscription:
+                        logging.info(f"Got message '{msg.data}' on topic '{msg.topic}'")
+                        command = self.router.route(msg.topic, msg.data)
+                        if command is not None:
+                            await dispatcher.dispatch(command)
+
+    async def publish_command_result(self, client, command, result):
+        """
+        Publishes the result of a command that is answered, e.g. of a bulk update, on
+        <base topic>/elro/<device id>/<command>
+        :param client: The MQTT client to use
+        :param command: The handled RoutedCommand
+        :param result: The result dict of the command
+        """
+        topic = f"{self.base_topic}/elro/{command.device_id}/{command.route.key}"
+        logging.info(f"Publish {command.route.key} result on '{topic}':\n{result}")
+        await self.publish(client, RESPONSE, topic, json.dumps(result).encode('utf-8'))
 
     async def handle_hub_events(self, hub):
         """
         Main loop to handle all device events
         :param hub: The hub to listen for devices
         """
-        async with trio.open_nursery() as nursery:
+        async with anyio.create_task_group() as task_group:
             logging.info(f"Start listener for incoming mqtt")
-            nursery.start_soon(self.device_message_task, hub)
+            task_group.start_soon(self.device_message_task, hub)
+            task_group.start_soon(self.scene_update_task, hub)
+            task_group.start_soon(self.availability_task, hub)
+            task_group.start_soon(self.health_update_task, hub)
+            task_group.start_soon(self.metrics_task, hub)
+            task_group.start_soon(self.history_request_task, hub)
+            if self.ha_autodiscover is True:
+                task_group.start_soon(self.device_discovery_task, hub)
+            if self.telemetry is not None:
+                task_group.start_soon(self.telemetry_task)
             async for device_id in hub.new_device_receive_ch:
                 logging.info(f"New device registered: {hub.devices[device_id]}")
-                nursery.start_soon(self.device_update_task, hub.devices[device_id])
-                nursery.start_soon(self.device_alarm_task, hub.devices[device_id])
-                nursery.start_soon(self.device_discovery_task, hub.devices[device_id])
+                task_group.start_soon(self.device_update_task, hub.devices[device_id])
+                task_group.start_soon(self.device_alarm_task, hub.devices[device_id])
+                self.queue_discovery(hub.devices[device_id])
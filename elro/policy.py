@@ -0,0 +1,64 @@
+import dataclasses
+
+from distmqtt.mqtt.constants import QOS_0, QOS_1
+
+ALARM = "alarm"
+STATE = "state"
+REFRESH = "refresh"
+DISCOVERY = "discovery"
+AVAILABILITY = "availability"
+STATUS = "status"
+RESPONSE = "response"
+
+
+@dataclasses.dataclass(frozen=True)
+class PublishPolicy:
+    """
+    How the messages of a class are published. MQTT 3.1.1 has no message expiry, so the expiry is the number of
+    seconds a publish may take (e.g. waiting for the broker or its PUBACK) before it is dropped as stale.
+    """
+    qos: int = QOS_1
+    retain: bool = False
+    expiry: float = None
+
+
+DEFAULT_POLICIES = {
+    # Alarms must arrive, however late
+    ALARM: PublishPolicy(QOS_1),
+    # A state change (e.g. a window that opens) is useless after a minute
+    STATE: PublishPolicy(QOS_1, expiry=60),
+    # A refresh of the battery level or signal strength is repeated with the next status sweep
+    REFRESH: PublishPolicy(QOS_0, expiry=30),
+    DISCOVERY: PublishPolicy(QOS_1, retain=True),
+    AVAILABILITY: PublishPolicy(QOS_1, retain=True),
+    # The scenes and the health of the K1, looked up at any time
+    STATUS: PublishPolicy(QOS_1, retain=True),
+    # The replies to requests, e.g. for the history of a device
+    RESPONSE: PublishPolicy(QOS_1, expiry=30),
+}
+
+
+def parse_policy(text):
+    """
+    Parses a policy from the command line, e.g. "refresh:qos=0,retain=false,expiry=30". The settings that are
+    left out keep their default.
+    :param text: The message class and its settings
+    :return: A tuple with the message class and the PublishPolicy
+    :raises ValueError: When the text is not a valid policy
+    """
+    message_class, _, settings = text.partition(":")
+    if message_class not in DEFAULT_POLICIES:
+        raise ValueError(f"Unknown message class '{message_class}', expected one of {', '.join(DEFAULT_POLICIES)}")
+
+    fields = {}
+    for setting in filter(None, settings.split(",")):
+        key, _, value = setting.partition("=")
+        if key == "qos" and value in ("0", "1", "2"):
+            fields["qos"] = int(value)
+        elif key == "retain" and value.lower() in ("true", "false"):
+            fields["retain"] = value.lower() == "true"
+        elif key == "expiry":
+            fields["expiry"] = float(value) if float(value) > 0 else None
+        else:
+            raise ValueError(f"Invalid setting '{setting}' in policy '{text}'")
+    return message_class, dataclasses.replace(DEFAULT_POLICIES[message_class], **fields)
@@ -0,0 +1,292 @@
+import logging
+import json
+import re
+
+import anyio
+
+from elro.hub import Hub
+from elro.scheduler import CommandScheduler, ScheduledCommand
+
+
+class Route:
+    """
+    A route from a key in a command message to the hub method that handles it
+    """
+    HUB = "hub"
+    DEVICE = "device"
+
+    def __init__(self, key, target, handler):
+        """
+        Constructor
+        :param key: The key in the JSON message that selects this route
+        :param target: Route.HUB if the route only applies to device id 0, Route.DEVICE if it only applies
+                       to the other device ids, None if it applies to all
+        :param handler: An async function (hub, device_id, value) that executes the command, it returns the
+                        ScheduledCommand when the command is queued on the hub, or a result dict that is
+                        published as the answer to the command
+        """
+        self.key = key
+        self.target = target
+        self.handler = handler
+
+    def matches(self, device_id, message):
+        """
+        Checks if this route handles the message
+        :param device_id: The device id from the topic
+        :param message: The parsed JSON message
+        :return: True if the route handles the message
+        """
+        if self.key not in message:
+            return False
+        if self.target == Route.HUB:
+            return device_id == 0
+        if self.target == Route.DEVICE:
+            return device_id != 0
+        return True
+
+
+class RoutedCommand:
+    """
+    A command message that is matched with its route
+    """
+    def __init__(self, device_id, route, value, received):
+        """
+        Constructor
+        :param device_id: The device id the command is for
+        :param route: The matching route
+        :param value: The value of the route key in the message
+        :param received: The anyio time the message was received
+        """
+        self.device_id = device_id
+        self.route = route
+        self.value = value
+        self.received = received
+
+    async def execute(self, hub):
+        """
+        Executes the command on the hub
+        :param hub: The hub to execute the command on
+        :return: The ScheduledCommand when the command is queued on the hub, a result dict when the command is
+                 answered, otherwise None
+        """
+        return await self.route.handler(hub, self.device_id, self.value)
+
+
+def _schedule(hub, key, device_id, function, *args):
+    return hub.scheduler.schedule((key, device_id), CommandScheduler.USER, function, *args)
+
+
+async def _set_name(hub, device_id, value):
+    return _schedule(hub, "name", device_id, hub.set_device_name, device_id, value)
+
+
+async def _set_state(hub, device_id, value):
+    state = str(value).lower()
+    if state == 'test alarm' or (state == 'silence' and device_id == 0):
+        return _schedule(hub, "state", device_id, hub.set_device_state, device_id, Hub.STATES[state])
+    else:
+        logging.warning(f"Unable to set state '{value}' for device '{device_id}'")
+
+
+async def _permit_join(hub, device_id, value):
+    if value is True:
+        return _schedule(hub, "join", device_id, hub.permit_join_device)
+    elif value is False:
+        return _schedule(hub, "join", device_id, hub.permit_join_device_disable)
+
+
+async def _remove(hub, device_id, value):
+    if value is True:
+        return _schedule(hub, "remove", device_id, hub.remove_device, device_id, True)
+
+
+async def _replace(hub, device_id, value):
+    if value is True:
+        return _schedule(hub, "replace", device_id, hub.replace_device, device_id)
+    elif value is False:
+        return _schedule(hub, "join", 0, hub.permit_join_device_disable)
+
+
+async def _trigger_scene(hub, device_id, value):
+    scene = hub.scenes.get(value) if isinstance(value, int) else hub.scene_by_name(str(value))
+    if scene is None:
+        logging.warning(f"Unable to trigger unknown scene '{value}'")
+        return None
+    return hub.scheduler.schedule(("scene", scene.id), CommandScheduler.USER, hub.trigger_scene, scene.id)
+
+
+async def _bulk(hub, device_id, value):
+    result = await hub.bulk_update(value)
+    logging.info(f"Bulk update result: {result}")
+    return result
+
+
+# The routes are tried in order, the first route that matches handles the message
+ROUTES = [
+    Route("name", Route.DEVICE, _set_name),
+    Route("state", None, _set_state),
+    Route("permit_join", Route.HUB, _permit_join),
+    Route("remove", Route.DEVICE, _remove),
+    Route("replace", Route.DEVICE, _replace),
+    Route("scene", Route.HUB, _trigger_scene),
+]
+
+# The route for a list of operations on the hub topic
+BULK_ROUTE = Route("bulk", Route.HUB, _bulk)
+
+
+class CommandRouter:
+    """
+    Matches messages on the command topics with the route that handles them. The topic pattern is
+    compiled once for the base topic.
+    """
+    def __init__(self, base_topic, routes=None):
+        """
+        Constructor
+        :param base_topic: The base topic the command topics are under
+        :param routes: The routes to use, defaults to ROUTES
+        """
+        self.base_topic = base_topic
+        self.subscription_topic = f"{base_topic}/elro/+/set"
+        self.topic_pattern = re.compile(f"^{re.escape(base_topic)}/elro/([^/]+)/set$", re.IGNORECASE)
+        self.routes = ROUTES if routes is None else routes
+
+    def device_id(self, topic):
+        """
+        Gets the device id from a command topic
+        :param topic: The topic the message was received on
+        :return: The device id, or None when the topic is not a valid command topic
+        """
+        match = self.topic_pattern.match(topic)
+        if match is None:
+            logging.error(f"Please provide the topic as [base_topic]/elro/[device_id]/set, got '{topic}'")
+            return None
+        try:
+            return int(match.group(1))
+        except ValueError:
+            logging.error(f"Please provide an integer for the device_index, got '{match.group(1)}'")
+            return None
+
+    def route(self, topic, payload):
+        """
+        Matches a message with its route
+        :param topic: The topic the message was received on
+        :param payload: The payload of the message
+        :return: A RoutedCommand, or None when the message cannot be handled
+        """
+        received = anyio.current_time()
+        mqtt_message = payload.strip('\"')
+
+        device_id = self.device_id(topic)
+        if device_id is None:
+            logging.warning(f"Received message on topic '{topic}', but there was no device index")
+            return None
+
+        try:
+            message = json.loads(mqtt_message)
+        except Exception as error:
+            logging.error(f"Unable to parse MQTT JSON '{mqtt_message}' with error: '{error}'")
+            return None
+
+        if isinstance(message, list) and device_id == 0:
+            return RoutedCommand(device_id, BULK_ROUTE, message, received)
+
+        if isinstance(message, dict):
+            for route in self.routes:
+                if route.matches(device_id, message):
+                    return RoutedCommand(device_id, route, message[route.key], received)
+
+        logging.warning(f"No action belongs to the MQTT message '{mqtt_message}' and/or topic '{topic}'")
+        return None
+
+
+class CommandDispatcher:
+    """
+    Executes routed commands concurrently. Commands for different devices run in parallel, commands for
+    the same device are executed in the order they were received. The latency is recorded when the
+    command is actually sent to the K1. Workers are only started for the hub and the known devices, so
+    a topic with an arbitrary device id does not start a task. Dispatching never waits: a command for a
+    device with a full queue is dropped, and a bulk update, which waits until all its operations are sent,
+    runs in its own task, so neither can stall the command subscription.
+    """
+    def __init__(self, task_group, hub, metrics, queue_size=16, respond=None):
+        """
+        Constructor
+        :param task_group: The task group to start the per device workers in
+        :param hub: The hub to execute the commands on
+        :param metrics: The metrics to record the command latency in
+        :param queue_size: The number of pending commands per device, more commands are dropped
+        :param respond: An async function (command, result) that publishes the result of an answered command,
+                        None to only log the results
+        """
+        self.task_group = task_group
+        self.hub = hub
+        self.metrics = metrics
+        self.queue_size = queue_size
+        self.respond = respond
+        self.queues = {}
+
+    async def dispatch(self, command):
+        """
+        Queues a command for execution, without waiting
+        :param command: The RoutedCommand to execute
+        """
+        if command.route is BULK_ROUTE:
+            self.task_group.start_soon(self._execute, command, name="bulk_update")
+            return
+
+        try:
+            send_ch = self.queues[command.device_id]
+        except KeyError:
+            if command.device_id != 0 and command.device_id not in self.hub.devices:
+                logging.warning(f"Ignoring '{command.route.key}' for unknown device '{command.device_id}'")
+                self.metrics.increment("unknown_device_commands")
+                return
+            send_ch, receive_ch = anyio.create_memory_object_stream(self.queue_size)
+            self.queues[command.device_id] = send_ch
+            self.task_group.start_soon(self._worker, receive_ch, name=f"commands_{command.device_id}")
+        try:
+            send_ch.send_nowait(command)
+        except anyio.WouldBlock:
+            logging.warning(f"Dropped '{command.route.key}' for device '{command.device_id}', its queue is full")
+            self.metrics.increment("dropped_commands")
+
+    async def _worker(self, receive_ch):
+        """
+        Executes the commands of one device in order
+        :param receive_ch: The channel with the commands of the device
+        """
+        async for command in receive_ch:
+            await self._execute(command)
+
+    async def _execute(self, command):
+        """
+        Executes a command, and records its latency or publishes its result
+        :param command: The RoutedCommand to execute
+        """
+        result = None
+        try:
+            result = await command.execute(self.hub)
+        except Exception as error:
+            logging.error(f"Unable to execute '{command.route.key}' for device '{command.device_id}': {error}")
+            self.metrics.increment("command_errors")
+
+        if isinstance(result, ScheduledCommand):
+            result.add_done_callback(lambda: self._record_latency(command))
+            return
+
+        self._record_latency(command)
+        if result is not None and self.respond is not None:
+            try:
+                await self.respond(command, result)
+            except Exception as error:
+                logging.error(f"Unable to answer '{command.route.key}' for device '{command.device_id}': {error}")
+
+    def _record_latency(self, command):
+        """
+        Records the time between receiving a command and sending it to the K1
+        :param command: The handled RoutedCommand
+        """
+        latency = anyio.current_time() - command.received
+        self.metrics.observe(f"command_latency.{command.route.key}", latency)
+        logging.debug(f"Handled '{command.route.key}' for device '{command.device_id}' in {latency * 1000:.1f} ms")
@@ -0,0 +1,61 @@
+import logging
+import json
+
+from elro.utils import get_string_from_ascii
+
+
+class Scene:
+    """
+    A Scene is a set of device actions stored on the K1, that is executed with a single command
+    """
+    def __init__(self, scene_id, name="", content="", group=0):
+        """
+        Constructor
+        :param scene_id: The scene ID
+        :param name: The name of the scene
+        :param content: The raw scene content as reported by the K1
+        :param group: The scene group the scene belongs to
+        """
+        self.id = scene_id
+        self.name = name
+        self.content = content
+        self.group = group
+
+    def __str__(self):
+        return f"<Scene: {self.name} (id: {self.id})>"
+
+    def __repr__(self):
+        return str(self)
+
+    @property
+    def json(self):
+        """
+        A json representation of the scene.
+        :return: A str containing json.
+        """
+        return json.dumps({"id": self.id,
+                           "name": self.name,
+                           "group": self.group})
+
+
+def create_scene_from_data(data):
+    """
+    Factory method to create a scene from a data dict. The answer_content has the same layout as a device
+    name reply: 4 hex characters with the scene id, followed by the encoded name.
+    :param data: The data dict received from the K1
+    :return: A Scene object, or None when the data has no scene
+    """
+    answer = data["data"].get("answer_content", "")
+    if len(answer) < 4 or "OVER" in answer:
+        return None
+
+    try:
+        scene_id = int(answer[0:4], 16)
+    except ValueError:
+        logging.warning(f"Unable to read the scene id from '{answer}'")
+        return None
+
+    return Scene(scene_id,
+                 name=get_string_from_ascii(answer[4:36]),
+                 content=data["data"].get("scene_content", ""),
+                 group=data["data"].get("sence_group", 0))
@@ -0,0 +1,245 @@
+import logging
+import collections
+import math
+
+import anyio
+
+
+class ScheduledCommand:
+    """
+    A command waiting in the CommandScheduler to be sent to the K1
+    """
+    def __init__(self, key, priority, function, args, expires=None):
+        """
+        Constructor
+        :param key: The key used to merge redundant commands, None if the command is never merged
+        :param priority: The priority of the command
+        :param function: The async function that sends the command
+        :param args: The arguments of the function
+        :param expires: The anyio time after which the command is no longer sent, None if it never expires
+        """
+        self.key = key
+        self.priority = priority
+        self.function = function
+        self.args = args
+        self.expires = expires
+        self.expired = False
+        self.done = anyio.Event()
+        self.callbacks = []
+
+    def add_done_callback(self, callback):
+        """
+        Adds a function that is called when the command is sent
+        :param callback: A function without arguments
+        """
+        if self.done.is_set():
+            callback()
+        else:
+            self.callbacks.append(callback)
+
+    def _set_done(self):
+        """
+        Marks the command as sent
+        """
+        self.done.set()
+        for callback in self.callbacks:
+            callback()
+        self.callbacks = []
+
+
+class CommandScheduler:
+    """
+    Schedules the commands that are sent to the K1. The K1 is a small embedded device, so the commands are
+    rate limited, redundant commands for the same device are merged (the last one wins, at the position of the
+    last one) and polling is only done when there are no user commands waiting. While the K1 is not connected the
+    scheduler is paused: the commands are buffered, up to a maximum, and sent in order when it resumes. Commands
+    that wait longer than their expiry are dropped, also while the scheduler is paused.
+    """
+    USER = 0
+    POLL = 1
+
+    def __init__(self, metrics, interval=0.2, expiry=300, max_buffered=100):
+        """
+        Constructor
+        :param metrics: The metrics to record the queue depth in
+        :param interval: The minimal number of seconds between two commands
+        :param expiry: The number of seconds a command may wait before it is dropped, None if commands never expire
+        :param max_buffered: The number of commands that are buffered while paused, the oldest are dropped
+        """
+        self.metrics = metrics
+        self.interval = interval
+        self.expiry = expiry
+        self.max_buffered = max_buffered
+        self.paused = False
+        self._queues = {CommandScheduler.USER: collections.deque(),
+                        CommandScheduler.POLL: collections.deque()}
+        self._pending = {}
+        self._wakeup = anyio.Event()
+
+    @property
+    def queue_depth(self):
+        """
+        The number of commands waiting to be sent
+        :return: The queue depth
+        """
+        return sum(len(queue) for queue in self._queues.values())
+
+    def pause(self):
+        """
+        Holds the commands until resume() is called, e.g. while the K1 is not connected
+        """
+        if not self.paused:
+            logging.info("Buffering the commands until the k1 is connected")
+            self.paused = True
+
+    def resume(self):
+        """
+        Sends the buffered commands, in order
+        """
+        if self.paused:
+            logging.info(f"Sending {self.queue_depth} buffered commands")
+            self.paused = False
+            self._wakeup.set()
+
+    def schedule(self, key, priority, function, *args, expiry=None):
+        """
+        Adds a command to the queue. If a command with the same key is waiting, that command is replaced and moved
+        to the back of the queue, so the commands are sent in the order they were last issued.
+        :param key: The key used to merge redundant commands, None if the command is never merged
+        :param priority: CommandScheduler.USER or CommandScheduler.POLL
+        :param function: The async function that sends the command
+        :param args: The arguments of the function
+        :param expiry: The number of seconds the command may wait before it is dropped, None for the default
+        :return: The ScheduledCommand
+        """
+        expiry = self.expiry if expiry is None else expiry
+        expires = None if expiry is None else anyio.current_time() + expiry
+        if key is not None and key in self._pending:
+            command = self._pending[key]
+            command.function = function
+            command.args = args
+            command.expires = expires
+            queue = self._queues[command.priority]
+            queue.remove(command)
+            queue.append(command)
+            self.metrics.increment("commands_coalesced")
+            logging.debug(f"Merged command '{key}' with the waiting command")
+            return command
+
+        if self.paused:
+            self.metrics.increment("commands_buffered")
+            if self.queue_depth >= self.max_buffered:
+                self._drop_oldest()
+
+        command = ScheduledCommand(key, priority, function, args, expires)
+        if key is not None:
+            self._pending[key] = command
+        self._queues[priority].append(command)
+        self.metrics.set_gauge("command_queue_depth", self.queue_depth)
+        self._wakeup.set()
+        return command
+
+    async def submit(self, key, priority, function, *args):
+        """
+        Adds a command to the queue and waits until it is sent
+        :param key: The key used to merge redundant commands, None if the command is never merged
+        :param priority: CommandScheduler.USER or CommandScheduler.POLL
+        :param function: The async function that sends the command
+        :param args: The arguments of the function
+        """
+        command = self.schedule(key, priority, function, *args)
+        await command.done.wait()
+
+    def _drop_oldest(self):
+        """
+        Drops the oldest buffered command, polls before user commands
+        """
+        for priority in sorted(self._queues, reverse=True):
+            queue = self._queues[priority]
+            if queue:
+                command = queue.popleft()
+                if command.key is not None:
+                    del self._pending[command.key]
+                logging.warning(f"Dropped the buffered command '{command.key}', the buffer is full")
+                self.metrics.increment("commands_dropped")
+                command.expired = True
+                command._set_done()
+                return
+
+    def _expire(self, command):
+        """
+        Drops a command that waited longer than its expiry
+        :param command: The ScheduledCommand
+        """
+        logging.warning(f"Dropped the command '{command.key}', it expired")
+        self.metrics.increment("commands_expired")
+        command.expired = True
+        command._set_done()
+
+    def _drop_expired(self):
+        """
+        Drops the buffered commands that expired while paused, so their callers do not wait for the resume
+        """
+        now = anyio.current_time()
+        for queue in self._queues.values():
+            for command in [command for command in queue if command.expires is not None and now >= command.expires]:
+                queue.remove(command)
+                if command.key is not None:
+                    del self._pending[command.key]
+                self._expire(command)
+        self.metrics.set_gauge("command_queue_depth", self.queue_depth)
+
+    def _until_next_expiry(self):
+        """
+        The number of seconds until the first buffered command expires
+        :return: The number of seconds, math.inf when no command expires
+        """
+        expires = [command.expires for queue in self._queues.values() for command in queue
+                   if command.expires is not None]
+        return max(0, min(expires) - anyio.current_time()) if expires else math.inf
+
+    def _next(self):
+        """
+        Takes the next command from the queue with the highest priority
+        :return: The ScheduledCommand, or None when the queues are empty
+        """
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            if queue:
+                command = queue.popleft()
+                if command.key is not None:
+                    del self._pending[command.key]
+                return command
+        return None
+
+    async def run(self):
+        """
+        The main loop sending the scheduled commands
+        """
+        while True:
+            if self.paused:
+                self._drop_expired()
+                with anyio.move_on_after(self._until_next_expiry()):
+                    await self._wakeup.wait()
+                    self._wakeup = anyio.Event()
+                continue
+
+            command = self._next()
+            if command is None:
+                await self._wakeup.wait()
+                self._wakeup = anyio.Event()
+                continue
+
+            self.metrics.set_gauge("command_queue_depth", self.queue_depth)
+            if command.expires is not None and anyio.current_time() > command.expires:
+                self._expire(command)
+                continue
+
+            try:
+                await command.function(*command.args)
+            except Exception as error:
+                logging.error(f"Unable to send command '{command.key}': {error}")
+                self.metrics.increment("command_errors")
+            command._set_done()
+            self.metrics.increment("commands_sent")
+            await anyio.sleep(self.interval)
@@ -0,0 +1,246 @@
+import logging
+import collections
+import json
+
+import anyio
+
+from elro.command import Command
+from elro.transport import UDPTransport
+from elro.utils import get_ascii, get_string_from_ascii, crc_maker_char
+
+
+class SimulatedDevice:
+    """
+    A device connected to the K1Simulator
+    """
+    def __init__(self, device_type, name, status="0464AAFF"):
+        """
+        Constructor
+        :param device_type: The device type as hex string, e.g. "0013" for a fire alarm
+        :param name: The name of the device
+        :param status: The device status as hex string, see DEVICE_STATUS_UPDATE in protocol.md
+        """
+        self.device_type = device_type
+        self.name = name
+        self.status = status
+
+
+class K1Simulator:
+    """
+    A simulated K1 connector speaking the UDP protocol of protocol.md. It answers the handshake and the
+    commands of the hub with the replies of a real K1, so the hub, the discovery and load tests can run
+    without hardware.
+    """
+    def __init__(self, hub_id, devices=None, host="127.0.0.1", port=0):
+        """
+        Constructor
+        :param hub_id: The id of the simulated K1 (ST_ followed by 12 hex characters)
+        :param devices: A dict with the SimulatedDevice objects by device id
+        :param host: The ip to listen on
+        :param port: The port to listen on, 0 picks a free port
+        """
+        self.id = hub_id
+        self.devices = {} if devices is None else devices
+        self.received = collections.Counter()
+        self.sent = 0
+
+        self.msg_id = 0
+        self.client = None
+        self.sock = UDPTransport()
+        self.address = self.sock.bind((host, port))
+
+    @property
+    def port(self):
+        """
+        The port the simulator listens on
+        :return: The port
+        """
+        return self.address[1]
+
+    async def serve(self, *, task_status=anyio.TASK_STATUS_IGNORED):
+        """
+        The main loop answering the datagrams. Use task_group.start(simulator.serve) to wait until it runs.
+        """
+        task_status.started(self.address)
+        try:
+            while True:
+                data, address = await self.sock.recvfrom(4096)
+                await self.handle_datagram(data, address)
+        finally:
+            self.sock.close()
+
+    async def handle_datagram(self, data, address):
+        """
+        Answers one datagram
+        :param data: The received bytes
+        :param address: The address of the sender
+        """
+        message = data.decode("utf-8", errors="replace")
+        if message.startswith("IOT_KEY?"):
+            self.received["handshake"] += 1
+            hub_id = message[len("IOT_KEY?"):]
+            if hub_id in ("", self.id):
+                self.client = address
+                await self.send_raw(f"NAME:{self.id}\nBIND:0\nKEY:0\n", address)
+            return
+
+        if message == "APP_answer_OK":
+            self.received["answer"] += 1
+            return
+
+        try:
+            data = json.loads(message)["params"]["data"]
+            command = Command(data["cmdId"])
+        except (ValueError, KeyError, TypeError) as error:
+            logging.warning(f"Simulator ignores '{message}': {error}")
+            self.received["invalid"] += 1
+            return
+
+        self.received[command.name] += 1
+        self.client = address
+        await self.handle_command(command, data)
+
+    async def handle_command(self, command, data):
+        """
+        Answers one command of the hub
+        :param command: The Command
+        :param data: The data of the command
+        """
+        if command == Command.GET_ALL_EQUIPMENT_STATUS:
+            for device_id in sorted(self.devices):
+                await self.send_status(device_id)
+            await self.send_status_over()
+        elif command == Command.SYN_DEVICE_STATUS:
+            for device_id in self.changed_devices(data.get("device_status", "")):
+                await self.send_status(device_id)
+            await self.send_status_over()
+        elif command == Command.GET_DEVICE_NAME:
+            for device_id in sorted(self.devices):
+                await self.send_name(device_id)
+            await self.send_data({"cmdId": Command.DEVICE_NAME_REPLY.value, "answer_content": "NAME_OVER"})
+        elif command == Command.SYN_SCENE:
+            await self.send_data({"cmdId": Command.SCENE_STATUS_UPDATE.value,
+                                  "sence_group": data.get("sence_group", 0),
+                                  "scene_content": "",
+                                  "answer_content": "OVER"})
+        elif command == Command.EQUIPMENT_CONTROL:
+            device_id = data["device_ID"]
+            for device in self._devices(device_id):
+                device.status = device.status[:4] + data["device_status"][:2] + device.status[6:]
+            if device_id in self.devices:
+                await self.send_status(device_id)
+        elif command == Command.MODIFY_EQUIPMENT_NAME:
+            device_id = data["device_ID"]
+            if device_id in self.devices:
+                self.devices[device_id].name = get_string_from_ascii(data["device_name"][:32])
+                await self.send_name(device_id)
+        elif command == Command.DELETE_EQUIPMENT:
+            device_id = data["device_ID"]
+            device = self.devices.pop(device_id, None)
+            if device is not None:
+                await self.send_data({"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                                      "device_ID": device_id,
+                                      "device_name": "DEL",
+                                      "device_status": device.status})
+
+    def _devices(self, device_id):
+        """
+        The devices a command applies to, device id 0 is every device
+        :param device_id: The device id of the command
+        :return: A list with the SimulatedDevice objects
+        """
+        if device_id == 0:
+            return list(self.devices.values())
+        try:
+            return [self.devices[device_id]]
+        except KeyError:
+            return []
+
+    def changed_devices(self, device_status):
+        """
+        The devices of which the status differs from the status known by the hub. The device status of a
+        SYN_DEVICE_STATUS command contains a CRC of the known status for every device id, see protocol.md.
+        :param device_status: The device status of the command, empty when the hub knows no status
+        :return: A sorted list with device ids
+        """
+        known = {}
+        for index in range(4, len(device_status) - 3, 4):
+            crc = device_status[index:index + 4]
+            if crc != "0000":
+                known[index // 4] = crc.upper()
+
+        return [device_id for device_id in sorted(self.devices)
+                if known.get(device_id) != crc_maker_char(self.devices[device_id].status)]
+
+    async def send_status(self, device_id):
+        """
+        Sends the status of a device
+        :param device_id: The id of the device
+        """
+        device = self.devices[device_id]
+        await self.send_data({"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                              "device_ID": device_id,
+                              "device_name": device.device_type,
+                              "device_status": device.status})
+
+    async def send_status_over(self):
+        """
+        Sends the end of a status sweep
+        """
+        await self.send_data({"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                              "device_ID": 65535,
+                              "device_name": "STATUES",
+                              "device_status": "OVER"})
+
+    async def send_name(self, device_id):
+        """
+        Sends the name of a device
+        :param device_id: The id of the device
+        """
+        name = get_ascii(self.devices[device_id].name)
+        await self.send_data({"cmdId": Command.DEVICE_NAME_REPLY.value,
+                              "answer_content": f"{device_id:04x}{name}"})
+
+    async def update_device(self, device_id, status):
+        """
+        Changes the status of a device and sends it to the hub, like a sensor that reports a change
+        :param device_id: The id of the device
+        :param status: The new device status
+        """
+        self.devices[device_id].status = status
+        await self.send_status(device_id)
+
+    async def trigger_alarm(self, device_id):
+        """
+        Sends an alarm of a device to the hub
+        :param device_id: The id of the device
+        """
+        device = self.devices[device_id]
+        payload = f"000BAD{device_id:04X}{device.device_type}{device.status}"
+        crc = crc_maker_char(payload)
+        await self.send_data({"cmdId": Command.DEVICE_ALARM_TRIGGER.value,
+                              "answer_content": f"{payload}{crc[2:]}{crc[:2]}"})
+
+    async def send_data(self, data):
+        """
+        Sends a command to the hub that connected last
+        :param data: A dict with the data of the command
+        """
+        if self.client is None:
+            logging.warning("Simulator has no connected hub")
+            return
+
+        self.msg_id += 1
+        message = {"msgId": self.msg_id,
+                   "action": "devSend",
+                   "params": {"devTid": self.id, "appTid": [], "data": data}}
+        await self.send_raw(json.dumps(message), self.client)
+
+    async def send_raw(self, message, address):
+        """
+        Sends a datagram
+        :param message: The message string
+        :param address: The address to send to
+        """
+        self.sent += 1
+        await self.sock.sendto(bytes(message, "utf-8"), address)
@@ -0,0 +1,96 @@
+import logging
+import json
+import os
+from abc import ABC, abstractmethod
+
+import anyio
+
+from elro.events import event_dict
+
+
+class EventSink(ABC):
+    """
+    The base of the outputs of a hub, e.g. MQTT or a local socket. A sink runs next to the hub and delivers its
+    events to the consumers.
+    """
+    @abstractmethod
+    async def handle_hub_events(self, hub):
+        """
+        Main loop delivering the events of the hub
+        :param hub: The hub to deliver the events of
+        """
+
+
+class UnixSocketSink(EventSink):
+    """
+    Streams the events of a hub as newline-delimited json to the local processes that connect to a Unix domain
+    socket, e.g. a siren controller that must react to alarms without a round trip over an MQTT broker. Every
+    client gets every event that is published after it connected. A client that does not keep up is disconnected,
+    so it cannot hold up the other clients or the hub.
+    """
+    def __init__(self, path, queue_size=256):
+        """
+        Constructor
+        :param path: The path of the socket, an existing socket is replaced
+        :param queue_size: The number of events that are queued for a client before it is disconnected
+        """
+        self.path = path
+        self.queue_size = queue_size
+        self.clients = set()
+        self.delivered = 0
+        self.dropped = 0
+
+    async def handle_hub_events(self, hub, *, task_status=anyio.TASK_STATUS_IGNORED):
+        """
+        Main loop accepting the clients and streaming the events of the hub to them
+        :param hub: The hub to stream the events of
+        :param task_status: Is started as soon as the socket accepts clients
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        listener = await anyio.create_unix_listener(self.path)
+        logging.info(f"Streaming the hub events on '{self.path}'")
+        try:
+            async with listener, anyio.create_task_group() as task_group:
+                task_group.start_soon(listener.serve, self.handle_client)
+                task_status.started()
+                async for event in hub.events():
+                    self.broadcast(event)
+        finally:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def broadcast(self, event):
+        """
+        Queues an event for all clients
+        :param event: The HubEvent
+        """
+        line = (json.dumps(event_dict(event)) + "\n").encode("utf-8")
+        for client in list(self.clients):
+            try:
+                client.send_nowait(line)
+                self.delivered += 1
+            except anyio.WouldBlock:
+                logging.warning(f"Disconnecting a client of '{self.path}' that is {self.queue_size} events behind")
+                self.clients.discard(client)
+                client.close()
+                self.dropped += 1
+
+    async def handle_client(self, stream):
+        """
+        Writes the queued events of a client to its connection
+        :param stream: The connection of the client
+        """
+        send_ch, receive_ch = anyio.create_memory_object_stream(self.queue_size)
+        self.clients.add(send_ch)
+        logging.info(f"Client connected to '{self.path}', {len(self.clients)} clients")
+        try:
+            async with stream, receive_ch:
+                async for line in receive_ch:
+                    await stream.send(line)
+        except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+            pass
+        finally:
+            self.clients.discard(send_ch)
+            send_ch.close()
+            logging.info(f"Client disconnected from '{self.path}', {len(self.clients)} clients")
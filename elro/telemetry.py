@@ -0,0 +1,110 @@
+import time
+
+
+class TelemetryWindow:
+    """
+    The minimum, maximum and last value of the battery level and signal strength of one device in a summary window
+    """
+    def __init__(self, started):
+        """
+        Constructor
+        :param started: The start of the window in seconds since the epoch
+        """
+        self.started = started
+        self.samples = 0
+        self.battery = None
+        self.signal = None
+
+    @staticmethod
+    def _add(stats, value):
+        if stats is None:
+            return {"min": value, "max": value, "last": value}
+        return {"min": min(stats["min"], value), "max": max(stats["max"], value), "last": value}
+
+    def add(self, battery, signal):
+        """
+        Adds a sample
+        :param battery: The battery level in percent
+        :param signal: The signal strength from 0 to 4
+        """
+        self.samples += 1
+        self.battery = TelemetryWindow._add(self.battery, battery)
+        self.signal = TelemetryWindow._add(self.signal, signal)
+
+    def summary(self, until):
+        """
+        The summary of the window
+        :param until: The end of the window in seconds since the epoch
+        :return: A dict with the window, the number of samples and the battery and signal statistics
+        """
+        return {"since": self.started,
+                "until": until,
+                "samples": self.samples,
+                "battery": self.battery,
+                "signal": self.signal}
+
+
+class TelemetryAggregator:
+    """
+    Aggregates the battery level and signal strength of the devices, which change slowly but arrive with every status
+    sweep. A sample is only published on a meaningful change, all samples are summarized per interval.
+    """
+    def __init__(self, interval=3600, battery_delta=5, signal_delta=1):
+        """
+        Constructor
+        :param interval: The number of seconds of a summary window
+        :param battery_delta: The change of the battery level in percent that is published immediately
+        :param signal_delta: The change of the signal strength that is published immediately
+        """
+        self.interval = interval
+        self.battery_delta = battery_delta
+        self.signal_delta = signal_delta
+        self.windows = {}
+        self.published = {}
+
+    def observe(self, device_id, battery, signal):
+        """
+        Adds a sample of a device
+        :param device_id: The id of the device
+        :param battery: The battery level in percent
+        :param signal: The signal strength from 0 to 4
+        :return: True if the sample is a meaningful change that should be published now
+        """
+        try:
+            window = self.windows[device_id]
+        except KeyError:
+            window = self.windows[device_id] = TelemetryWindow(time.time())
+        window.add(battery, signal)
+
+        try:
+            published_battery, published_signal = self.published[device_id]
+        except KeyError:
+            self.published[device_id] = (battery, signal)
+            return True
+
+        if abs(battery - published_battery) >= self.battery_delta or \
+                abs(signal - published_signal) >= self.signal_delta:
+            self.published[device_id] = (battery, signal)
+            return True
+        return False
+
+    def due(self, now=None):
+        """
+        The devices of which the summary window is over
+        :param now: The current time in seconds since the epoch, None for now
+        :return: A list with the device ids
+        """
+        now = time.time() if now is None else now
+        return [device_id for device_id, window in self.windows.items() if now - window.started >= self.interval]
+
+    def summarize(self, device_id, now=None):
+        """
+        Ends the summary window of a device, the next window starts with the next sample
+        :param device_id: The id of the device
+        :param now: The current time in seconds since the epoch, None for now
+        :return: The summary dict of the window
+        """
+        now = time.time() if now is None else now
+        window = self.windows.pop(device_id)
+        return window.summary(now)
+
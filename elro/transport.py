@@ -0,0 +1,97 @@
+import socket
+
+import anyio
+import anyio.lowlevel
+
+
+class UDPTransport:
+    """
+    A non-blocking UDP socket that works on every anyio backend (trio and asyncio), so the hub can share the
+    event loop of the application it runs in
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self._addresses = {}
+
+    def bind(self, address):
+        """
+        Binds the socket to a local address, to receive datagrams on it
+        :param address: A tuple with the ip and the port, port 0 picks a free port
+        :return: A tuple with the bound ip and port
+        """
+        self.sock.bind(address)
+        return self.sock.getsockname()[:2]
+
+    def enable_broadcast(self):
+        """
+        Allows sending datagrams to broadcast addresses
+        """
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    async def resolve(self, address):
+        """
+        Resolves a (host, port) address once, so hostnames are not looked up on every send
+        :param address: A tuple with the host and the port
+        :return: A tuple with the ip and the port
+        """
+        try:
+            return self._addresses[address]
+        except KeyError:
+            pass
+
+        host, port = address
+        info = await anyio.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self._addresses[address] = info[0][4][:2]
+        return self._addresses[address]
+
+    async def sendto(self, data, address):
+        """
+        Sends a datagram
+        :param data: The bytes to send
+        :param address: A tuple with the host and the port to send to
+        :return: The number of bytes sent
+        """
+        address = await self.resolve(address)
+        await anyio.lowlevel.checkpoint()
+        while True:
+            try:
+                return self.sock.sendto(data, address)
+            except BlockingIOError:
+                await anyio.wait_writable(self.sock)
+
+    async def recv(self, size):
+        """
+        Receives a datagram
+        :param size: The maximum number of bytes to receive
+        :return: The received bytes
+        """
+        await anyio.lowlevel.checkpoint()
+        while True:
+            try:
+                return self.sock.recv(size)
+            except BlockingIOError:
+                await anyio.wait_readable(self.sock)
+
+    async def recvfrom(self, size):
+        """
+        Receives a datagram with the address it was sent from
+        :param size: The maximum number of bytes to receive
+        :return: A tuple with the received bytes and a tuple with the ip and the port of the sender
+        """
+        await anyio.lowlevel.checkpoint()
+        while True:
+            try:
+                data, address = self.sock.recvfrom(size)
+                return data, address[:2]
+            except BlockingIOError:
+                await anyio.wait_readable(self.sock)
+
+    def close(self):
+        """
+        Closes the socket
+        """
+        self.sock.close()
@@ -0,0 +1,109 @@
+import logging
+
+import anyio
+
+
+class Watchdog:
+    """
+    Measures the round trip time of the polls of the hub and judges the liveness of the K1 from it. A poll is
+    timestamped when it is sent, the first matching reply (the end of the status sweep or of the names) ends it.
+    The K1 is degraded when a poll is not answered in time, and down when it is not answered at all.
+    """
+    UP = "up"
+    DEGRADED = "degraded"
+    DOWN = "down"
+
+    STATUS = "status"
+    NAMES = "names"
+
+    def __init__(self, metrics, degraded_after=5, down_after=30):
+        """
+        Constructor
+        :param metrics: The metrics to record the round trip times and the state in
+        :param degraded_after: The number of seconds after which an unanswered poll makes the K1 degraded
+        :param down_after: The number of seconds after which an unanswered poll makes the K1 down
+        """
+        self.metrics = metrics
+        self.degraded_after = degraded_after
+        self.down_after = down_after
+        self.state = Watchdog.UP
+        self.last_rtt = None
+        self._pending = {}
+
+    def sent(self, kind):
+        """
+        Timestamps a poll, a poll that is still waiting for its reply keeps its first timestamp
+        :param kind: Watchdog.STATUS or Watchdog.NAMES
+        """
+        self._pending.setdefault(kind, anyio.current_time())
+
+    def replied(self, kind):
+        """
+        Ends a poll with its reply
+        :param kind: Watchdog.STATUS or Watchdog.NAMES
+        :return: True if the state of the K1 changed
+        """
+        try:
+            sent = self._pending.pop(kind)
+        except KeyError:
+            return self._set_state(self._judge())
+
+        self.last_rtt = anyio.current_time() - sent
+        self.metrics.observe("rtt", self.last_rtt)
+        self.metrics.observe(f"rtt.{kind}", self.last_rtt)
+        return self._set_state(self._judge())
+
+    def check(self):
+        """
+        Judges the state of the K1 from the polls that are waiting for their reply
+        :return: True if the state of the K1 changed
+        """
+        return self._set_state(self._judge())
+
+    def _judge(self):
+        """
+        The state of the K1 by the oldest unanswered poll
+        :return: The state
+        """
+        if not self._pending:
+            return Watchdog.UP
+        waiting = anyio.current_time() - min(self._pending.values())
+        if waiting >= self.down_after:
+            return Watchdog.DOWN
+        if waiting >= self.degraded_after:
+            return Watchdog.DEGRADED
+        return Watchdog.UP
+
+    def _set_state(self, state):
+        """
+        Changes the state of the K1
+        :param state: The new state
+        :return: True if the state changed
+        """
+        self.metrics.set_gauge("hub_health", [Watchdog.UP, Watchdog.DEGRADED, Watchdog.DOWN].index(state))
+        if state == self.state:
+            return False
+
+        logging.warning(f"K1 is {state}, it was {self.state}")
+        self.state = state
+        self.metrics.increment(f"hub_{state}")
+        return True
+
+    def reset(self):
+        """
+        Forgets the unanswered polls, e.g. after a reconnect
+        """
+        self._pending.clear()
+
+    def summary(self):
+        """
+        The state and the round trip times, ready to be published
+        :return: A dict with the state, the last round trip time and its percentiles in milliseconds
+        """
+        def milliseconds(seconds):
+            return None if seconds is None else round(seconds * 1000, 1)
+
+        return {"state": self.state,
+                "rtt": milliseconds(self.last_rtt),
+                "rtt_p50": milliseconds(self.metrics.percentile("rtt", 50)),
+                "rtt_p95": milliseconds(self.metrics.percentile("rtt", 95))}
@@ -0,0 +1,93 @@
+import trio
+import trio.testing
+
+from elro.broadcast import Broadcast
+from elro.device import create_device_from_data, DeviceType
+from elro.command import Command
+
+
+async def test_wait_returns_after_notify():
+    broadcast = Broadcast()
+    versions = []
+
+    async def waiter():
+        versions.append(await broadcast.wait())
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(waiter)
+        await trio.testing.wait_all_tasks_blocked()
+        broadcast.notify()
+    assert versions == [1]
+
+
+async def test_wait_returns_immediately_for_missed_changes():
+    broadcast = Broadcast()
+    broadcast.notify()
+    broadcast.notify()
+    with trio.fail_after(1):
+        assert await broadcast.wait(0) == 2
+
+
+def test_notify_without_waiters_allocates_no_event():
+    broadcast = Broadcast()
+    broadcast.notify()
+    assert broadcast._changed is None
+    assert broadcast.version == 1
+
+
+async def test_subscribers_miss_no_changes_in_bursts():
+    broadcast = Broadcast()
+    bursts, burst_size = 50, 20
+    seen = {subscriber: 0 for subscriber in range(5)}
+
+    async def subscriber(number):
+        version = 0
+        while version < bursts * burst_size:
+            new_version = await broadcast.wait(version)
+            seen[number] += new_version - version
+            version = new_version
+            # A slow subscriber, changes happen while it is busy
+            await trio.sleep(0.001 * number)
+
+    async with trio.open_nursery() as nursery:
+        for number in seen:
+            nursery.start_soon(subscriber, number)
+        for _ in range(bursts):
+            for _ in range(burst_size):
+                broadcast.notify()
+            await trio.sleep(0)
+    assert broadcast.version == bursts * burst_size
+    assert all(count == bursts * burst_size for count in seen.values())
+
+
+async def test_subscribe_yields_the_versions():
+    broadcast = Broadcast()
+    versions = []
+
+    async def subscriber():
+        async for version in broadcast.subscribe():
+            versions.append(version)
+            if version >= 3:
+                break
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(subscriber)
+        await trio.testing.wait_all_tasks_blocked()
+        broadcast.notify()
+        await trio.testing.wait_all_tasks_blocked()
+        broadcast.notify()
+        broadcast.notify()
+    assert versions == [1, 3]
+
+
+async def test_device_updates_are_not_lost_between_waits():
+    device = create_device_from_data({"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                                               "device_name": DeviceType.CO_ALARM.value,
+                                               "device_ID": 1,
+                                               "device_status": "0464AA00"}})
+    version = device.updated.version
+    # The updates happen while the subscriber is not waiting
+    device.battery_level = 50
+    device.device_state = "Alarm"
+    with trio.fail_after(1):
+        assert await device.updated.wait(version) == version + 2
@@ -0,0 +1,31 @@
+from elro.cache import HubIdCache, default_cache_path
+
+
+def test_cache_path_follows_xdg_cache_home(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_cache_path() == str(tmp_path / "elro" / "hub_ids.json")
+
+
+def test_cache_returns_none_without_cache_file(tmp_path):
+    cache = HubIdCache(str(tmp_path / "hub_ids.json"))
+    assert cache.get("k1.local") is None
+
+
+def test_cache_stores_ids_by_hostname(tmp_path):
+    path = str(tmp_path / "elro" / "hub_ids.json")
+    HubIdCache(path).set("k1.local", "ST_aaaaaaaaaaaa")
+    HubIdCache(path).set("192.168.1.2", "ST_bbbbbbbbbbbb")
+
+    cache = HubIdCache(path)
+    assert cache.get("k1.local") == "ST_aaaaaaaaaaaa"
+    assert cache.get("192.168.1.2") == "ST_bbbbbbbbbbbb"
+
+
+def test_cache_ignores_corrupt_cache_file(tmp_path):
+    path = tmp_path / "hub_ids.json"
+    path.write_text("not json")
+
+    cache = HubIdCache(str(path))
+    assert cache.get("k1.local") is None
+    cache.set("k1.local", "ST_aaaaaaaaaaaa")
+    assert cache.get("k1.local") == "ST_aaaaaaaaaaaa"
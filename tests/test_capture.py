@@ -0,0 +1,71 @@
+import pytest
+from asynctest.mock import CoroutineMock
+
+from elro.capture import CaptureWriter, ReplayTransport, RECEIVED, SENT, read_capture, replay
+from elro.hub import Hub
+
+STATUS = b'{"msgId": 1, "action": "devSend", "params": {"devTid": "ST_aaaaaaaaaaaa", "appTid": [], "data": ' \
+         b'{"cmdId": 19, "device_ID": 3, "device_name": "0013", "device_status": "0464AAFF"}}}'
+
+
+def test_capture_roundtrip(tmp_path):
+    path = str(tmp_path / "k1.cap")
+    writer = CaptureWriter(path)
+    writer.record(SENT, b"IOT_KEY?ST_aaaaaaaaaaaa")
+    writer.record(RECEIVED, b"NAME:ST_aaaaaaaaaaaa")
+    writer.close()
+
+    records = list(read_capture(path))
+    assert [(direction, data) for _, direction, data in records] == [(SENT, b"IOT_KEY?ST_aaaaaaaaaaaa"),
+                                                                    (RECEIVED, b"NAME:ST_aaaaaaaaaaaa")]
+    assert records[0][0] <= records[1][0]
+
+
+def test_capture_appends_and_stops_at_an_incomplete_record(tmp_path):
+    path = str(tmp_path / "k1.cap")
+    for _ in range(2):
+        writer = CaptureWriter(path)
+        writer.record(RECEIVED, b"NAME:ST_aaaaaaaaaaaa")
+        writer.close()
+    with open(path, "ab") as capture:
+        capture.write(b"\x00\x01")
+
+    assert len(list(read_capture(path))) == 2
+
+
+def test_read_capture_rejects_other_files(tmp_path):
+    path = tmp_path / "k1.cap"
+    path.write_bytes(b"not a capture")
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
+
+
+async def test_replay_feeds_the_received_datagrams_to_the_hub(tmp_path, autojump_clock):
+    path = str(tmp_path / "k1.cap")
+    writer = CaptureWriter(path)
+    writer.record(SENT, b"IOT_KEY?ST_aaaaaaaaaaaa")
+    writer.record(RECEIVED, b"NAME:ST_aaaaaaaaaaaa")
+    writer.record(RECEIVED, STATUS)
+    writer.close()
+
+    hub = Hub("127.0.0.1", 1025, "ST_aaaaaaaaaaaa")
+    hub.sock = ReplayTransport()
+    assert await replay(hub, path, speed=0) == 2
+
+    assert hub.connected
+    assert hub.devices[3].device_state == "Normal"
+    assert hub.sock.sent == [b"APP_answer_OK"]
+
+
+async def test_hub_captures_sent_and_received_datagrams(tmp_path):
+    path = str(tmp_path / "k1.cap")
+    hub = Hub("127.0.0.1", 1025, "ST_aaaaaaaaaaaa")
+    hub.sock = ReplayTransport()
+    hub.sock.recv = CoroutineMock(return_value=b"NAME:ST_aaaaaaaaaaaa")
+    hub.capture = CaptureWriter(path)
+    await hub.send_data("IOT_KEY?ST_aaaaaaaaaaaa")
+    await hub.receive_data()
+    hub.capture.close()
+
+    assert [(direction, data) for _, direction, data in read_capture(path)] == \
+           [(SENT, b"IOT_KEY?ST_aaaaaaaaaaaa"), (RECEIVED, b"NAME:ST_aaaaaaaaaaaa")]
@@ -0,0 +1,44 @@
+from unittest.mock import patch
+
+from elro.dedup import DuplicateFilter
+
+
+def test_first_datagram_is_not_a_duplicate():
+    dedup = DuplicateFilter()
+    assert dedup.is_duplicate(1, "luke") is False
+
+
+def test_same_datagram_is_a_duplicate():
+    dedup = DuplicateFilter()
+    dedup.is_duplicate(1, "luke")
+    assert dedup.is_duplicate(1, "luke") is True
+
+
+def test_same_msg_id_with_other_payload_is_not_a_duplicate():
+    dedup = DuplicateFilter()
+    dedup.is_duplicate(1, "luke")
+    assert dedup.is_duplicate(1, "leia") is False
+
+
+def test_datagram_without_msg_id_is_never_a_duplicate():
+    dedup = DuplicateFilter()
+    dedup.is_duplicate(None, "luke")
+    assert dedup.is_duplicate(None, "luke") is False
+    assert len(dedup) == 0
+
+
+def test_oldest_datagram_is_forgotten_when_window_is_full():
+    dedup = DuplicateFilter(size=2)
+    dedup.is_duplicate(1, "luke")
+    dedup.is_duplicate(2, "leia")
+    dedup.is_duplicate(3, "han")
+    assert len(dedup) == 2
+    assert dedup.is_duplicate(1, "luke") is False
+
+
+def test_datagram_is_forgotten_after_max_age():
+    dedup = DuplicateFilter(max_age=10)
+    with patch("elro.dedup.time.monotonic", return_value=100):
+        dedup.is_duplicate(1, "luke")
+    with patch("elro.dedup.time.monotonic", return_value=111):
+        assert dedup.is_duplicate(1, "luke") is False
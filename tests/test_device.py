@@ -1,7 +1,4 @@
-from unittest.mock import MagicMock
-
 import pytest
-import trio
 
 from elro.device import create_device_from_data, WindowSensor, AlarmSensor, DeviceType
 from elro.command import Command
@@ -78,26 +75,31 @@ def test_factory_creates_the_right_type_for_fire_sensor():
 
 
 def test_calling_update_fires_updated_event(device, update_data):
-    event_set = MagicMock()
-    device.updated.set = event_set
+    version = device.updated.version
     device.update(update_data)
-    event_set.assert_called_once_with()
-    assert isinstance(device.updated, trio.Event)
-    assert device.updated.is_set() is False
+    assert device.updated.version > version
 
 
 def test_setting_device_state_fires_updated_event(device, update_data):
-    event_set = MagicMock()
-    device.updated.set = event_set
+    version = device.updated.version
     device.device_state = "anakin"
-    event_set.assert_called_once_with()
+    assert device.updated.version == version + 1
 
 
 def test_setting_battery_level_fires_updated_event(device, update_data):
-    event_set = MagicMock()
-    device.updated.set = event_set
+    version = device.updated.version
     device.battery_level = 42
-    event_set.assert_called_once_with()
+    assert device.updated.version == version + 1
+
+
+def test_alarm_event_fires_alarm_and_updated_events(alarm_device, update_data):
+    alarm_version = alarm_device.alarm.version
+    updated_version = alarm_device.updated.version
+    update_data['data']['device_name'] = DeviceType.CO_ALARM.value
+    update_data['data']['device_status'] = '0464AABB'
+    alarm_device.send_alarm_event(update_data)
+    assert alarm_device.alarm.version == alarm_version + 1
+    assert alarm_device.updated.version > updated_version
 
 
 def test_update_window_sensor_to_open_sets_correct_state(device, update_data):
@@ -126,3 +128,10 @@ def test_update_alarm_sensor_to_alarm_sets_correct_state(alarm_device, update_da
     update_data['data']['device_status'] = '  2ABB  '
     alarm_device.update_specifics(update_data)
     assert alarm_device.device_state == "Test Alarm"
+
+
+def test_setting_the_same_name_fires_no_updated_event(device):
+    device.name = "leia"
+    version = device.updated.version
+    device.name = "leia"
+    assert device.updated.version == version
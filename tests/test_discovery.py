@@ -0,0 +1,36 @@
+import anyio
+
+from elro.discovery import discover, parse_reply, probe_addresses
+from elro.simulator import K1Simulator
+
+
+def test_probe_addresses_of_a_network():
+    addresses = probe_addresses("192.168.1.0/24")
+    assert len(addresses) == 254
+    assert addresses[0] == "192.168.1.1"
+    assert addresses[-1] == "192.168.1.254"
+    assert probe_addresses("255.255.255.255") == ["255.255.255.255"]
+
+
+def test_parse_reply():
+    assert parse_reply(b"NAME:ST_aaaaaaaaaaaa\nBIND:0\nKEY:0\n") == "ST_aaaaaaaaaaaa"
+    assert parse_reply(b"APP_answer_OK") is None
+
+
+async def test_discover_finds_the_simulator():
+    sim = K1Simulator("ST_aaaaaaaaaaaa")
+    async with anyio.create_task_group() as task_group:
+        await task_group.start(sim.serve)
+        with anyio.fail_after(2):
+            hubs = await discover("127.0.0.1", sim.port, timeout=5)
+        task_group.cancel_scope.cancel()
+
+    assert len(hubs) == 1
+    assert hubs[0].address == "127.0.0.1"
+    assert hubs[0].hub_id == "ST_aaaaaaaaaaaa"
+    assert hubs[0].response_time >= 0
+
+
+async def test_discover_returns_nothing_without_hubs(autojump_clock):
+    hubs = await discover("127.0.0.0/30", 9, timeout=1)
+    assert hubs == []
@@ -0,0 +1,54 @@
+import dataclasses
+
+import pytest
+import trio
+import trio.testing
+
+from elro.events import EventStream, DeviceRemoved, HubConnected
+
+
+async def test_publish_assigns_increasing_sequence_numbers():
+    stream = EventStream()
+    first = stream.publish(HubConnected, hub_id="ST_aaaaaaaaaaaa")
+    second = stream.publish(DeviceRemoved, device_id=3)
+    assert (first.sequence, second.sequence) == (1, 2)
+
+
+async def test_events_are_immutable():
+    event = EventStream().publish(DeviceRemoved, device_id=3)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        event.device_id = 4
+
+
+async def test_subscriber_receives_every_event_of_a_burst():
+    stream = EventStream()
+    received = []
+
+    async def subscriber():
+        async for event in stream.subscribe():
+            received.append(event.device_id)
+            await trio.sleep(0.001)  # a slow consumer
+            if len(received) == 100:
+                return
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(subscriber)
+        await trio.testing.wait_all_tasks_blocked()
+        for i in range(100):
+            stream.publish(DeviceRemoved, device_id=i)
+
+    assert received == list(range(100))
+
+
+async def test_subscriber_can_resume_after_a_sequence_number():
+    stream = EventStream()
+    for i in range(5):
+        stream.publish(DeviceRemoved, device_id=i)
+    assert [event.device_id for event in stream.since(3)] == [3, 4]
+
+
+async def test_subscriber_that_is_too_far_behind_continues_with_the_oldest_kept_event():
+    stream = EventStream(size=3)
+    for i in range(5):
+        stream.publish(DeviceRemoved, device_id=i)
+    assert [event.sequence for event in stream.since(0)] == [3, 4, 5]
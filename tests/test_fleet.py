@@ -0,0 +1,51 @@
+import json
+
+import pytest
+from asynctest.mock import MagicMock
+
+from elro.fleet import FleetCoordinator, load_fleet, shard, worker_report
+
+
+def test_shard_divides_the_hubs_round_robin():
+    assert shard([1, 2, 3, 4, 5], 2) == [[1, 3, 5], [2, 4]]
+    assert shard([1, 2], 4) == [[1], [2]]
+
+
+def test_load_fleet(tmp_path):
+    path = tmp_path / "fleet.json"
+    path.write_text(json.dumps([{"hostname": "k1-a.local", "id": "ST_aaaaaaaaaaaa"}]))
+    assert load_fleet(str(path)) == [{"hostname": "k1-a.local", "id": "ST_aaaaaaaaaaaa"}]
+
+    path.write_text(json.dumps([{"hostname": "k1-a.local"}]))
+    with pytest.raises(ValueError):
+        load_fleet(str(path))
+
+
+def test_worker_report():
+    hub = MagicMock()
+    hub.id = "ST_aaaaaaaaaaaa"
+    hub.connected = True
+    hub.devices = {1: None}
+    hub.metrics.counters = {"commands_sent": 2}
+    report = worker_report(3, [hub])
+    assert report["worker"] == 3
+    assert report["hubs"] == {"ST_aaaaaaaaaaaa": {"connected": True, "devices": 1, "counters": {"commands_sent": 2}}}
+
+
+def test_coordinator_aggregates_the_worker_reports():
+    hubs = [{"hostname": f"k1-{index}.local", "id": f"ST_00000000000{index}"} for index in range(3)]
+    coordinator = FleetCoordinator(hubs, 2, "localhost")
+    coordinator.reports = {
+        0: {"worker": 0, "pid": 1, "hubs": {"ST_000000000000": {"connected": True, "devices": 2,
+                                                                 "counters": {"commands_sent": 2}},
+                                            "ST_000000000002": {"connected": False, "devices": 0,
+                                                                 "counters": {}}}},
+        1: {"worker": 1, "pid": 2, "hubs": {"ST_000000000001": {"connected": True, "devices": 3,
+                                                                 "counters": {"commands_sent": 5}}}}}
+
+    health = coordinator.health()
+    assert health["workers"] == 2
+    assert health["hubs"] == 3
+    assert health["connected"] == 2
+    assert health["devices"] == 5
+    assert health["counters"] == {"commands_sent": 7}
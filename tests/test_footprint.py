@@ -0,0 +1,15 @@
+import pytest
+
+from elro.footprint import measure_footprint
+
+# The memory budgets for small boards, a regression beyond these fails the test
+BYTES_PER_DEVICE = 8 * 1024
+BYTES_PER_TASK = 10 * 1024
+
+
+@pytest.mark.parametrize("devices", [10, 100])
+async def test_footprint_stays_within_the_budget(devices):
+    result = await measure_footprint(devices)
+    assert result["devices"] == devices
+    assert 0 < result["bytes_per_device"] <= BYTES_PER_DEVICE
+    assert 0 < result["bytes_per_task"] <= BYTES_PER_TASK
@@ -0,0 +1,39 @@
+from elro.events import DeviceUpdated
+from elro.history import DeviceHistory, HistoryStore
+
+
+def test_history_keeps_the_samples_in_order():
+    history = DeviceHistory(4)
+    history.append(1.0, "Normal", 100, 4)
+    history.append(2.0, "Alarm", 99, 3)
+    assert len(history) == 2
+    assert history.window() == [{"timestamp": 1.0, "state": "Normal", "battery": 100, "signal": 4},
+                                {"timestamp": 2.0, "state": "Alarm", "battery": 99, "signal": 3}]
+
+
+def test_history_overwrites_the_oldest_samples():
+    history = DeviceHistory(4)
+    for second in range(10):
+        history.append(float(second), "Normal", 100 - second, 4)
+    assert len(history) == 4
+    assert [sample["timestamp"] for sample in history.window()] == [6.0, 7.0, 8.0, 9.0]
+    assert [sample["battery"] for sample in history.window()] == [94, 93, 92, 91]
+
+
+def test_history_window_and_limit():
+    history = DeviceHistory(8)
+    for second in range(10):
+        history.append(float(second), "Normal", 100, -1)
+    assert [sample["timestamp"] for sample in history.window(since=4, until=6)] == [4.0, 5.0, 6.0]
+    assert [sample["timestamp"] for sample in history.window(limit=2)] == [8.0, 9.0]
+    assert history.window(since=20) == []
+
+
+def test_history_store_records_device_events():
+    store = HistoryStore(4)
+    store.record(DeviceUpdated(sequence=1, timestamp=1.0, device_id=3, device_type="FIRE_ALARM", name="Hall",
+                               state="Normal", battery=100, signal=4))
+    assert store.query(3) == [{"timestamp": 1.0, "state": "Normal", "battery": 100, "signal": 4}]
+    assert store.query(4) == []
+    store.forget(3)
+    assert store.query(3) == []
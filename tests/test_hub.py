@@ -1,7 +1,14 @@
+import json
+
+import anyio
 import pytest
+import trio
+import trio.testing
 from asynctest.mock import CoroutineMock, MagicMock
 from elro.hub import Hub
 from elro.command import Command
+from elro.device import create_device_from_data
+from elro.utils import get_ascii, get_eq_crc
 
 
 @pytest.fixture
@@ -59,6 +66,16 @@ async def test_recv_data_sets_connected_on_name_response(hub):
     assert hub.connected == True
 
 
+async def test_every_hub_keeps_its_own_keys():
+    hubs = [Hub("127.0.0.1", 1025, "ST_aaaaaaaaaaaa"), Hub("127.0.0.1", 1026, "ST_bbbbbbbbbbbb")]
+    await hubs[0].handle_datagram(b"NAME:ST_aaaaaaaaaaaa\nBIND:1\nKEY:25\n")
+    await hubs[1].handle_datagram(b"NAME:ST_bbbbbbbbbbbb\nBIND:2\nKEY:42\n")
+    assert [(hub.ctrl_key, hub.bind_key) for hub in hubs] == [("25", "1"), ("42", "2")]
+    assert '"ctrlKey":"25"' in hubs[0].construct_message("{}")
+    for hub in hubs:
+        hub.sock.close()
+
+
 async def test_recv_handles_answer_ok_response_correctly(hub):
     hub.sock.recv = CoroutineMock(return_value="  {ST_answer_OK} ")
     hub.handle_command = MagicMock()
@@ -73,6 +90,24 @@ async def test_recv_handles_commands_correctly(hub):
     hub.handle_command.assert_awaited_with("fortytwo")
 
 
+async def test_recv_suppresses_duplicate_commands(hub):
+    hub.sock.recv = CoroutineMock(return_value='  {"msgId":7,"params":"fortytwo"} ')
+    hub.handle_command = CoroutineMock()
+    await hub.receive_data()
+    await hub.receive_data()
+    hub.handle_command.assert_awaited_once_with("fortytwo")
+    assert hub.metrics.counters["duplicates_suppressed"] == 1
+
+
+async def test_recv_answers_duplicate_commands(hub):
+    hub.sock.recv = CoroutineMock(return_value='  {"msgId":7,"params":"fortytwo"} ')
+    hub.handle_command = CoroutineMock()
+    await hub.receive_data()
+    await hub.receive_data()
+    assert hub.sock.sendto.await_count == 2
+    hub.sock.sendto.assert_awaited_with(b"APP_answer_OK", ("127.0.0.1", 1025))
+
+
 async def test_update_on_new_device_adds_device(hub, update_data):
     size = len(hub.devices)
     await hub.handle_command(update_data)
@@ -169,3 +204,342 @@ async def test_replace_device_sends_right_command(hub):
     hub.sock.sendto.assert_awaited_with(b'{"msgId":1,"action":"appSend","params":{"devTid":"ST_aaaaaaaaaaaa",'
                                         b'"ctrlKey":"25","appTid":"0","data":{"cmdId":3}}}',
                                         ('127.0.0.1', 1025))
+
+
+async def test_bulk_update_sends_all_operations_and_aggregates_the_result(hub, update_data):
+    for device_id in (3, 4):
+        update_data["data"]["device_ID"] = device_id
+        hub.devices[device_id] = create_device_from_data(update_data)
+    hub.scheduler.interval = 0
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(hub.scheduler.run)
+        result = await hub.bulk_update([{"id": 3, "name": "Kitchen"},
+                                        {"id": 4, "state": "test alarm"},
+                                        {"id": 5, "name": "Unknown"},
+                                        {"id": 4, "remove": True}])
+        await trio.testing.wait_all_tasks_blocked()
+        nursery.cancel_scope.cancel()
+
+    assert [operation["id"] for operation in result["succeeded"]] == [3, 4, 4]
+    assert [failure["operation"]["id"] for failure in result["failed"]] == [5]
+    # The three operations, then the rename fetches the names again, at poll priority
+    sent = [call[0][0] for call in hub.sock.sendto.await_args_list]
+    assert len(sent) == 4
+    assert b'"cmdId":14,' in sent[-1]
+    assert 4 not in hub.devices
+
+
+async def test_bulk_update_validates_like_the_single_commands(hub, update_data):
+    update_data["data"]["device_ID"] = 3
+    hub.devices[3] = create_device_from_data(update_data)
+    result = await hub.bulk_update([{"id": 0, "remove": True},
+                                    {"id": 5, "remove": True},
+                                    {"id": 3, "state": "silence"}])
+    assert result["succeeded"] == []
+    assert [failure["operation"]["id"] for failure in result["failed"]] == [0, 5, 3]
+    assert hub.sock.sendto.await_count == 0
+    assert 3 in hub.devices
+
+
+async def test_bulk_update_merges_operations_for_the_same_device(hub, update_data):
+    update_data["data"]["device_ID"] = 3
+    hub.devices[3] = create_device_from_data(update_data)
+    hub.scheduler.interval = 0
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(hub.scheduler.run)
+        await hub.bulk_update([{"id": 3, "name": "Kitchen"}, {"id": 3, "name": "Hall"}])
+        nursery.cancel_scope.cancel()
+
+    renames = [call[0][0] for call in hub.sock.sendto.await_args_list if b'"cmdId":5,' in call[0][0]]
+    assert len(renames) == 1
+    assert b"48616c6c" in renames[0]
+
+
+async def test_bulk_update_reports_dropped_operations_as_failed(hub, update_data):
+    for device_id in (3, 4):
+        update_data["data"]["device_ID"] = device_id
+        hub.devices[device_id] = create_device_from_data(update_data)
+    hub.scheduler.interval = 0
+    hub.scheduler.max_buffered = 1
+    hub.scheduler.pause()
+
+    async def resume():
+        await trio.testing.wait_all_tasks_blocked()
+        hub.scheduler.resume()
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(hub.scheduler.run)
+        nursery.start_soon(resume)
+        # The buffer holds one command, so the first state is dropped for the second one
+        result = await hub.bulk_update([{"id": 3, "state": "test alarm"}, {"id": 4, "state": "test alarm"}])
+        nursery.cancel_scope.cancel()
+
+    assert [operation["id"] for operation in result["succeeded"]] == [4]
+    assert [failure["operation"]["id"] for failure in result["failed"]] == [3]
+    assert hub.sock.sendto.await_count == 1
+
+
+@pytest.fixture
+def scene_data():
+    return {"data": {"cmdId": Command.SCENE_STATUS_UPDATE.value,
+                     "sence_group": 0,
+                     "scene_content": "0102",
+                     "answer_content": "000240404040404040404b69746368656e24"}}
+
+
+async def test_scene_status_update_adds_scene_to_the_index(hub, scene_data):
+    version = hub.scenes_updated.version
+    await hub.handle_command(scene_data)
+    assert hub.scenes[2].name == "Kitchen"
+    assert hub.scene_by_name("kitchen") is hub.scenes[2]
+    assert hub.scenes_updated.version == version + 1
+
+
+async def test_scene_status_update_ignores_the_end_of_the_sync(hub):
+    data = {"data": {"cmdId": Command.SCENE_STATUS_UPDATE.value,
+                     "answer_content": "SCENE_OVER"}}
+    await hub.handle_command(data)
+    assert hub.scenes == {}
+
+
+async def test_trigger_scene_sends_the_right_command(hub, scene_data):
+    await hub.handle_command(scene_data)
+    await hub.trigger_scene(2)
+    hub.sock.sendto.assert_awaited_with(b'{"msgId":1,"action":"appSend","params":{"devTid":"ST_aaaaaaaaaaaa",'
+                                        b'"ctrlKey":"0","appTid":"0","data":{"cmdId":32,"sence_group":2}}}',
+                                        ('127.0.0.1', 1025))
+
+
+async def test_trigger_unknown_scene_sends_nothing(hub):
+    await hub.trigger_scene(2)
+    hub.sock.sendto.assert_not_awaited()
+
+
+async def test_status_update_publishes_device_updated_event(hub):
+    data = {"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                     "device_name": "0101",
+                     "device_ID": 3,
+                     "device_status": "0464AA00"}}
+    hub.devices[3] = create_device_from_data(data)
+    data["data"]["device_status"] = "04645500"
+    await hub.handle_command(data)
+    events = hub.event_stream.since(0)
+    assert [type(event).__name__ for event in events] == ["DeviceUpdated"]
+    assert events[0].device_id == 3
+    assert events[0].state == "Open"
+
+
+async def test_unchanged_status_update_publishes_no_event(hub):
+    data = {"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                     "device_name": "0101",
+                     "device_ID": 3,
+                     "device_status": "0464AA00"}}
+    hub.devices[3] = create_device_from_data(data)
+    await hub.handle_command(data)
+    await hub.handle_command(data)
+    assert [type(event).__name__ for event in hub.event_stream.since(0)] == ["DeviceUpdated"]
+
+
+async def test_remove_device_publishes_device_removed_event(hub, update_data):
+    update_data["data"]["device_ID"] = 3
+    hub.devices[3] = create_device_from_data(update_data)
+    await hub.remove_device(3)
+    events = hub.event_stream.since(0)
+    assert type(events[0]).__name__ == "DeviceRemoved"
+    assert events[0].device_id == 3
+
+
+async def test_recv_failures_disconnect_instead_of_exiting(hub, autojump_clock):
+    hub.sock.recv = CoroutineMock(return_value="  NAME:ST_aaaaaaaaaaaa ")
+    await hub.receive_data()
+    hub.sock.recv = CoroutineMock(side_effect=OSError("network is down"))
+    await hub.receive_data()
+    assert hub.connected == False
+    assert hub.metrics.counters["hub_disconnects"] == 1
+    assert [type(event).__name__ for event in hub.event_stream.since(0)] == ["HubConnected", "HubDisconnected"]
+
+
+async def test_supervisor_reconnects_with_backoff_when_the_hub_is_silent(hub, autojump_clock):
+    hub.sock.recv = CoroutineMock(return_value="  NAME:ST_aaaaaaaaaaaa ")
+    await hub.receive_data()
+    handshakes = []
+    hub.sock.sendto = CoroutineMock(side_effect=lambda data, address: handshakes.append(trio.current_time()))
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(hub.connection_supervisor)
+        await trio.sleep(150)
+        assert hub.connected == False
+        assert len(handshakes) >= 3
+        assert handshakes[2] - handshakes[1] == 2 * (handshakes[1] - handshakes[0])
+
+        await hub.receive_data()
+        await trio.sleep(60)
+        assert hub.connected == True
+        nursery.cancel_scope.cancel()
+
+    assert hub.metrics.counters["hub_reconnects"] == 1
+    assert hub.metrics.timings["outage_duration"][0] > 0
+
+
+async def test_commands_are_buffered_while_disconnected_and_flushed_on_reconnect(hub, autojump_clock):
+    hub.sock.recv = CoroutineMock(return_value="  NAME:ST_aaaaaaaaaaaa ")
+    await hub.receive_data()
+    hub.set_disconnected("test")
+    sent = []
+
+    async def send(name):
+        sent.append(name)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(hub.scheduler.run)
+        hub.scheduler.schedule(("name", 3), 0, send, "Kitchen")
+        hub.scheduler.schedule(("name", 4), 0, send, "Hall")
+        await trio.sleep(10)
+        assert sent == []
+        assert hub.metrics.counters["commands_buffered"] == 2
+
+        await hub.receive_data()
+        await trio.sleep(1)
+        nursery.cancel_scope.cancel()
+
+    assert sent == ["Kitchen", "Hall"]
+
+
+@pytest.fixture
+def name_data():
+    return {"data": {"cmdId": Command.DEVICE_NAME_REPLY.value,
+                     "answer_content": "000340404040404040404b69746368656e24"}}
+
+
+async def test_unchanged_name_reply_is_not_set_again(hub, name_data):
+    data = {"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                     "device_name": "0101",
+                     "device_ID": 3,
+                     "device_status": "0464AA00"}}
+    hub.devices[3] = create_device_from_data(data)
+    await hub.handle_command(name_data)
+    await hub.handle_command(name_data)
+    assert hub.devices[3].name == "Kitchen"
+    assert hub.metrics.counters["names_unchanged"] == 1
+    assert [type(event).__name__ for event in hub.event_stream.since(0)] == ["DeviceNameChanged"]
+
+
+async def test_names_are_fetched_again_after_the_ttl(hub, autojump_clock):
+    assert hub.names_due()
+    await hub.handle_command({"data": {"cmdId": Command.DEVICE_NAME_REPLY.value, "answer_content": "NAME_OVER"}})
+    assert not hub.names_due()
+    await trio.sleep(hub.name_ttl)
+    assert hub.names_due()
+
+
+async def test_new_device_requests_the_names(hub, update_data):
+    hub.names_fetched_at = trio.current_time()
+    update_data["data"]["device_ID"] = 3
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(hub.process_device, update_data)
+        assert await hub.new_device_receive_ch.receive() == 3
+    assert hub.scheduler.queue_depth == 1
+
+
+async def test_new_devices_are_dropped_when_nobody_reads_the_channel(hub, update_data):
+    hub.new_device_send_ch, hub.new_device_receive_ch = anyio.create_memory_object_stream(1)
+    for device_id in (3, 4):
+        update_data["data"]["device_ID"] = device_id
+        with trio.fail_after(1):
+            await hub.process_device(update_data)
+    assert sorted(hub.devices) == [3, 4]
+    assert hub.metrics.counters["new_devices_dropped"] == 1
+
+
+async def test_status_updates_are_recorded_in_the_history(hub):
+    data = {"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                     "device_name": "0101",
+                     "device_ID": 3,
+                     "device_status": "0464AA00"}}
+    hub.devices[3] = create_device_from_data(data)
+    await hub.handle_command(data)
+    data["data"]["device_status"] = "03505500"
+    await hub.handle_command(data)
+    assert [(sample["state"], sample["battery"], sample["signal"]) for sample in hub.history.query(3)] == \
+           [("Closed", 100, 4), ("Open", 80, 3)]
+
+
+async def test_status_sweep_ends_the_status_poll(hub, autojump_clock):
+    await hub.poll_device_status()
+    await trio.sleep(0.5)
+    await hub.handle_command({"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                                       "device_ID": 65535,
+                                       "device_name": "STATUES",
+                                       "device_status": "OVER"}})
+    assert hub.watchdog.last_rtt == 0.5
+    assert hub.watchdog.state == "up"
+
+
+async def test_status_sweep_notifies_a_health_update(hub):
+    version = hub.health_updated.version
+    await hub.handle_command({"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                                       "device_ID": 65535,
+                                       "device_name": "STATUES",
+                                       "device_status": "OVER"}})
+    assert hub.health_updated.version == version + 1
+
+
+async def test_status_updates_cache_the_device_status(hub):
+    data = {"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                     "device_name": "0101",
+                     "device_ID": 3,
+                     "device_status": "0464AA00"}}
+    hub.devices[3] = create_device_from_data(data)
+    await hub.handle_command(data)
+    data["data"]["device_status"] = "03505500"
+    await hub.handle_command(data)
+    assert hub.device_statuses == {3: "03505500"}
+
+
+async def test_deleted_devices_leave_the_status_cache(hub):
+    data = {"data": {"cmdId": Command.DEVICE_STATUS_UPDATE.value,
+                     "device_name": "0101",
+                     "device_ID": 3,
+                     "device_status": "0464AA00"}}
+    hub.devices[3] = create_device_from_data(data)
+    await hub.handle_command(data)
+    hub.cache_status(5, "03505500")
+    data["data"]["device_name"] = "DEL"
+    await hub.handle_command(data)
+    assert hub.device_statuses == {5: "03505500"}
+    assert 3 not in hub.devices
+
+
+async def test_poll_device_status_sends_the_cached_statuses(hub):
+    hub.cache_status(3, "0464AA00")
+    hub.cache_status(5, "03505500")
+    await hub.poll_device_status()
+    expected = get_eq_crc({3: "0464AA00", 5: "03505500"})
+    message = json.loads(hub.sock.sendto.call_args[0][0])
+    assert message["params"]["data"] == {"cmdId": Command.SYN_DEVICE_STATUS.value, "device_status": expected}
+
+
+async def test_poll_device_status_without_statuses_asks_for_all_devices(hub):
+    await hub.poll_device_status()
+    message = json.loads(hub.sock.sendto.call_args[0][0])
+    assert message["params"]["data"] == {"cmdId": Command.SYN_DEVICE_STATUS.value, "device_status": ""}
+
+
+async def test_invalid_statuses_are_not_cached(hub):
+    hub.cache_status(3, "0464AA00")
+    hub.cache_status(3, "  42AA")
+    assert hub.device_statuses == {}
+
+
+async def test_device_names_register_no_status(hub):
+    await hub.handle_command({"data": {"cmdId": Command.DEVICE_NAME_REPLY.value,
+                                       "answer_content": "0003" + get_ascii("Kitchen")}})
+    assert hub.device_statuses == {}
+
+
+async def test_forget_device_drops_the_cached_status(hub):
+    hub.cache_status(3, "0464AA00")
+    hub.forget_device(3)
+    assert hub.device_statuses == {}
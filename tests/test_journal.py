@@ -0,0 +1,119 @@
+import anyio
+
+from elro.events import DeviceAlarm, DeviceUpdated, DeviceNameChanged, EventStream
+from elro.journal import AlarmJournal, INDEX
+
+
+def device_event(stream, event_type, device_id, state="NORMAL", **fields):
+    return stream.publish(event_type, device_id=device_id, device_type="FIRE_ALARM", name=f"Device {device_id}",
+                          state=state, battery=100, signal=4, **fields)
+
+
+def test_query_by_device_time_and_type(tmp_path):
+    journal = AlarmJournal(str(tmp_path))
+    stream = EventStream()
+    events = [device_event(stream, DeviceAlarm, 3, "ALARM"),
+              device_event(stream, DeviceUpdated, 3),
+              device_event(stream, DeviceAlarm, 4, "ALARM"),
+              device_event(stream, DeviceAlarm, 3, "ALARM")]
+    for event in events:
+        journal.append(event)
+    journal.close()
+
+    journal = AlarmJournal(str(tmp_path))
+    assert [record["sequence"] for record in journal.query()] == [1, 2, 3, 4]
+    assert [record["sequence"] for record in journal.query(device_id=3, event="DeviceAlarm")] == [1, 4]
+    assert [record["sequence"] for record in journal.query(since=events[1].timestamp,
+                                                           until=events[2].timestamp)] == [2, 3]
+    assert journal.query(since=events[3].timestamp + 1) == []
+    assert journal.query(device_id=5) == []
+    journal.close()
+
+
+def test_query_on_an_empty_journal(tmp_path):
+    journal = AlarmJournal(str(tmp_path))
+    assert journal.query() == []
+    journal.close()
+
+
+def test_a_torn_record_is_cut_off(tmp_path):
+    journal = AlarmJournal(str(tmp_path))
+    stream = EventStream()
+    journal.append(device_event(stream, DeviceAlarm, 3, "ALARM"))
+    journal.close()
+    size = (tmp_path / "journal.log").stat().st_size
+    with open(tmp_path / "journal.log", "ab") as log:
+        log.write(b"\x40\x00\x00\x00\x00\x00\x00\x00{\"sequ")
+
+    journal = AlarmJournal(str(tmp_path))
+    assert (tmp_path / "journal.log").stat().st_size == size
+    journal.append(device_event(stream, DeviceAlarm, 3, "ALARM"))
+    journal.close()
+
+    journal = AlarmJournal(str(tmp_path))
+    assert [record["sequence"] for record in journal.query(device_id=3)] == [1, 2]
+    journal.close()
+
+
+def test_a_lost_index_entry_is_recovered(tmp_path):
+    journal = AlarmJournal(str(tmp_path))
+    stream = EventStream()
+    for device_id in (3, 4):
+        journal.append(device_event(stream, DeviceAlarm, device_id, "ALARM"))
+    journal.close()
+    # A crash after writing the records, while writing the index
+    index = tmp_path / "journal.idx"
+    index.write_bytes(index.read_bytes()[:INDEX.size + 3])
+
+    journal = AlarmJournal(str(tmp_path))
+    assert index.stat().st_size == 2 * INDEX.size
+    assert [record["device_id"] for record in journal.query()] == [3, 4]
+    journal.close()
+
+
+async def test_record_events_journals_alarms_and_state_changes(tmp_path):
+    class FakeHub:
+        def __init__(self):
+            self.event_stream = EventStream()
+
+        def events(self):
+            return self.event_stream.subscribe()
+
+    hub = FakeHub()
+    journal = AlarmJournal(str(tmp_path))
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(journal.record_events, hub)
+        await anyio.sleep(0.01)
+        device_event(hub.event_stream, DeviceAlarm, 3, "ALARM")
+        device_event(hub.event_stream, DeviceNameChanged, 3, old_name="Old")
+        device_event(hub.event_stream, DeviceUpdated, 3)
+
+        with anyio.fail_after(5):
+            while len(journal.query()) < 2:
+                await anyio.sleep(0.01)
+        task_group.cancel_scope.cancel()
+
+    assert [record["event"] for record in journal.query()] == ["DeviceAlarm", "DeviceUpdated"]
+    journal.close()
+
+
+def test_a_read_only_query_keeps_a_record_that_is_being_written(tmp_path):
+    journal = AlarmJournal(str(tmp_path))
+    stream = EventStream()
+    journal.append(device_event(stream, DeviceAlarm, 3, "ALARM"))
+    journal.close()
+    # The bridge is writing the next record while the journal is queried
+    with open(tmp_path / "journal.log", "ab") as log:
+        log.write(b"\x40\x00\x00\x00\x00\x00\x00\x00{\"sequ")
+    size = (tmp_path / "journal.log").stat().st_size
+
+    reader = AlarmJournal(str(tmp_path), read_only=True)
+    assert [record["sequence"] for record in reader.query()] == [1]
+    reader.close()
+    assert (tmp_path / "journal.log").stat().st_size == size
+
+
+def test_a_read_only_query_on_a_missing_journal(tmp_path):
+    journal = AlarmJournal(str(tmp_path / "missing"), read_only=True)
+    assert journal.query() == []
+    assert not (tmp_path / "missing").exists()
@@ -0,0 +1,50 @@
+import socket
+
+import pytest
+
+from elro.command import Command
+from elro.loadgen import CommandLoadGenerator, LatencyTracker, parse_mix, percentiles
+
+
+def test_parse_mix():
+    assert parse_mix("state=9,name=1") == {"state": 9, "name": 1}
+    assert parse_mix("name") == {"name": 1}
+
+
+@pytest.mark.parametrize("text", ["scene=1", "state=0", "state=-1", "state=x"])
+def test_parse_mix_rejects_invalid_mixes(text):
+    with pytest.raises(ValueError):
+        parse_mix(text)
+
+
+def test_percentiles_in_milliseconds():
+    assert percentiles([0.001 * value for value in range(1, 101)]) == {"p50": 51.0, "p95": 96.0, "p99": 100.0,
+                                                                       "max": 100.0}
+    assert percentiles([])["p50"] is None
+
+
+async def test_latency_tracker_ends_the_coalesced_messages(autojump_clock):
+    tracker = LatencyTracker()
+    tracker.sent((Command.EQUIPMENT_CONTROL, 1))
+    tracker.sent((Command.EQUIPMENT_CONTROL, 1))
+    tracker.sent((Command.EQUIPMENT_CONTROL, 2))
+    tracker.received((Command.EQUIPMENT_CONTROL, 1))
+    assert len(tracker.latencies) == 2
+    assert tracker.waiting == 1
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def test_load_reaches_the_simulator():
+    generator = CommandLoadGenerator(devices=2, count=10, rate=0, mix={"state": 1, "name": 1}, port=free_port(),
+                                     seed=1)
+    report = await generator.run()
+    assert report["published"] == 10
+    assert report["delivered"] == 10
+    assert report["lost"] == 0
+    assert 0 < report["k1_commands"] <= 10
+    assert report["latency"]["max"] > 0
@@ -1,8 +1,18 @@
+import json
+
 from asynctest import CoroutineMock, MagicMock
 import asynctest
 import pytest
+import trio
+import trio.testing
 import elro.mqtt
+from elro.broadcast import Broadcast
 from elro.device import AlarmSensor, DeviceType
+from elro.hub import Hub
+from elro.metrics import Metrics
+from elro.policy import PublishPolicy
+from elro.scene import Scene
+from elro.telemetry import TelemetryAggregator
 
 
 @pytest.fixture
@@ -27,8 +37,9 @@ async def test_handle_device_alarm_sends_alarm_message(client, mock_device):
     mock_device.alarm.wait.assert_called_once()
     publisher = mock_open_client.return_value.__aenter__.return_value.publish
     publisher.assert_called_with('/test/elro/42',
-                                 b'{"name": "yoda", "device_name": "yoda", "id": "42", "type": "0101", "state": "Alarm", "battery": 100}',
-                                 1)
+                                 b'{"name": "yoda", "device_name": "yoda", "id": "42", "type": "0101", "type_name": "DOOR_WINDOW_SENSOR", "state": "", "battery": -1, "signal": -1}',
+                                 1,
+                                 retain=False)
 
 
 async def test_handle_device_update_sends_update_message(client, mock_device):
@@ -38,14 +49,263 @@ async def test_handle_device_update_sends_update_message(client, mock_device):
     mock_device.updated.wait.assert_called_once()
     publisher = mock_open_client.return_value.__aenter__.return_value.publish
     publisher.assert_called_with('/test/elro/42',
-                                 b'{"name": "yoda", "device_name": "yoda", "id": "42", "type": "0101", "state": "", "battery": -1}',
-                                 1)
+                                 b'{"name": "yoda", "device_name": "yoda", "id": "42", "type": "0101", "type_name": "DOOR_WINDOW_SENSOR", "state": "", "battery": -1, "signal": -1}',
+                                 1,
+                                 retain=False)
 
-async def test_handle_device_update_sends_update_message(client, mock_device):
+
+async def test_handle_device_update_sends_a_refresh_at_qos_0(client):
+    device = AlarmSensor("42", DeviceType.DOOR_WINDOW_SENSOR.value)
+    with asynctest.mock.patch("elro.mqtt.open_mqttclient") as mock_open_client:
+        mock_open_client.return_value.__aenter__.return_value.publish = CoroutineMock()
+        for battery_level in (100, 80):
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(client.handle_device_update, device)
+                await trio.testing.wait_all_tasks_blocked()
+                device.battery_level = battery_level
+    publisher = mock_open_client.return_value.__aenter__.return_value.publish
+    assert [call[0][2] for call in publisher.call_args_list] == [1, 0]
+    assert client.metrics.counters["published_state"] == 1
+    assert client.metrics.counters["published_refresh"] == 1
+
+
+async def test_handle_device_update_sends_a_rename_as_a_state_change(client):
+    device = AlarmSensor("42", DeviceType.DOOR_WINDOW_SENSOR.value)
+    with asynctest.mock.patch("elro.mqtt.open_mqttclient") as mock_open_client:
+        mock_open_client.return_value.__aenter__.return_value.publish = CoroutineMock()
+        for name in ("yoda", "luke"):
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(client.handle_device_update, device)
+                await trio.testing.wait_all_tasks_blocked()
+                device.name = name
+    publisher = mock_open_client.return_value.__aenter__.return_value.publish
+    assert [call[0][2] for call in publisher.call_args_list] == [1, 1]
+    assert client.metrics.counters["published_state"] == 2
+
+
+async def test_handle_device_update_aggregates_the_refreshes(client):
+    client.telemetry = TelemetryAggregator(battery_delta=5)
+    device = AlarmSensor("42", DeviceType.DOOR_WINDOW_SENSOR.value)
+    with asynctest.mock.patch("elro.mqtt.open_mqttclient") as mock_open_client:
+        mock_open_client.return_value.__aenter__.return_value.publish = CoroutineMock()
+        for battery_level in (100, 98, 90):
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(client.handle_device_update, device)
+                await trio.testing.wait_all_tasks_blocked()
+                device.battery_level = battery_level
+    publisher = mock_open_client.return_value.__aenter__.return_value.publish
+    assert [call[0][0] for call in publisher.call_args_list] == ['/test/elro/42', '/test/elro/42/telemetry']
+    assert publisher.call_args[0][1] == b'{"battery": 90, "signal": -1}'
+    assert client.metrics.counters["refresh_suppressed"] == 1
+
+
+async def test_handle_device_update_sends_a_rename_with_telemetry_as_a_state_change(client):
+    client.telemetry = TelemetryAggregator(battery_delta=5)
+    device = AlarmSensor("42", DeviceType.DOOR_WINDOW_SENSOR.value)
+    with asynctest.mock.patch("elro.mqtt.open_mqttclient") as mock_open_client:
+        mock_open_client.return_value.__aenter__.return_value.publish = CoroutineMock()
+        for name in ("yoda", "luke"):
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(client.handle_device_update, device)
+                await trio.testing.wait_all_tasks_blocked()
+                device.name = name
+    publisher = mock_open_client.return_value.__aenter__.return_value.publish
+    assert [call[0][0] for call in publisher.call_args_list] == ['/test/elro/42', '/test/elro/42']
+    assert json.loads(publisher.call_args[0][1])["name"] == "luke"
+    assert publisher.call_args[0][2] == 1
+    assert "refresh_suppressed" not in client.metrics.counters
+
+
+async def test_publish_telemetry_summaries(client):
+    client.telemetry = TelemetryAggregator(interval=0)
+    client.telemetry.observe(42, 100, 4)
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    await client.publish_telemetry_summaries(mqtt_client)
+    topic, payload, qos = mqtt_client.publish.call_args[0]
+    assert topic == '/test/elro/42/telemetry/summary'
+    assert json.loads(payload)["battery"] == {"min": 100, "max": 100, "last": 100}
+    assert qos == 0
+
+
+async def test_publish_drops_an_expired_message(client, autojump_clock):
+    async def slow_publish(*args, **kwargs):
+        await trio.sleep(120)
+
+    mqtt_client = MagicMock()
+    mqtt_client.publish = slow_publish
+    assert await client.publish(mqtt_client, "refresh", "/test/elro/42", b"{}") is False
+    assert client.metrics.counters["publish_expired"] == 1
+
+
+async def test_publish_uses_the_configured_policy():
+    client = elro.mqtt.MQTTPublisher("test", True, "/test", {"alarm": PublishPolicy(2, retain=True)})
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    assert await client.publish(mqtt_client, "alarm", "/test/elro/42", b"{}") is True
+    mqtt_client.publish.assert_awaited_once_with("/test/elro/42", b"{}", 2, retain=True)
+
+
+async def test_publish_availability_is_retained(client):
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    await client.publish_availability(mqtt_client, False)
+    mqtt_client.publish.assert_called_with('/test/elro/availability', b'offline', 1, retain=True)
+
+
+async def test_publish_metrics_publishes_the_hub_and_publisher_metrics(client):
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    hub = MagicMock()
+    hub.metrics = Metrics()
+    hub.metrics.increment("commands_expired")
+    hub.metrics.set_gauge("command_queue_depth", 2)
+    client.metrics.observe("command_latency.state", 0.5)
+    await client.publish_metrics(mqtt_client, hub)
+    topic, payload, qos = mqtt_client.publish.call_args[0]
+    assert (topic, qos, mqtt_client.publish.call_args[1]) == ('/test/elro/metrics', 1, {"retain": True})
+    metrics = json.loads(payload)
+    assert metrics["hub"]["counters"] == {"commands_expired": 1}
+    assert metrics["hub"]["gauges"] == {"command_queue_depth": 2}
+    assert metrics["publisher"]["timings"]["command_latency.state"]["last"] == 0.5
+
+
+async def test_handle_device_discovery_publishes_the_config(client, discovery_hub):
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    client.queue_discovery(discovery_hub.devices["42"])
+    await client.handle_device_discovery(mqtt_client, discovery_hub)
+    mqtt_client.publish.assert_called_with('homeassistant/sensor/elro_k1/42/config',
+                                           b'{"name": "elro_k1_42", "state_topic": "/test/elro/42", "value_template": "{{ value_json.state }}", "json_attributes_topic": "/test/elro/42", "availability_topic": "/test/elro/availability", "unique_id": "elro_k1_device_42"}',
+                                           1,
+                                           retain=True)
+
+
+async def test_handle_device_discovery_scopes_the_config_by_hub(discovery_hub):
+    client = elro.mqtt.MQTTPublisher("test", True, "/test", hub_id="ST_a1b2")
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    client.queue_discovery(discovery_hub.devices["42"])
+    await client.handle_device_discovery(mqtt_client, discovery_hub)
+    topic, payload = mqtt_client.publish.call_args[0][:2]
+    assert topic == 'homeassistant/sensor/elro_k1_ST_a1b2/42/config'
+    assert json.loads(payload)["unique_id"] == "elro_k1_ST_a1b2_device_42"
+
+
+async def test_connection_uses_the_shared_client(mock_device):
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    client = elro.mqtt.MQTTPublisher("test", True, "/test", client=mqtt_client)
+    with asynctest.mock.patch("elro.mqtt.open_mqttclient") as mock_open_client:
+        await client.handle_device_update(mock_device)
+    mock_open_client.assert_not_called()
+    mqtt_client.publish.assert_awaited_once()
+
+
+@pytest.fixture
+def discovery_hub():
+    hub = MagicMock()
+    hub.devices = {"42": AlarmSensor("42", DeviceType.CO_ALARM.value),
+                   "43": AlarmSensor("43", DeviceType.CO_ALARM.value)}
+    hub.synced = trio.Event()
+    return hub
+
+
+async def test_handle_device_discovery_publishes_a_batch(client, discovery_hub):
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    for device in discovery_hub.devices.values():
+        client.queue_discovery(device)
+    await client.handle_device_discovery(mqtt_client, discovery_hub)
+    assert mqtt_client.publish.await_count == 2
+
+
+async def test_handle_device_discovery_skips_unchanged_configs(client, discovery_hub):
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    device = discovery_hub.devices["42"]
+    client.discovery_published[client.discovery_topic("42")] = client.discovery_config(device)
+    client.queue_discovery(device)
+    await client.handle_device_discovery(mqtt_client, discovery_hub)
+    mqtt_client.publish.assert_not_awaited()
+    assert client.metrics.counters["discovery_skipped"] == 1
+
+
+async def test_remove_stale_discovery_clears_removed_devices(client, discovery_hub):
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    client.discovery_published[client.discovery_topic("42")] = "{}"
+    client.discovery_published[client.discovery_topic("7")] = "{}"
+    await client.remove_stale_discovery(mqtt_client, discovery_hub)
+    mqtt_client.publish.assert_awaited_once_with('homeassistant/sensor/elro_k1/7/config', b"", 1, retain=True)
+    assert list(client.discovery_published) == [client.discovery_topic("42")]
+
+
+async def test_discovery_removal_task_clears_the_config_of_a_removed_device(client):
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    hub = Hub("127.0.0.1", 1025, "ST_aaaaaaaaaaaa")
+    hub.devices[7] = AlarmSensor(7, DeviceType.CO_ALARM.value)
+    client.discovery_published[client.discovery_topic(7)] = "{}"
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(client.discovery_removal_task, mqtt_client, hub)
+        await trio.testing.wait_all_tasks_blocked()
+        hub.forget_device(7)
+        await trio.testing.wait_all_tasks_blocked()
+        nursery.cancel_scope.cancel()
+    hub.sock.close()
+    mqtt_client.publish.assert_awaited_once_with('homeassistant/sensor/elro_k1/7/config', b"", 1, retain=True)
+    assert client.discovery_published == {}
+
+
+async def test_handle_history_request_publishes_the_samples(client):
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    hub = MagicMock()
+    hub.history.query.return_value = [{"timestamp": 1.0, "state": "Normal", "battery": 100, "signal": 4}]
+    await client.handle_history_request(mqtt_client, hub, "/test/elro/42/history/get", '{"limit": 1}')
+    hub.history.query.assert_called_with(42, None, None, 1)
+    mqtt_client.publish.assert_called_with('/test/elro/42/history',
+                                           b'[{"timestamp": 1.0, "state": "Normal", "battery": 100, "signal": 4}]',
+                                           1,
+                                           retain=False)
+
+
+async def test_publish_command_result_publishes_the_bulk_result(client):
+    mqtt_client = MagicMock()
+    mqtt_client.publish = CoroutineMock()
+    command = client.router.route("/test/elro/0/set", '[{"id": 3, "remove": true}]')
+    result = {"succeeded": [], "failed": [{"operation": {"id": 3, "remove": True}, "error": "unknown"}]}
+    await client.publish_command_result(mqtt_client, command, result)
+    mqtt_client.publish.assert_awaited_once_with('/test/elro/0/bulk', json.dumps(result).encode('utf-8'), 1,
+                                                 retain=False)
+
+
+async def test_handle_scene_update_publishes_the_missed_updates(client):
+    hub = MagicMock()
+    hub.scenes_updated = Broadcast()
+    hub.scenes = {2: Scene(2, "Night")}
+    hub.scenes_updated.notify()  # an update while nothing was waiting
+    with asynctest.mock.patch("elro.mqtt.open_mqttclient") as mock_open_client:
+        mock_open_client.return_value.__aenter__.return_value.publish = CoroutineMock()
+        with trio.fail_after(1):
+            assert await client.handle_scene_update(hub, 0) == 1
+    publisher = mock_open_client.return_value.__aenter__.return_value.publish
+    publisher.assert_called_with('/test/elro/scenes', b'[' + Scene(2, "Night").json.encode('utf-8') + b']', 1,
+                                 retain=True)
+
+
+async def test_handle_health_update_publishes_the_missed_updates(client):
+    hub = MagicMock()
+    hub.health_updated = Broadcast()
+    hub.watchdog.summary.return_value = {"state": "degraded", "rtt": 250.0, "rtt_p50": 120.0, "rtt_p95": 250.0}
+    hub.health_updated.notify()  # an update while nothing was waiting
     with asynctest.mock.patch("elro.mqtt.open_mqttclient") as mock_open_client:
         mock_open_client.return_value.__aenter__.return_value.publish = CoroutineMock()
-        await client.handle_device_discovery(mock_device)
+        with trio.fail_after(1):
+            assert await client.handle_health_update(hub, 0) == 1
     publisher = mock_open_client.return_value.__aenter__.return_value.publish
-    publisher.assert_called_with('homeassistant/sensor/elro_k1/42',
-                                 b'{"name": "elro_k1_42", "state_topic": "test/elro/42", "value_template": "{{ value_json.state }}", "json_attributes_topic": "test/elro/42", "unique_id": "elro_k1_device_42"}',
-                                 1)
+    publisher.assert_called_with('/test/elro/health',
+                                 b'{"state": "degraded", "rtt": 250.0, "rtt_p50": 120.0, "rtt_p95": 250.0}',
+                                 1,
+                                 retain=True)
@@ -0,0 +1,15 @@
+import pytest
+
+from elro.policy import DEFAULT_POLICIES, PublishPolicy, parse_policy
+
+
+def test_parse_policy_keeps_the_defaults_that_are_left_out():
+    assert parse_policy("alarm:qos=2") == ("alarm", PublishPolicy(2, retain=False, expiry=None))
+    assert parse_policy("refresh:retain=true,expiry=0") == ("refresh", PublishPolicy(0, retain=True, expiry=None))
+    assert parse_policy("state") == ("state", DEFAULT_POLICIES["state"])
+
+
+@pytest.mark.parametrize("text", ["telemetry:qos=0", "alarm:qos=3", "alarm:retain=yes", "alarm:priority=1"])
+def test_parse_policy_rejects_invalid_policies(text):
+    with pytest.raises(ValueError):
+        parse_policy(text)
@@ -0,0 +1,185 @@
+import pytest
+import trio
+import trio.testing
+from asynctest import CoroutineMock, MagicMock
+
+from elro.metrics import Metrics
+from elro.router import CommandRouter, CommandDispatcher
+from elro.scene import Scene
+from elro.scheduler import CommandScheduler
+
+
+@pytest.fixture
+def router():
+    return CommandRouter("/test")
+
+
+@pytest.fixture
+def hub():
+    hub = MagicMock()
+    hub.set_device_name = CoroutineMock()
+    hub.set_device_state = CoroutineMock()
+    hub.permit_join_device = CoroutineMock()
+    hub.remove_device = CoroutineMock()
+    hub.scheduler = CommandScheduler(Metrics(), interval=0)
+    hub.devices = {3: MagicMock(), 4: MagicMock()}
+    return hub
+
+
+async def test_router_subscribes_under_the_base_topic(router):
+    assert router.subscription_topic == "/test/elro/+/set"
+
+
+async def test_router_ignores_topics_outside_the_base_topic(router):
+    assert router.route("/other/elro/3/set", '{"name": "Kitchen"}') is None
+
+
+async def test_router_ignores_non_integer_device_ids(router):
+    assert router.route("/test/elro/kitchen/set", '{"name": "Kitchen"}') is None
+
+
+async def test_router_ignores_invalid_json(router):
+    assert router.route("/test/elro/3/set", '{"name": ') is None
+
+
+async def test_router_routes_name_to_set_device_name(router, hub):
+    command = router.route("/test/elro/3/set", '{"name": "Kitchen"}')
+    scheduled = await command.execute(hub)
+    assert scheduled.function == hub.set_device_name
+    assert scheduled.args == (3, "Kitchen")
+
+
+async def test_router_does_not_route_name_for_the_hub(router):
+    assert router.route("/test/elro/0/set", '{"name": "Kitchen"}') is None
+
+
+async def test_router_routes_test_alarm_state(router, hub):
+    command = router.route("/test/elro/3/set", '{"state": "Test Alarm"}')
+    scheduled = await command.execute(hub)
+    assert scheduled.function == hub.set_device_state
+    assert scheduled.args == (3, "17")
+
+
+async def test_router_routes_permit_join_only_for_the_hub(router, hub):
+    assert router.route("/test/elro/3/set", '{"permit_join": true}') is None
+    command = router.route("/test/elro/0/set", '{"permit_join": true}')
+    scheduled = await command.execute(hub)
+    assert scheduled.function == hub.permit_join_device
+
+
+async def test_dispatcher_queues_commands_on_the_hub(router, hub):
+    async with trio.open_nursery() as nursery:
+        dispatcher = CommandDispatcher(nursery, hub, Metrics())
+        await dispatcher.dispatch(router.route("/test/elro/3/set", '{"name": "first"}'))
+        await dispatcher.dispatch(router.route("/test/elro/4/set", '{"name": "other"}'))
+        await trio.sleep(0.1)
+        nursery.cancel_scope.cancel()
+
+    assert hub.scheduler.queue_depth == 2
+
+
+async def test_dispatcher_keeps_order_per_device_and_records_latency(router, hub):
+    executed = []
+
+    async def set_device_name(device_id, name):
+        executed.append((device_id, name))
+
+    hub.set_device_name = set_device_name
+    metrics = Metrics()
+    async with trio.open_nursery() as nursery:
+        dispatcher = CommandDispatcher(nursery, hub, metrics)
+        await dispatcher.dispatch(router.route("/test/elro/3/set", '{"name": "first"}'))
+        await dispatcher.dispatch(router.route("/test/elro/4/set", '{"name": "other"}'))
+        await dispatcher.dispatch(router.route("/test/elro/3/set", '{"state": "test alarm"}'))
+        await trio.sleep(0.1)
+        nursery.start_soon(hub.scheduler.run)
+        await trio.sleep(0.1)
+        nursery.cancel_scope.cancel()
+
+    assert executed == [(3, "first"), (4, "other")]
+    assert metrics.snapshot()["timings"]["command_latency.name"]["count"] == 2
+    assert metrics.snapshot()["timings"]["command_latency.state"]["count"] == 1
+
+
+async def test_dispatcher_starts_no_worker_for_unknown_devices(router, hub):
+    metrics = Metrics()
+    async with trio.open_nursery() as nursery:
+        dispatcher = CommandDispatcher(nursery, hub, metrics)
+        await dispatcher.dispatch(router.route("/test/elro/999999/set", '{"name": "ghost"}'))
+        await dispatcher.dispatch(router.route("/test/elro/0/set", '{"permit_join": true}'))
+        await trio.sleep(0.1)
+        nursery.cancel_scope.cancel()
+
+    assert list(dispatcher.queues) == [0]
+    assert metrics.counters["unknown_device_commands"] == 1
+    assert hub.scheduler.queue_depth == 1
+
+
+async def test_router_routes_a_list_on_the_hub_topic_to_bulk_update(router, hub):
+    hub.bulk_update = CoroutineMock(return_value={"succeeded": [], "failed": []})
+    command = router.route("/test/elro/0/set", '[{"id": 3, "name": "Kitchen"}]')
+    await command.execute(hub)
+    hub.bulk_update.assert_awaited_once_with([{"id": 3, "name": "Kitchen"}])
+
+
+async def test_dispatcher_publishes_the_bulk_result(router, hub):
+    result = {"succeeded": [{"id": 3, "name": "Kitchen"}], "failed": []}
+    hub.bulk_update = CoroutineMock(return_value=result)
+    answers = []
+
+    async def respond(command, answer):
+        answers.append((command.route.key, answer))
+
+    async with trio.open_nursery() as nursery:
+        dispatcher = CommandDispatcher(nursery, hub, Metrics(), respond=respond)
+        await dispatcher.dispatch(router.route("/test/elro/0/set", '[{"id": 3, "name": "Kitchen"}]'))
+        await trio.sleep(0.1)
+        nursery.cancel_scope.cancel()
+
+    assert answers == [("bulk", result)]
+
+
+async def test_a_waiting_bulk_update_does_not_block_the_hub_commands(router, hub):
+    bulk_done = trio.Event()
+
+    async def bulk_update(operations):
+        await bulk_done.wait()  # e.g. while the K1 is not connected
+        return {"succeeded": operations, "failed": []}
+
+    hub.bulk_update = bulk_update
+    async with trio.open_nursery() as nursery:
+        dispatcher = CommandDispatcher(nursery, hub, Metrics(), queue_size=1)
+        await dispatcher.dispatch(router.route("/test/elro/0/set", '[{"id": 3, "name": "Kitchen"}]'))
+        with trio.fail_after(1):
+            for _ in range(3):
+                await dispatcher.dispatch(router.route("/test/elro/0/set", '{"permit_join": true}'))
+                await trio.testing.wait_all_tasks_blocked()
+        bulk_done.set()
+        nursery.cancel_scope.cancel()
+
+    assert hub.scheduler.queue_depth == 1
+
+
+async def test_dispatcher_drops_commands_when_the_queue_of_a_device_is_full(router, hub):
+    metrics = Metrics()
+    async with trio.open_nursery() as nursery:
+        dispatcher = CommandDispatcher(nursery, hub, metrics, queue_size=1)
+        with trio.fail_after(1):
+            for name in ("first", "second", "third"):
+                await dispatcher.dispatch(router.route("/test/elro/3/set", f'{{"name": "{name}"}}'))
+        nursery.cancel_scope.cancel()
+
+    assert metrics.counters["dropped_commands"] == 2
+
+
+async def test_router_does_not_route_a_list_on_a_device_topic(router):
+    assert router.route("/test/elro/3/set", '[{"id": 3, "name": "Kitchen"}]') is None
+
+
+async def test_router_routes_scene_by_name_to_trigger_scene(router, hub):
+    hub.scenes = {2: Scene(2, "Night")}
+    hub.scene_by_name = lambda name: hub.scenes[2] if name == "night" else None
+    command = router.route("/test/elro/0/set", '{"scene": "night"}')
+    scheduled = await command.execute(hub)
+    assert scheduled.function == hub.trigger_scene
+    assert scheduled.args == (2,)
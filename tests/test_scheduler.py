@@ -0,0 +1,168 @@
+import pytest
+import trio
+
+from elro.metrics import Metrics
+from elro.scheduler import CommandScheduler
+
+
+@pytest.fixture
+def scheduler():
+    return CommandScheduler(Metrics(), interval=0)
+
+
+async def run_scheduler(scheduler, duration=0.1):
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(scheduler.run)
+        await trio.sleep(duration)
+        nursery.cancel_scope.cancel()
+
+
+async def test_schedule_increases_the_queue_depth(scheduler):
+    async def send():
+        pass
+
+    scheduler.schedule(None, CommandScheduler.USER, send)
+    scheduler.schedule(None, CommandScheduler.POLL, send)
+    assert scheduler.queue_depth == 2
+    assert scheduler.metrics.gauges["command_queue_depth"] == 2
+
+
+async def test_commands_with_the_same_key_are_merged(scheduler):
+    sent = []
+
+    async def send(name):
+        sent.append(name)
+
+    scheduler.schedule(("name", 3), CommandScheduler.USER, send, "luke")
+    scheduler.schedule(("name", 3), CommandScheduler.USER, send, "leia")
+    await run_scheduler(scheduler)
+    assert sent == ["leia"]
+
+
+async def test_merged_commands_keep_the_order_they_were_issued_in(scheduler):
+    sent = []
+
+    async def send(name):
+        sent.append(name)
+
+    scheduler.schedule(("state", 3), CommandScheduler.USER, send, "luke")
+    scheduler.schedule(("state", 4), CommandScheduler.USER, send, "leia")
+    scheduler.schedule(("state", 3), CommandScheduler.USER, send, "han")
+    await run_scheduler(scheduler)
+    assert sent == ["leia", "han"]
+    assert scheduler.metrics.counters["commands_coalesced"] == 1
+
+
+async def test_user_commands_are_sent_before_polls(scheduler):
+    sent = []
+
+    async def send(name):
+        sent.append(name)
+
+    scheduler.schedule("poll", CommandScheduler.POLL, send, "poll")
+    scheduler.schedule(None, CommandScheduler.USER, send, "user")
+    await run_scheduler(scheduler)
+    assert sent == ["user", "poll"]
+
+
+async def test_commands_are_rate_limited(autojump_clock):
+    scheduler = CommandScheduler(Metrics(), interval=1)
+    sent = []
+
+    async def send(name):
+        sent.append(name)
+
+    for i in range(5):
+        scheduler.schedule(None, CommandScheduler.USER, send, i)
+    await run_scheduler(scheduler, 2.5)
+    assert sent == [0, 1, 2]
+    assert scheduler.queue_depth == 2
+
+
+async def test_submit_waits_until_the_command_is_sent(scheduler):
+    sent = []
+
+    async def send(name):
+        sent.append(name)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(scheduler.run)
+        await scheduler.submit(None, CommandScheduler.USER, send, "luke")
+        assert sent == ["luke"]
+        nursery.cancel_scope.cancel()
+
+
+async def test_paused_commands_are_buffered_and_sent_in_order_on_resume(scheduler):
+    sent = []
+
+    async def send(name):
+        sent.append(name)
+
+    scheduler.pause()
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(scheduler.run)
+        scheduler.schedule(("name", 3), CommandScheduler.USER, send, "luke")
+        scheduler.schedule(("name", 4), CommandScheduler.USER, send, "leia")
+        scheduler.schedule(("name", 3), CommandScheduler.USER, send, "han")
+        await trio.sleep(0.1)
+        assert sent == []
+        scheduler.resume()
+        await trio.sleep(0.1)
+        nursery.cancel_scope.cancel()
+
+    assert sent == ["leia", "han"]
+    assert scheduler.metrics.counters["commands_buffered"] == 2
+
+
+async def test_the_buffer_drops_the_oldest_command(scheduler):
+    scheduler.max_buffered = 2
+
+    async def send():
+        pass
+
+    scheduler.pause()
+    first = scheduler.schedule(None, CommandScheduler.USER, send)
+    poll = scheduler.schedule("poll", CommandScheduler.POLL, send)
+    last = scheduler.schedule(None, CommandScheduler.USER, send)
+    assert poll.expired and poll.done.is_set()
+    assert not first.expired and not last.expired
+    assert scheduler.queue_depth == 2
+    assert scheduler.metrics.counters["commands_dropped"] == 1
+
+
+async def test_expired_commands_are_not_sent(autojump_clock):
+    scheduler = CommandScheduler(Metrics(), interval=0, expiry=60)
+    sent = []
+
+    async def send(name):
+        sent.append(name)
+
+    scheduler.pause()
+    expired = scheduler.schedule(None, CommandScheduler.USER, send, "old")
+    await trio.sleep(50)
+    scheduler.schedule(None, CommandScheduler.USER, send, "new")
+    await trio.sleep(20)
+    scheduler.resume()
+    await run_scheduler(scheduler)
+
+    assert sent == ["new"]
+    assert expired.expired and expired.done.is_set()
+    assert scheduler.metrics.counters["commands_expired"] == 1
+
+
+async def test_buffered_commands_expire_while_paused(autojump_clock):
+    scheduler = CommandScheduler(Metrics(), interval=0, expiry=60)
+
+    async def send():
+        pass
+
+    scheduler.pause()
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(scheduler.run)
+        with trio.fail_after(61):
+            await scheduler.submit(None, CommandScheduler.USER, send)
+        nursery.cancel_scope.cancel()
+
+    assert scheduler.paused
+    assert scheduler.queue_depth == 0
+    assert scheduler.metrics.counters["commands_expired"] == 1
@@ -0,0 +1,127 @@
+import anyio
+
+from elro.hub import Hub
+from elro.simulator import K1Simulator, SimulatedDevice
+from elro.utils import get_eq_crc
+
+HUB_ID = "ST_aaaaaaaaaaaa"
+
+
+def simulator():
+    return K1Simulator(HUB_ID, {1: SimulatedDevice("0013", "Kitchen"),
+                                2: SimulatedDevice("0004", "Bathroom", "0464AA55")})
+
+
+async def test_hub_connects_and_syncs_with_simulator():
+    sim = simulator()
+    hub = Hub("127.0.0.1", sim.port, HUB_ID)
+    async with anyio.create_task_group() as task_group:
+        await task_group.start(sim.serve)
+        task_group.start_soon(hub.receiver_task)
+        task_group.start_soon(hub.connect)
+        with anyio.fail_after(5):
+            await hub.synced.wait()
+            # The first names can arrive before the devices are known, like on a real K1
+            while hub.devices[1].name != "Kitchen":
+                await hub.get_device_names()
+                await anyio.sleep(0.05)
+        task_group.cancel_scope.cancel()
+
+    assert hub.connected
+    assert sorted(hub.devices) == [1, 2]
+    assert hub.devices[2].name == "Bathroom"
+    assert sim.received["handshake"] >= 1
+    assert sim.received["SYN_DEVICE_STATUS"] == 1
+    assert sim.received["answer"] >= 4
+
+
+def test_simulator_only_reports_devices_with_another_status():
+    sim = simulator()
+    known = get_eq_crc({1: "0464AAFF", 2: "0464AA00"})
+    assert sim.changed_devices(known) == [2]
+    assert sim.changed_devices("") == [1, 2]
+    sim.sock.close()
+
+
+async def wait_for_sweep(hub, sim, sweeps):
+    # Every sweep ends with the STATUES datagram, which ends the status poll of the hub
+    while len(hub.metrics.timings.get("rtt.status", ())) < sweeps:
+        await anyio.sleep(0.01)
+
+
+async def test_status_polls_only_report_the_changed_devices():
+    sim = K1Simulator(HUB_ID, {device_id: SimulatedDevice("0013", f"Device {device_id}")
+                               for device_id in range(1, 21)})
+    hub = Hub("127.0.0.1", sim.port, HUB_ID)
+    async with anyio.create_task_group() as task_group:
+        await task_group.start(sim.serve)
+        task_group.start_soon(hub.receiver_task)
+        with anyio.fail_after(5):
+            await hub.connect()
+            await wait_for_sweep(hub, sim, 1)
+            first_sweep = sim.sent
+
+            await hub.poll_device_status()
+            await wait_for_sweep(hub, sim, 2)
+            unchanged_sweep = sim.sent - first_sweep
+
+            sim.devices[7].status = "0450AA00"
+            await hub.poll_device_status()
+            await wait_for_sweep(hub, sim, 3)
+            changed_sweep = sim.sent - first_sweep - unchanged_sweep
+        task_group.cancel_scope.cancel()
+
+    # The handshake reply, 20 statuses and the end of the sweep
+    assert first_sweep == 22
+    assert unchanged_sweep == 1
+    assert changed_sweep == 2
+    assert hub.device_statuses[7] == "0450AA00"
+    assert hub.devices[7].battery_level == 80
+
+
+async def test_hub_events_alone_follow_the_simulator():
+    sim = simulator()
+    hub = Hub("127.0.0.1", sim.port, HUB_ID)
+    events = []
+
+    async def read_events():
+        async for event in hub.events():
+            events.append(type(event).__name__)
+
+    # Only the typed events are read, like the library example in the README
+    async with anyio.create_task_group() as task_group:
+        await task_group.start(sim.serve)
+        task_group.start_soon(read_events)
+        task_group.start_soon(hub.receiver_task)
+        with anyio.fail_after(5):
+            await hub.connect()
+            await hub.synced.wait()
+        task_group.cancel_scope.cancel()
+
+    assert sorted(hub.devices) == [1, 2]
+    assert events[0] == "HubConnected"
+    assert events.count("DeviceAdded") == 2
+
+
+async def test_hub_removes_a_device_the_simulator_deleted():
+    sim = simulator()
+    hub = Hub("127.0.0.1", sim.port, HUB_ID)
+    async with anyio.create_task_group() as task_group:
+        await task_group.start(sim.serve)
+        task_group.start_soon(hub.receiver_task)
+        with anyio.fail_after(5):
+            await hub.connect()
+            await hub.synced.wait()
+            while hub.devices[1].name != "Kitchen":
+                await hub.get_device_names()
+                await anyio.sleep(0.05)
+            # The K1 reports the removal with a DEL status update, with the status and name caches filled
+            await hub.remove_device(2, True)
+            while 2 in sim.devices:
+                await anyio.sleep(0.01)
+            await hub.poll_device_status()
+            await wait_for_sweep(hub, sim, 2)
+        task_group.cancel_scope.cancel()
+
+    assert sorted(hub.devices) == [1]
+    assert 2 not in hub.device_names
@@ -0,0 +1,62 @@
+import json
+
+import anyio
+import pytest
+
+from elro.events import DeviceAlarm, EventStream
+from elro.mqtt import MQTTPublisher
+from elro.sink import EventSink, UnixSocketSink
+
+
+class FakeHub:
+    def __init__(self):
+        self.event_stream = EventStream()
+
+    def events(self):
+        return self.event_stream.subscribe()
+
+
+def publish_alarm(hub, device_id):
+    return hub.event_stream.publish(DeviceAlarm, device_id=device_id, device_type="FIRE_ALARM", name="Kitchen",
+                                    state="ALARM", battery=100, signal=4)
+
+
+def test_mqtt_publisher_is_an_event_sink():
+    assert isinstance(MQTTPublisher("test", False, "/test"), EventSink)
+
+
+async def test_unix_socket_sink_streams_line_json(tmp_path):
+    path = str(tmp_path / "elro.sock")
+    hub = FakeHub()
+    sink = UnixSocketSink(path)
+    async with anyio.create_task_group() as task_group:
+        await task_group.start(sink.handle_hub_events, hub)
+        async with await anyio.connect_unix(path) as stream:
+            with anyio.fail_after(5):
+                while not sink.clients:
+                    await anyio.sleep(0.01)
+            publish_alarm(hub, 3)
+            publish_alarm(hub, 4)
+            received = b""
+            with anyio.fail_after(5):
+                while received.count(b"\n") < 2:
+                    received += await stream.receive()
+        task_group.cancel_scope.cancel()
+
+    lines = [json.loads(line) for line in received.splitlines()]
+    assert [(line["event"], line["device_id"]) for line in lines] == [("DeviceAlarm", 3), ("DeviceAlarm", 4)]
+    assert sink.delivered == 2
+
+
+def test_broadcast_disconnects_a_client_that_is_behind():
+    sink = UnixSocketSink("unused.sock", queue_size=1)
+    send_ch, receive_ch = anyio.create_memory_object_stream(1)
+    sink.clients.add(send_ch)
+    hub = FakeHub()
+    sink.broadcast(publish_alarm(hub, 3))
+    sink.broadcast(publish_alarm(hub, 4))
+    assert sink.clients == set()
+    assert sink.dropped == 1
+    with pytest.raises(anyio.EndOfStream):
+        receive_ch.receive_nowait()
+        receive_ch.receive_nowait()
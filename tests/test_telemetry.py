@@ -0,0 +1,27 @@
+from elro.telemetry import TelemetryAggregator
+
+
+def test_observe_reports_only_meaningful_changes():
+    telemetry = TelemetryAggregator(battery_delta=5, signal_delta=1)
+    assert telemetry.observe(3, 100, 4) is True
+    assert telemetry.observe(3, 98, 4) is False
+    assert telemetry.observe(3, 96, 4) is False
+    assert telemetry.observe(3, 95, 4) is True
+    assert telemetry.observe(3, 95, 3) is True
+    assert telemetry.observe(4, 50, 2) is True
+
+
+def test_summary_of_a_window():
+    telemetry = TelemetryAggregator(interval=3600)
+    for battery, signal in ((100, 4), (90, 2), (95, 3)):
+        telemetry.observe(3, battery, signal)
+    started = telemetry.windows[3].started
+
+    assert telemetry.due(started + 3599) == []
+    assert telemetry.due(started + 3600) == [3]
+    assert telemetry.summarize(3, started + 3600) == {"since": started,
+                                                      "until": started + 3600,
+                                                      "samples": 3,
+                                                      "battery": {"min": 90, "max": 100, "last": 95},
+                                                      "signal": {"min": 2, "max": 4, "last": 3}}
+    assert telemetry.due(started + 7200) == []
@@ -0,0 +1,39 @@
+import socket
+
+import anyio
+import pytest
+
+from elro.transport import UDPTransport
+
+
+async def roundtrip():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.setblocking(False)
+    port = server.getsockname()[1]
+
+    transport = UDPTransport()
+    await transport.sendto(b"IOT_KEY?ST_aaaaaaaaaaaa", ("localhost", port))
+    await anyio.wait_readable(server)
+    data, address = server.recvfrom(4096)
+    server.sendto(b"NAME:ST_aaaaaaaaaaaa", address)
+    reply = await transport.recv(4096)
+
+    transport.close()
+    server.close()
+    return data, reply
+
+
+@pytest.mark.parametrize("backend", ["trio", "asyncio"])
+def test_transport_sends_and_receives_on_every_backend(backend):
+    data, reply = anyio.run(roundtrip, backend=backend)
+    assert data == b"IOT_KEY?ST_aaaaaaaaaaaa"
+    assert reply == b"NAME:ST_aaaaaaaaaaaa"
+
+
+async def test_transport_resolves_a_hostname_once():
+    transport = UDPTransport()
+    first = await transport.resolve(("localhost", 1025))
+    assert first == ("127.0.0.1", 1025)
+    assert transport._addresses == {("localhost", 1025): first}
+    transport.close()
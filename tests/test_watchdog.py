@@ -0,0 +1,41 @@
+import trio
+
+from elro.metrics import Metrics
+from elro.watchdog import Watchdog
+
+
+async def test_watchdog_measures_the_round_trip_time(autojump_clock):
+    watchdog = Watchdog(Metrics())
+    watchdog.sent(Watchdog.STATUS)
+    await trio.sleep(0.25)
+    watchdog.replied(Watchdog.STATUS)
+    assert watchdog.last_rtt == 0.25
+    assert watchdog.metrics.timings["rtt.status"][0] == 0.25
+    assert watchdog.summary() == {"state": "up", "rtt": 250.0, "rtt_p50": 250.0, "rtt_p95": 250.0}
+
+
+async def test_watchdog_keeps_the_first_timestamp_of_a_poll(autojump_clock):
+    watchdog = Watchdog(Metrics())
+    watchdog.sent(Watchdog.NAMES)
+    await trio.sleep(1)
+    watchdog.sent(Watchdog.NAMES)
+    await trio.sleep(1)
+    watchdog.replied(Watchdog.NAMES)
+    assert watchdog.last_rtt == 2
+
+
+async def test_watchdog_flags_degraded_and_down_when_replies_stop(autojump_clock):
+    watchdog = Watchdog(Metrics(), degraded_after=5, down_after=30)
+    watchdog.sent(Watchdog.STATUS)
+    assert watchdog.check() is False
+    await trio.sleep(5)
+    assert watchdog.check() is True
+    assert watchdog.state == Watchdog.DEGRADED
+    await trio.sleep(25)
+    assert watchdog.check() is True
+    assert watchdog.state == Watchdog.DOWN
+    assert watchdog.metrics.gauges["hub_health"] == 2
+
+    watchdog.replied(Watchdog.STATUS)
+    assert watchdog.state == Watchdog.UP
+    assert watchdog.metrics.counters["hub_down"] == 1